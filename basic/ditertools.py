@@ -18,6 +18,14 @@ def chunks(csize: int, seq: Sequence[T]) -> Iterator[Sequence[T]]:
         yield seq[i: i + csize]
 
 
+def ichunks(csize: int, iterable: Iterable[T]) -> Iterator[Sequence[T]]:
+    it = iter(iterable)
+    chunk = list(islice(it, csize))
+    while chunk:
+        yield chunk
+        chunk = list(islice(it, csize))
+
+
 def icount(f: Callable[[T], bool], iterable: Iterable[T]) -> int:
     count_ = 0
     for item in iterable:
@@ -1,4 +1,5 @@
 id = lambda x: x
+noop = lambda *args: None
 
 # math
 add2 = lambda x, y: x + y
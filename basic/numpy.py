@@ -5,3 +5,25 @@ from typing import Dict
 def histogram(a: np.ndarray) -> Dict[int, int]:
     unique, counts = np.unique(a, return_counts=True)
     return dict(zip(unique, counts))
+
+
+# Odd 64-bit multiplier for polynomial id combination (from splitmix64)
+_combine_multiplier = np.uint64(0x9E3779B97F4A7C15)
+
+
+def combine_ids(ids: np.ndarray, n: int) -> np.ndarray:
+    """
+    Ids of all n-long windows of ids, as the polynomial
+    ids[i] * M^(n-1) + ... + ids[i+n-1] modulo 2^64, computed with one
+    vectorized pass per window offset. Returns an empty array if there are
+    fewer than n ids.
+    """
+    ids = np.asarray(ids, dtype=np.uint64)
+    nr_windows = len(ids) - n + 1
+    if nr_windows <= 0:
+        return np.empty(0, dtype=np.uint64)
+    combined = ids[:nr_windows].copy()
+    for offset in range(1, n):
+        combined *= _combine_multiplier
+        combined += ids[offset:offset + nr_windows]
+    return combined
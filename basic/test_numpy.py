@@ -0,0 +1,41 @@
+import random
+import unittest
+
+import numpy as np
+
+from basic.numpy import combine_ids
+
+multiplier = 0x9E3779B97F4A7C15
+
+
+def combined_id(ids: list) -> int:
+    combined = 0
+    for id_ in ids:
+        combined = (combined * multiplier + id_) % 2 ** 64
+    return combined
+
+
+class CombineIdsTest(unittest.TestCase):
+    def test_matches_polynomial(self):
+        rnd = random.Random(0)
+        ids = [rnd.randrange(2 ** 64) for _ in range(20)]
+        for n in [1, 2, 3, 5]:
+            np.testing.assert_array_equal(
+                combine_ids(np.array(ids, dtype=np.uint64), n),
+                np.array([combined_id(ids[i:i + n])
+                          for i in range(len(ids) - n + 1)],
+                         dtype=np.uint64))
+
+    def test_order_matters(self):
+        self.assertNotEqual(combine_ids([1, 2], 2)[0],
+                            combine_ids([2, 1], 2)[0])
+
+    def test_fewer_ids_than_n(self):
+        for ids in [[], [7], [7, 8]]:
+            combined = combine_ids(ids, 3)
+            self.assertEqual(len(combined), 0)
+            self.assertEqual(combined.dtype, np.uint64)
+
+
+if __name__ == '__main__':
+    unittest.main()
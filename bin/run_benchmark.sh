@@ -0,0 +1,8 @@
+#!/usr/bin/env bash
+
+PD=resources/pipeline
+
+python -m tokenization.benchmark \
+       --nr_tweets 20000 \
+       --seed 0 \
+       --history_file ${PD}/stats/tokenizer_benchmark.json
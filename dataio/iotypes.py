@@ -1,9 +1,16 @@
+import re
 from itertools import takewhile
 from nltk.util import ngrams as nltk_util_ngrams
-from typing import Iterable, TypeVar, Iterator, Sequence
+from typing import Iterable, TypeVar, Iterator, List, Sequence
+
+import numpy as np
 
 import basic
+from basic.numpy import combine_ids
 from tokenization import tokens, tokenizers
+from tokenization import compact
+from tokenization.compact import (
+    STABLE_ID_DTYPE, StringTable, TokenTable, lower_stable_id, stable_id)
 
 T = TypeVar('T', covariant=True)
 
@@ -24,12 +31,76 @@ class TokenizerError(TypeError):
         self.msg = msg
 
 
+class StopwordFilter:
+    """
+    Drops literal stopwords, looked up in a frozen set, and tokens matching
+    any of the stopword regexes, combined into a single pattern. Tokens are
+    compared by their text only, whatever their token type.
+    """
+
+    def __init__(self, stopwords: Iterable[str] = (),
+                 regex_stopwords: Iterable = (), case_sensitive: bool = True):
+        if not case_sensitive:
+            stopwords = map(lambda sw: sw.lower(), stopwords)
+        self._stopwords = frozenset(map(str.__str__, stopwords))
+        regexes = []
+        for regex in regex_stopwords:
+            if isinstance(regex, str):
+                regexes.append('(?:{})'.format(regex))
+            elif regex.flags & re.IGNORECASE:
+                regexes.append('(?i:{})'.format(regex.pattern))
+            else:
+                regexes.append('(?:{})'.format(regex.pattern))
+        self._regex = None
+        if len(regexes) > 0:
+            self._regex = re.compile('|'.join(regexes))
+
+    def keep(self, token: str) -> bool:
+        text = str.__str__(token)
+        if text in self._stopwords:
+            return False
+        return self._regex is None or self._regex.search(text) is None
+
+    def __call__(self, tokens_: Iterable[str]) -> list:
+        return [token for token in tokens_ if self.keep(token)]
+
+    def mask(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Batch version of keep, over a whole array of token texts. Each
+        distinct text is only tested once.
+        """
+        distinct_keep = {}
+        mask = np.empty(len(texts), dtype=bool)
+        for idx, text in enumerate(texts):
+            keep = distinct_keep.get(text)
+            if keep is None:
+                keep = distinct_keep[text] = self.keep(text)
+            mask[idx] = keep
+        return mask
+
+    def filter_table(self, table: TokenTable) -> TokenTable:
+        """
+        Batch version of __call__ for a compact TokenTable, testing each
+        distinct string id once and without materializing tokens.
+        """
+        unique_ids, inverse = np.unique(table.string_ids, return_inverse=True)
+        strings = table.strings
+        unique_keep = self.mask([strings[string_id]
+                                 for string_id in unique_ids.tolist()])
+        mask = unique_keep[inverse]
+        return TokenTable(table.string_ids[mask], table.type_codes[mask],
+                          strings)
+
+
 class NGrams(Sequence[T]):
     def __init__(self, unigrams=None):
         if unigrams is None:
             unigrams = []
         self._ngrams = {1: unigrams}
         self._unigrams = unigrams
+        self._table = unigrams if isinstance(unigrams, TokenTable) else None
+        self._ngram_ids = {}
+        self._ngram_sets = {}
 
     def __iter__(self) -> Iterator[T]:
         return iter(self._ngrams[1])
@@ -46,6 +117,24 @@ class NGrams(Sequence[T]):
     def __repr__(self):
         return repr(self._unigrams)
 
+    def is_compact(self) -> bool:
+        return self._table is self._unigrams
+
+    def table(self, strings: StringTable = None) -> TokenTable:
+        """
+        The unigrams as a compact TokenTable. NGrams built from a TokenTable
+        return it as is; otherwise it is built once, on first call.
+        """
+        if self._table is None:
+            self._table = TokenTable.from_tokens(self._unigrams, strings)
+        return self._table
+
+    def type_codes(self) -> np.ndarray:
+        return compact.type_codes(self._unigrams)
+
+    def texts(self) -> List[str]:
+        return compact.texts(self._unigrams)
+
     def has_valid_tail(self, allowed_tail, case_sensitive=True):
         tail = takewhile(lambda tok: isinstance(tok, tokens.UrlToken) or
                                      isinstance(tok, tokens.HashtagToken),
@@ -58,24 +147,53 @@ class NGrams(Sequence[T]):
     def ngrams(self, n):
         stored_ngrams = self._ngrams.get(n)
         if stored_ngrams is None:
-            stored_ngrams = nltk_util_ngrams(self, n)
-            self._ngrams[n] = list(stored_ngrams)
+            stored_ngrams = list(nltk_util_ngrams(self._unigrams, n))
+            self._ngrams[n] = stored_ngrams
         return stored_ngrams
 
-    def contains_ngram(self, ngram):
+    def ngram_ids(self, n: int, case_sensitive: bool = True) -> np.ndarray:
+        """
+        Ids of the n-grams, in order: the stable ids of the unigram texts
+        (see tokenization.compact.stable_id) for n = 1, combined over every
+        window of n unigrams by basic.numpy.combine_ids for n > 1. Unlike
+        ngrams, tokens are compared by their text only, lowercased unless
+        case_sensitive.
+        """
+        stored_ids = self._ngram_ids.get((n, case_sensitive))
+        if stored_ids is None:
+            if n == 1:
+                to_id = stable_id if case_sensitive else lower_stable_id
+                stored_ids = np.fromiter(map(to_id, self.texts()),
+                                         dtype=STABLE_ID_DTYPE,
+                                         count=len(self._unigrams))
+            else:
+                stored_ids = combine_ids(
+                    self.ngram_ids(1, case_sensitive), n)
+            self._ngram_ids[(n, case_sensitive)] = stored_ids
+        return stored_ids
+
+    def contains_ngram(self, ngram) -> bool:
+        """
+        Whether the tuple of tokens ngram is one of the n-grams. Like in
+        ngrams, tokens are compared with their type. The n-grams of each n
+        are put in a set on first call.
+        """
+        ngram = tuple(ngram)
         n = len(ngram)
-        return ngram in self.ngrams(n)
+        ngram_set = self._ngram_sets.get(n)
+        if ngram_set is None:
+            if n == 1:
+                ngram_set = frozenset((unigram,) for unigram in self._unigrams)
+            else:
+                ngram_set = frozenset(self.ngrams(n))
+            self._ngram_sets[n] = ngram_set
+        return ngram in ngram_set
 
     @staticmethod
-    def from_string(s, tokenizer, case_sensitive, stopwords, regex_stopwords):
+    def from_string(s, tokenizer, case_sensitive, stopword_filter):
         if not case_sensitive:
             s = s.lower()
-            stopwords = map(lambda sw: sw.lower(), stopwords)
-        tokens = filter(lambda tok: tok not in stopwords and
-                                    all(regex.search(tok) is None
-                                        for regex in regex_stopwords),
-                        tokenizer.tokenize(s))
-        tokens = list(tokens)
+        tokens = stopword_filter(tokenizer.tokenize(s))
         if len(tokens) == 0:
             raise TokenizerError('cannot build NGrams from ' + s)
         return NGrams(tokens)
@@ -89,8 +207,38 @@ class NGrams(Sequence[T]):
             stopwords = tokenizers.generic_stopwords
         if regex_stopwords is None:
             regex_stopwords = tokenizers.regex_stopwords
+        stopword_filter = StopwordFilter(
+            stopwords, regex_stopwords, case_sensitive)
         return lambda s: NGrams.from_string(
-            s, tokenizer, case_sensitive, stopwords, regex_stopwords)
+            s, tokenizer, case_sensitive, stopword_filter)
+
+
+class LazyNGrams(NGrams[T]):
+    """
+    NGrams of a raw string that is only tokenized, by builder, the first time
+    the unigrams are needed. Until then, holding one costs nothing more than
+    the string, so cheap filters can drop it before any tokenizer work.
+    A TokenizerError from builder is raised on that first access.
+    """
+
+    _deferred = frozenset(['_ngrams', '_unigrams', '_table', '_ngram_ids',
+                           '_ngram_sets'])
+
+    def __init__(self, s: str, builder):
+        self._s = s
+        self._builder = builder
+
+    def __getattr__(self, name):
+        if name not in LazyNGrams._deferred:
+            raise AttributeError(name)
+        self.__dict__.update(vars(self._builder(self._s)))
+        return self.__dict__[name]
+
+    def raw(self) -> str:
+        return self._s
+
+    def is_built(self) -> bool:
+        return '_unigrams' in self.__dict__
 
 
 SvNgrams = NGrams.get_builder()
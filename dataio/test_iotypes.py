@@ -0,0 +1,121 @@
+import re
+import unittest
+
+import numpy as np
+
+from basic.numpy import combine_ids
+from dataio import iotypes
+from tokenization import tokenizers, tokens
+from tokenization.compact import TokenTable, stable_id
+
+
+def typed(tokens_) -> list:
+    return [(type(token), str.__str__(token)) for token in tokens_]
+
+
+def texts(tokens_) -> list:
+    return [str.__str__(token) for token in tokens_]
+
+
+class StopwordFilterTest(unittest.TestCase):
+    def test_default_stopwords(self):
+        ngrams = iotypes.SvNgrams('null what a day null http://t.co/x')
+        self.assertEqual(texts(ngrams), ['what', 'a', 'day'])
+        self.assertEqual(texts(iotypes.SvNgrams('NULL day')), ['NULL', 'day'])
+        lower = iotypes.NGrams.get_builder(case_sensitive=False)
+        self.assertEqual(texts(lower('NULL Day')), ['day'])
+
+    def test_regex_flags(self):
+        stopword_filter = iotypes.StopwordFilter(
+            ['', 'null'], ['^x', re.compile('^y'),
+                           re.compile('^z', re.IGNORECASE)])
+        words = ['', 'null', 'Null', 'xa', 'Xa', 'ya', 'Ya', 'za', 'Za', 'a']
+        self.assertEqual(stopword_filter(words),
+                         ['Null', 'Xa', 'Ya', 'a'])
+        self.assertEqual(stopword_filter([tokens.HashtagToken('null'),
+                                          tokens.WordToken('null')]), [])
+        np.testing.assert_array_equal(
+            stopword_filter.mask(words),
+            [word in ['Null', 'Xa', 'Ya', 'a'] for word in words])
+
+    def test_filter_table(self):
+        stopword_filter = iotypes.StopwordFilter(
+            ['null'], tokenizers.regex_stopwords)
+        unigrams = iotypes.SvNgrams('a null http://t.co/x b #null')
+        unfiltered = [tokens.WordToken('null'),
+                      tokens.UrlToken('http://t.co/x')] + list(unigrams)
+        table = stopword_filter.filter_table(
+            TokenTable.from_tokens(unfiltered))
+        self.assertEqual(typed(table), typed(stopword_filter(unfiltered)))
+
+
+class LazyNGramsTest(unittest.TestCase):
+    def test_tokenizes_on_first_use(self):
+        calls = []
+
+        def builder(s):
+            calls.append(s)
+            return iotypes.SvNgrams(s)
+
+        ngrams = iotypes.LazyNGrams('what a great day', builder)
+        self.assertFalse(ngrams.is_built())
+        self.assertEqual(ngrams.raw(), 'what a great day')
+        self.assertEqual(calls, [])
+        self.assertEqual(len(ngrams), 4)
+        self.assertTrue(ngrams.is_built())
+        self.assertEqual(texts(ngrams.ngrams(2)[0]), ['what', 'a'])
+        self.assertEqual(calls, ['what a great day'])
+
+    def test_error_on_first_use(self):
+        ngrams = iotypes.LazyNGrams('null', iotypes.SvNgrams)
+        with self.assertRaises(iotypes.TokenizerError):
+            len(ngrams)
+        with self.assertRaises(AttributeError):
+            ngrams.no_such_attribute
+
+
+class NGramsTest(unittest.TestCase):
+    def setUp(self):
+        self.unigrams = [tokens.WordToken('Oh'), tokens.WordToken('great'),
+                         tokens.HashtagToken('#monday'),
+                         tokens.WordToken('great')]
+
+    def test_ngram_ids(self):
+        for unigrams in [self.unigrams, TokenTable.from_tokens(self.unigrams)]:
+            ngrams = iotypes.NGrams(unigrams)
+            text_ids = [stable_id(str.__str__(unigram))
+                        for unigram in self.unigrams]
+            np.testing.assert_array_equal(ngrams.ngram_ids(1), text_ids)
+            for n in [2, 3]:
+                np.testing.assert_array_equal(ngrams.ngram_ids(n),
+                                              combine_ids(text_ids, n))
+            self.assertEqual(len(ngrams.ngram_ids(5)), 0)
+            # The same text has the same id, whatever its position
+            ids = ngrams.ngram_ids(1)
+            self.assertEqual(ids[1], ids[3])
+
+    def test_case_insensitive_ngram_ids(self):
+        ngrams = iotypes.NGrams(self.unigrams)
+        lower = iotypes.NGrams([tokens.WordToken(str.lower(unigram))
+                                for unigram in self.unigrams])
+        np.testing.assert_array_equal(
+            ngrams.ngram_ids(2, case_sensitive=False), lower.ngram_ids(2))
+        self.assertNotEqual(ngrams.ngram_ids(1)[0], lower.ngram_ids(1)[0])
+
+    def test_contains_ngram_compares_types(self):
+        for unigrams in [self.unigrams, TokenTable.from_tokens(self.unigrams)]:
+            ngrams = iotypes.NGrams(unigrams)
+            self.assertTrue(ngrams.contains_ngram(
+                (tokens.HashtagToken('#monday'),)))
+            self.assertTrue(ngrams.contains_ngram(
+                (tokens.WordToken('great'), tokens.HashtagToken('#monday'))))
+            self.assertFalse(ngrams.contains_ngram(
+                (tokens.WordToken('#monday'),)))
+            self.assertFalse(ngrams.contains_ngram(
+                (tokens.WordToken('great'), tokens.WordToken('#monday'))))
+            self.assertFalse(ngrams.contains_ngram(
+                (tokens.HashtagToken('#monday'), tokens.WordToken('Oh'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,9 @@
-from itertools import count
 import numpy as np
-from typing import Callable, Any, TypeVar, Sequence
+from operator import itemgetter
+from typing import Callable, Any, TypeVar, Sequence, Tuple
 
-from ml.feature_extractors.feature_extractor import FeatureExtractor
+from ml.feature_extractors.feature_extractor import (
+    FeatureExtractor, TokenBatch, ragged_rows, token_texts, token_type_codes)
 from tokenization import tokens
 
 TweetT = TypeVar('TweetT')
@@ -16,6 +17,19 @@ def has_all_caps(w):
     return len(w) > 0 and w.isupper()
 
 
+def caps_masks(texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    has_initial_cap and has_all_caps of each of texts, as boolean masks,
+    without a Python call per text.
+    """
+    initial_caps = np.fromiter(
+        map(str.isupper, map(itemgetter(slice(0, 1)), texts)),
+        dtype=bool, count=len(texts))
+    all_caps = np.fromiter(map(str.isupper, texts), dtype=bool,
+                           count=len(texts))
+    return initial_caps, all_caps
+
+
 class CapitalizationFeatureExtractor(
         FeatureExtractor[TweetT, Sequence[tokens.Token], np.ndarray]):
     """
@@ -28,19 +42,37 @@ class CapitalizationFeatureExtractor(
 
     def __init__(self,
                  data_extractor: Callable[[TweetT], Sequence[tokens.Token]]):
-        self._token_type_to_index = dict(zip(tokens.all_token_types, count()))
+        self._nr_types = len(tokens.all_token_types)
         super().__init__(data_extractor)
 
-    def _extract(self, tokens: Sequence[tokens.Token]):
-        nr_words_initial_caps = 0
-        nr_words_all_caps = 0
-        nr_capital_pos = np.zeros(len(self._token_type_to_index))
-        for token in tokens:
-            if has_initial_cap(token):
-                nr_words_initial_caps += 1
-                type_index = self._token_type_to_index[type(token)]
-                nr_capital_pos[type_index] += 1
-            if has_all_caps(token):
-                nr_words_all_caps += 1
-        return np.concatenate((nr_capital_pos,
-                               [nr_words_initial_caps, nr_words_all_caps]))
+    def dim(self) -> int:
+        return self._nr_types + 2
+
+    def _extract_into(self, tokens: Sequence[tokens.Token], out: np.ndarray):
+        self.extract_codes(np.array([len(tokens)]), token_type_codes(tokens),
+                           *caps_masks(token_texts(tokens)), out[np.newaxis])
+
+    def _extract_token_batch(self, batch: TokenBatch, out: np.ndarray):
+        self.extract_codes(batch.lengths, batch.type_codes,
+                           *caps_masks(batch.texts), out)
+
+    def extract_codes(self, lengths: np.ndarray, codes: np.ndarray,
+                      initial_caps: np.ndarray, all_caps: np.ndarray,
+                      out: np.ndarray = None) -> np.ndarray:
+        """
+        Features of a ragged batch of tweets: the number of tokens of each,
+        and the token type codes and caps_masks of all of them, concatenated
+        tweet by tweet.
+        """
+        nr_tweets = len(lengths)
+        nr_types = self._nr_types
+        if out is None:
+            out = np.zeros((nr_tweets, self.dim()))
+        rows = ragged_rows(lengths)
+        nr_capital_pos = np.bincount(
+            rows[initial_caps] * nr_types + codes[initial_caps],
+            minlength=nr_tweets * nr_types)
+        out[:, :nr_types] = nr_capital_pos.reshape(nr_tweets, nr_types)
+        out[:, -2] = np.bincount(rows[initial_caps], minlength=nr_tweets)
+        out[:, -1] = np.bincount(rows[all_caps], minlength=nr_tweets)
+        return out
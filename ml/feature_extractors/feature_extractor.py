@@ -1,16 +1,311 @@
-from typing import TypeVar, Callable, Generic
+import hashlib
+import numpy as np
+import scipy.sparse
+from itertools import chain
+from typing import (
+    Any, TypeVar, Callable, Generic, Iterable, List, Optional, Sequence,
+    Sized, Tuple, Union)
+
+from dataio import iotypes
+from tokenization import compact, tokens
 
 PointT = TypeVar('PointT')
 RelevantPointT = TypeVar('RelevantPointT', covariant=True)
 FeatureT = TypeVar('FeatureT')
+TokenPass = Tuple[Iterable, Callable[[Any], None], Callable[[], None]]
+
+
+class TokenBatch:
+    """
+    Ragged batch of the token sequences of several rows, eg. of the tweets
+    of a batch, as flat arrays over all their tokens. Each array is computed
+    the first time it is read, and then shared by every extractor reading
+    the batch (see FeatureExtractor._extract_token_batch).
+    """
+
+    def __init__(self, tokens_per_row: Sequence[Sequence]):
+        self.tokens_per_row = tokens_per_row
+        self._lengths = None
+        self._type_codes = None
+        self._texts = None
+        self._lower_ids = None
+
+    def __len__(self) -> int:
+        return len(self.tokens_per_row)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """
+        Number of tokens of each row.
+        """
+        if self._lengths is None:
+            self._lengths, self._type_codes = \
+                ragged_type_codes(self.tokens_per_row)
+        return self._lengths
+
+    @property
+    def type_codes(self) -> np.ndarray:
+        """
+        Token type codes of all tokens (see ragged_type_codes).
+        """
+        if self._type_codes is None:
+            self._lengths, self._type_codes = \
+                ragged_type_codes(self.tokens_per_row)
+        return self._type_codes
+
+    @property
+    def texts(self) -> List[str]:
+        """
+        Texts of all tokens (see ragged_texts).
+        """
+        if self._texts is None:
+            self._texts = ragged_texts(self.tokens_per_row)
+        return self._texts
+
+    @property
+    def lower_ids(self) -> np.ndarray:
+        """
+        Stable ids of the lowercased texts of all tokens (see
+        token_lower_ids).
+        """
+        if self._lower_ids is None:
+            lower_ids = list(map(token_lower_ids, self.tokens_per_row))
+            self._lower_ids = (
+                np.concatenate(lower_ids) if len(lower_ids) > 0 else
+                np.empty(0, dtype=compact.STABLE_ID_DTYPE))
+        return self._lower_ids
 
 
 class FeatureExtractor(Generic[PointT, RelevantPointT, FeatureT]):
+    """
+    Subclasses either override _extract, or give their dim and write the
+    features of a point in place with _extract_into, which lets
+    extract_batch fill a single preallocated matrix. Those whose data is a
+    sequence of tokens can also compute the features of a whole batch at
+    once from its flat arrays, with _extract_token_batch.
+    """
+
     def __init__(self, data_extractor: Callable[[PointT], RelevantPointT]):
         self._data_extractor = data_extractor
 
+    def dim(self) -> Optional[int]:
+        """
+        Length of the feature vectors, or None if only known after extracting.
+        """
+        return None
+
+    def config(self) -> str:
+        """
+        Identifies the extractor, its parameters and the stats it was built
+        from, eg. as part of cache keys: extractors with the same config
+        produce the same features from the same data. The data extractor is
+        not part of it.
+        """
+        return self.__class__.__name__
+
+    def _nr_tokens(self, data: RelevantPointT) -> int:
+        """
+        Number of tokens in data, as reported by instrumentation.
+        """
+        return len(data) if isinstance(data, Sized) else 0
+
     def _extract(self, data: RelevantPointT) -> FeatureT:
+        dim = self.dim()
+        if dim is None or not writes_in_place(self):
+            raise NotImplementedError
+        features = np.zeros(dim)
+        self._extract_into(data, features)
+        return features
+
+    def _token_pass(self, data: RelevantPointT,
+                    out: np.ndarray) -> Optional[TokenPass]:
+        """
+        For extractors whose features come from one walk over a sequence of
+        tokens: the tokens of data, a function adding the features of one
+        token to out and a function completing out after the walk, so that
+        FeatureUnion can walk tokens shared by several extractors only once.
+        None for the other extractors.
+        """
+        return None
+
+    def _extract_into(self, data: RelevantPointT, out: np.ndarray):
+        """
+        Adds the features of data to out, a zeroed array of length dim.
+        """
+        token_pass = self._token_pass(data, out)
+        if token_pass is None:
+            raise NotImplementedError
+        tokens_, accumulate, finish = token_pass
+        for token in tokens_:
+            accumulate(token)
+        finish()
+
+    def _extract_token_batch(self, batch: TokenBatch, out: np.ndarray):
+        """
+        For extractors with a dim whose data is a sequence of tokens: adds
+        the features of each row of batch to its row of out, a zeroed
+        len(batch) x dim matrix. FeatureUnion gives the same batch to all the
+        extractors reading the same tokens, which gathers their arrays once.
+        """
         raise NotImplementedError
 
     def extract(self, point: RelevantPointT) -> FeatureT:
         return self._extract(self._data_extractor(point))
+
+    def extract_batch(self, points: Sequence[PointT]):
+        """
+        Features of all points, as a matrix with a row per point. Extractors
+        with a dim fill one preallocated matrix, at once if they read token
+        batches; the others stack the features of each point.
+        """
+        dim = self.dim()
+        if dim is None:
+            return stack_features([self.extract(point) for point in points])
+        features = np.zeros((len(points), dim))
+        if reads_token_batches(self):
+            self._extract_token_batch(
+                TokenBatch([self._data_extractor(point) for point in points]),
+                features)
+            return features
+        for point, row in zip(points, features):
+            self._extract_into(self._data_extractor(point), row)
+        return features
+
+
+def writes_in_place(extractor: FeatureExtractor) -> bool:
+    return (type(extractor)._extract_into is not
+            FeatureExtractor._extract_into or
+            type(extractor)._token_pass is not FeatureExtractor._token_pass)
+
+
+def reads_token_batches(extractor: FeatureExtractor) -> bool:
+    return (type(extractor)._extract_token_batch is not
+            FeatureExtractor._extract_token_batch)
+
+
+def config_digest(items: Iterable) -> str:
+    """
+    Short digest of the string forms of items, to stand for stats such as
+    a vocabulary in a config.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for item in items:
+        digest.update(str(item).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def sparse_rows(idxs_per_row: Iterable[Iterable[int]], size: int,
+                binary: bool = False,
+                normalise: bool = False) -> scipy.sparse.csr_matrix:
+    """
+    Sparse matrix with a row of length size per element of idxs_per_row,
+    counting the occurrences of each index in it, or marking them with 1 if
+    binary. With normalise, the values of a row are divided by their sum,
+    like the dense extractors do.
+    """
+    all_idxs = []
+    all_values = []
+    indptr = [0]
+    for idxs in idxs_per_row:
+        idxs, counts = np.unique(np.fromiter(idxs, dtype=np.int64),
+                                 return_counts=True)
+        values = np.ones(len(idxs)) if binary else counts.astype(np.float64)
+        if normalise and len(idxs) > 0:
+            values /= values.sum()
+        all_idxs.append(idxs)
+        all_values.append(values)
+        indptr.append(indptr[-1] + len(idxs))
+    if len(all_idxs) == 0:
+        return scipy.sparse.csr_matrix((0, size))
+    return scipy.sparse.csr_matrix(
+        (np.concatenate(all_values), np.concatenate(all_idxs), indptr),
+        shape=(len(indptr) - 1, size))
+
+
+def sparse_row(idxs: Iterable[int], size: int, binary: bool = False,
+               normalise: bool = False) -> scipy.sparse.csr_matrix:
+    """
+    1 x size version of sparse_rows, for the features of a single point.
+    """
+    return sparse_rows([idxs], size, binary, normalise)
+
+
+def stack_features(features: Sequence) -> Union[np.ndarray,
+                                                scipy.sparse.csr_matrix]:
+    """
+    Stacks per-point feature rows, or blocks of them, into one matrix: a CSR
+    matrix if any of them is sparse, a dense array otherwise.
+    """
+    if any(scipy.sparse.issparse(feature) for feature in features):
+        return scipy.sparse.vstack(features, format='csr')
+    if len(features) == 0:
+        return np.array(features)
+    return np.vstack(features)
+
+
+def token_type_codes(tokens_: Sequence) -> np.ndarray:
+    """
+    Token type codes (see tokens.token_type_codes) of NGrams, a TokenTable
+    or any sequence of tokens, read straight from the TokenTable if there
+    is one.
+    """
+    if isinstance(tokens_, iotypes.NGrams):
+        return tokens_.type_codes()
+    return compact.type_codes(tokens_)
+
+
+def token_texts(tokens_: Sequence) -> List[str]:
+    if isinstance(tokens_, iotypes.NGrams):
+        return tokens_.texts()
+    return compact.texts(tokens_)
+
+
+def token_lower_ids(tokens_: Sequence) -> np.ndarray:
+    """
+    Stable ids of the lowercased texts (see compact.lower_stable_id) of NGrams
+    or any sequence of tokens, cached by NGrams.
+    """
+    if isinstance(tokens_, iotypes.NGrams):
+        return tokens_.ngram_ids(1, case_sensitive=False)
+    return compact.lower_stable_ids(tokens_)
+
+
+def _is_compact(tokens_: Sequence) -> bool:
+    return (isinstance(tokens_, compact.TokenTable) or
+            (isinstance(tokens_, iotypes.NGrams) and tokens_.is_compact()))
+
+
+def ragged_type_codes(tokens_per_row: Sequence[Sequence]
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ragged batch of the token type codes of several token sequences: the
+    length of each and the concatenation of their codes.
+    """
+    lengths = np.fromiter(map(len, tokens_per_row), dtype=np.int64,
+                          count=len(tokens_per_row))
+    if len(tokens_per_row) > 0 and all(map(_is_compact, tokens_per_row)):
+        codes = np.concatenate(list(map(token_type_codes, tokens_per_row)))
+    else:
+        codes = np.fromiter(
+            map(tokens.token_type_code, chain.from_iterable(tokens_per_row)),
+            dtype=compact.TYPE_CODE_DTYPE, count=lengths.sum())
+    return lengths, codes.astype(np.int64)
+
+
+def ragged_texts(tokens_per_row: Sequence[Sequence]) -> List[str]:
+    """
+    Concatenation of the texts of several token sequences. Tokens that are
+    already materialized stand for their own text, being strings.
+    """
+    return list(chain.from_iterable(
+        token_texts(tokens_) if _is_compact(tokens_) else tokens_
+        for tokens_ in tokens_per_row))
+
+
+def ragged_rows(lengths: np.ndarray) -> np.ndarray:
+    """
+    Row index of every element of a ragged batch with rows of the given
+    lengths.
+    """
+    return np.repeat(np.arange(len(lengths)), lengths)
@@ -1,109 +1,244 @@
+import hashlib
 import numpy as np
-from typing import Callable, Sequence, TypeVar, Dict, Tuple
+import scipy.sparse
+from collections import OrderedDict
+from typing import Callable, Sequence, TypeVar, Dict, Tuple, Union
 
-from basic.dcollections import setlist
-from basic.ditertools import flatten
-from ml.feature_extractors.feature_extractor import FeatureExtractor
+from ml.feature_extractors.feature_extractor import (
+    FeatureExtractor, ragged_rows, token_lower_ids)
 from tokenization import tokens
+from tokenization.compact import STABLE_ID_DTYPE, lower_stable_ids
 
 TweetT = TypeVar('TweetT')
+HstData = Tuple[int, Sequence[tokens.Token]]
 
 
-class HSTFrequencyFeatureExtractor(
-        FeatureExtractor[TweetT, Tuple[int, Sequence[tokens.Token]], np.ndarray]):
-    def __init__(self,
-                 data_extractor: Callable[[TweetT],
-                                          Tuple[int, Sequence[tokens.Token]]],
-                 hst: Dict[int, Sequence[str]],
-                 should_normalize: bool = False):
-        self._hst = hst
-        self._should_normalize = should_normalize
-        super().__init__(data_extractor)
+def _sorted_index(term_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The distinct term_ids, sorted, and the position of the first occurrence
+    of each in term_ids.
+    """
+    return np.unique(term_ids, return_index=True)
 
-    def _extract(self, data: Tuple[int, Sequence[tokens.Token]]) -> np.ndarray:
-        uid, tokens = data
-        user_hst = self._hst[uid]
-        hist = np.zeros(100)
-        for token in tokens:
-            try:
-                token_hst_index = user_hst.index(str(token.lower()))
-                hist[token_hst_index] += 1
-            except TypeError:
-                pass
-        if self._should_normalize:
-            hist_sum = sum(hist)
-            if hist_sum > 0:
-                hist = hist / sum(hist)
-        return hist
-
-
-class HSTGlobalFrequencyFeatureExtractor(
-        FeatureExtractor[TweetT, Tuple[int, Sequence[tokens.Token]], np.ndarray]):
-    def __init__(self,
-                 data_extractor: Callable[[TweetT],
-                                          Tuple[int, Sequence[tokens.Token]]],
-                 hst: Dict[int, Sequence[str]],
-                 should_normalize: bool = False):
-        self._hst = setlist(flatten(hst.values()))
-        self._should_normalize = should_normalize
-        super().__init__(data_extractor)
 
-    def _extract(self, data: Tuple[int, Sequence[tokens.Token]]) -> np.ndarray:
-        uid, tokens = data
-        hist = np.zeros(len(self._hst))
-        for token in tokens:
-            try:
-                token_hst_index = self._hst.index(str(token.lower()))
-                hist[token_hst_index] += 1
-            except TypeError:
-                pass
-        if self._should_normalize:
-            hist_sum = sum(hist)
-            if hist_sum > 0:
-                hist = hist / sum(hist)
-        return hist
-
-
-class HSTIndicatorFeatureExtractor(
-        FeatureExtractor[TweetT, Tuple[int, Sequence[tokens.Token]], np.ndarray]):
-    def __init__(self,
-                 data_extractor: Callable[[TweetT],
-                                          Tuple[int, Sequence[tokens.Token]]],
-                 hst: Dict[int, Sequence[str]]):
-        self._hst = hst
-        super().__init__(data_extractor)
+def _lookup(index: Tuple[np.ndarray, np.ndarray],
+            term_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Which of term_ids are in index, as a boolean mask, and their slots.
+    """
+    sorted_ids, slots = index
+    if len(sorted_ids) == 0:
+        return np.zeros(len(term_ids), dtype=bool), slots
+    positions = np.searchsorted(sorted_ids, term_ids)
+    positions[positions == len(sorted_ids)] = 0
+    found = sorted_ids[positions] == term_ids
+    return found, slots[positions[found]]
+
+
+class HstIndex:
+    """
+    The historical salient terms of every user, precompiled once into
+    sorted arrays of lowercase term ids (see compact.lower_stable_id), so
+    that the slot of each token of a tweet is found with a single binary
+    search over all of them.
+    The slot of a term is its rank among the first nr_terms HSTs of its
+    user, or its position among the distinct HSTs of all users (in the
+    order of hst) for the global extractors.
+    """
+
+    def __init__(self, hst: Dict[int, Sequence[str]], nr_terms: int = 100):
+        self._nr_terms = nr_terms
+        self._user_index = {}
+        global_term_ids = OrderedDict()
+        digest = hashlib.blake2b(digest_size=8)
+        for uid, user_hst in hst.items():
+            term_ids = lower_stable_ids(list(user_hst)[:nr_terms])
+            self._user_index[uid] = _sorted_index(term_ids)
+            digest.update(str(uid).encode('utf-8'))
+            digest.update(term_ids.tobytes())
+            for term_id in term_ids.tolist():
+                global_term_ids.setdefault(term_id)
+        self._nr_global_terms = len(global_term_ids)
+        self._digest = digest.hexdigest()
+        self._global_index = _sorted_index(np.fromiter(
+            global_term_ids, dtype=STABLE_ID_DTYPE,
+            count=len(global_term_ids)))
 
-    def _extract(self, data: Tuple[int, Sequence[tokens.Token]]) -> np.ndarray:
-        uid, tokens = data
-        user_hst = self._hst[uid]
-        hist = np.zeros(100)
-        for token in tokens:
-            try:
-                token_hst_index = user_hst.index(str(token.lower()))
-                hist[token_hst_index] = 1
-            except TypeError:
-                pass
-        return hist
-
-
-class HSTGlobalIndicatorFeatureExtractor(
-        FeatureExtractor[TweetT, Tuple[int, Sequence[tokens.Token]], np.ndarray]):
-    def __init__(self,
-                 data_extractor: Callable[[TweetT],
-                                          Tuple[int, Sequence[tokens.Token]]],
-                 hst: Dict[int, Sequence[str]],
-                 should_normalize: bool = False):
-        self._hst = setlist(flatten(hst.values()))
+    @property
+    def nr_terms(self) -> int:
+        return self._nr_terms
+
+    @property
+    def nr_global_terms(self) -> int:
+        return self._nr_global_terms
+
+    @property
+    def digest(self) -> str:
+        """
+        Digest of the HSTs of all users, in order.
+        """
+        return self._digest
+
+    def user_slots(self, uid: int, term_ids: np.ndarray
+                   ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Which of term_ids are HSTs of user uid, as a boolean mask, and
+        their slots.
+        """
+        return _lookup(self._user_index[uid], term_ids)
+
+    def global_slots(self, term_ids: np.ndarray
+                     ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Which of term_ids are HSTs of any user, as a boolean mask, and
+        their global slots.
+        """
+        return _lookup(self._global_index, term_ids)
+
+
+class _HstFeatureExtractor(FeatureExtractor[TweetT, HstData, np.ndarray]):
+    """
+    Histogram, or indicator, of the HSTs among the tokens of a tweet, over
+    the HSTs of its user or, if is_global, of all users. With sparse, rows
+    are scipy.sparse CSR matrices instead of dense arrays.
+    """
+
+    def __init__(self, data_extractor: Callable[[TweetT], HstData],
+                 hst: Union[Dict[int, Sequence[str]], HstIndex],
+                 is_global: bool, is_indicator: bool,
+                 should_normalize: bool, sparse: bool, nr_terms: int):
+        if not isinstance(hst, HstIndex):
+            hst = HstIndex(hst, nr_terms)
+        self._index = hst
+        self._is_global = is_global
+        self._is_indicator = is_indicator
         self._should_normalize = should_normalize
+        self._sparse = sparse
         super().__init__(data_extractor)
 
-    def _extract(self, data: Tuple[int, Sequence[tokens.Token]]) -> np.ndarray:
-        uid, tokens = data
-        hist = np.zeros(len(self._hst))
-        for token in tokens:
-            try:
-                token_hst_index = self._hst.index(str(token.lower()))
-                hist[token_hst_index] = 1
-            except TypeError:
-                pass
-        return hist
+    def dim(self) -> int:
+        if self._is_global:
+            return self._index.nr_global_terms
+        return self._index.nr_terms
+
+    def config(self) -> str:
+        return '{}(nr_terms={}, normalize={}, sparse={}, hst={})'.format(
+            self.__class__.__name__, self._index.nr_terms,
+            self._should_normalize, self._sparse, self._index.digest)
+
+    def _nr_tokens(self, data: HstData) -> int:
+        return len(data[1])
+
+    def _slots(self, data_per_row: Sequence[HstData]
+               ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Row and slot of every HST among the tokens of a batch of rows,
+        looking up the tokens of all rows of a user at once.
+        """
+        uids = [uid for uid, _ in data_per_row]
+        term_ids = [token_lower_ids(tokens_) for _, tokens_ in data_per_row]
+        lengths = np.fromiter(map(len, term_ids), dtype=np.int64,
+                              count=len(term_ids))
+        rows = ragged_rows(lengths)
+        term_ids = (np.concatenate(term_ids) if len(term_ids) > 0 else
+                    np.empty(0, dtype=STABLE_ID_DTYPE))
+        if self._is_global:
+            found, slots = self._index.global_slots(term_ids)
+            return rows[found], slots
+
+        # Tokens sorted by the user of their row, so that those of each user
+        # are one slice
+        distinct_uids, row_users = np.unique(uids, return_inverse=True)
+        token_users = row_users.reshape(-1)[rows]
+        order = np.argsort(token_users, kind='stable')
+        bounds = np.searchsorted(token_users[order],
+                                 np.arange(len(distinct_uids) + 1))
+        all_rows, all_slots = [rows[:0]], [rows[:0]]
+        for user, uid in enumerate(distinct_uids.tolist()):
+            user_tokens = order[bounds[user]:bounds[user + 1]]
+            found, slots = self._index.user_slots(uid, term_ids[user_tokens])
+            all_rows.append(rows[user_tokens[found]])
+            all_slots.append(slots)
+        return np.concatenate(all_rows), np.concatenate(all_slots)
+
+    def _to_dense(self, rows: np.ndarray, slots: np.ndarray,
+                  nr_rows: int) -> np.ndarray:
+        dim = self.dim()
+        features = np.bincount(rows * dim + slots, minlength=nr_rows * dim)
+        features = features.reshape(nr_rows, dim).astype(np.float64)
+        if self._is_indicator:
+            np.minimum(features, 1, out=features)
+        elif self._should_normalize:
+            row_sums = features.sum(axis=1, keepdims=True)
+            np.divide(features, row_sums, out=features, where=row_sums > 0)
+        return features
+
+    def _to_sparse(self, rows: np.ndarray, slots: np.ndarray,
+                   nr_rows: int) -> scipy.sparse.csr_matrix:
+        features = scipy.sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, slots)), shape=(nr_rows, self.dim()))
+        if self._is_indicator:
+            features.data[:] = 1
+        elif self._should_normalize:
+            row_sums = np.asarray(features.sum(axis=1)).ravel()
+            row_sums[row_sums == 0] = 1
+            features = scipy.sparse.diags(1 / row_sums) @ features
+        return scipy.sparse.csr_matrix(features)
+
+    def _extract(self, data: HstData):
+        rows, slots = self._slots([data])
+        if self._sparse:
+            return self._to_sparse(rows, slots, 1)
+        return self._to_dense(rows, slots, 1)[0]
+
+    def _extract_into(self, data: HstData, out: np.ndarray):
+        rows, slots = self._slots([data])
+        out += self._to_dense(rows, slots, 1)[0]
+
+    def extract_batch(self, points: Sequence[TweetT]):
+        """
+        Features of points, best given as all the tweets of a user, whose
+        tokens are then looked up together.
+        """
+        rows, slots = self._slots(list(map(self._data_extractor, points)))
+        if self._sparse:
+            return self._to_sparse(rows, slots, len(points))
+        return self._to_dense(rows, slots, len(points))
+
+
+class HSTFrequencyFeatureExtractor(_HstFeatureExtractor[TweetT]):
+    def __init__(self, data_extractor: Callable[[TweetT], HstData],
+                 hst: Union[Dict[int, Sequence[str]], HstIndex],
+                 should_normalize: bool = False, nr_terms: int = 100):
+        super().__init__(data_extractor, hst, is_global=False,
+                         is_indicator=False, should_normalize=should_normalize,
+                         sparse=False, nr_terms=nr_terms)
+
+
+class HSTGlobalFrequencyFeatureExtractor(_HstFeatureExtractor[TweetT]):
+    def __init__(self, data_extractor: Callable[[TweetT], HstData],
+                 hst: Union[Dict[int, Sequence[str]], HstIndex],
+                 should_normalize: bool = False, sparse: bool = False,
+                 nr_terms: int = 100):
+        super().__init__(data_extractor, hst, is_global=True,
+                         is_indicator=False, should_normalize=should_normalize,
+                         sparse=sparse, nr_terms=nr_terms)
+
+
+class HSTIndicatorFeatureExtractor(_HstFeatureExtractor[TweetT]):
+    def __init__(self, data_extractor: Callable[[TweetT], HstData],
+                 hst: Union[Dict[int, Sequence[str]], HstIndex],
+                 nr_terms: int = 100):
+        super().__init__(data_extractor, hst, is_global=False,
+                         is_indicator=True, should_normalize=False,
+                         sparse=False, nr_terms=nr_terms)
+
+
+class HSTGlobalIndicatorFeatureExtractor(_HstFeatureExtractor[TweetT]):
+    def __init__(self, data_extractor: Callable[[TweetT], HstData],
+                 hst: Union[Dict[int, Sequence[str]], HstIndex],
+                 should_normalize: bool = False, sparse: bool = False,
+                 nr_terms: int = 100):
+        super().__init__(data_extractor, hst, is_global=True,
+                         is_indicator=True, should_normalize=should_normalize,
+                         sparse=sparse, nr_terms=nr_terms)
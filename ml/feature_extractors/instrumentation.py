@@ -0,0 +1,196 @@
+import functools
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import scipy.sparse
+
+from ml.feature_extractors.feature_extractor import FeatureExtractor
+from ml.feature_extractors.union import FeatureUnion
+
+logger = logging.getLogger('ml.feature_extractors.instrumentation')
+
+# Opt-in: enable() wraps extract and extract_batch of every FeatureExtractor
+# class and disable() puts the originals back, so that, while disabled,
+# extractors run exactly the code they would without this module.
+_instrumented_methods = ['extract', 'extract_batch']
+_originals = OrderedDict()
+_stats = {}  # type: Dict[str, ExtractorStats]
+# Extractors inside an instrumented call, whose nested calls, eg. to
+# super().extract_batch, are already being measured
+_active = set()
+_log_every = None
+_last_log = 0.0
+
+
+class ExtractorStats:
+    """
+    What the instrumented calls of the extractors of one class did: points
+    extracted, wall time, tokens read and size of the features produced.
+    Times and tokens include those of the extractors they call, eg. the
+    parts of a FeatureUnion, which counts the tokens read by all of them.
+    """
+
+    def __init__(self):
+        self.nr_calls = 0
+        self.nr_points = 0
+        self.seconds = 0.0
+        self.nr_tokens = 0
+        self.nr_features = 0
+        self.output_bytes = 0
+
+    def as_dict(self) -> Dict[str, float]:
+        return OrderedDict([
+            ('nr_calls', self.nr_calls),
+            ('nr_points', self.nr_points),
+            ('seconds', self.seconds),
+            ('nr_tokens', self.nr_tokens),
+            ('nr_features', self.nr_features),
+            ('output_bytes', self.output_bytes)
+        ])
+
+
+def _output_bytes(features) -> int:
+    if scipy.sparse.issparse(features):
+        features = features.tocsr()
+        return (features.data.nbytes + features.indices.nbytes +
+                features.indptr.nbytes)
+    return getattr(features, 'nbytes', 0)
+
+
+def _record(extractor: FeatureExtractor, points, seconds: float,
+            nr_tokens: int, features):
+    stats = _stats.get(extractor.__class__.__name__)
+    if stats is None:
+        stats = _stats[extractor.__class__.__name__] = ExtractorStats()
+    stats.nr_calls += 1
+    stats.nr_points += len(points)
+    stats.seconds += seconds
+    stats.nr_tokens += nr_tokens
+    shape = getattr(features, 'shape', None)
+    stats.nr_features = shape[-1] if shape else len(features)
+    stats.output_bytes += _output_bytes(features)
+
+    if _log_every is not None and time.time() - _last_log >= _log_every:
+        log_snapshot()
+
+
+def _token_readers(extractor: FeatureExtractor) -> List[FeatureExtractor]:
+    """
+    Extractors whose data counts as the tokens read by extractor: its parts
+    for a FeatureUnion, which walks their data instead of its own.
+    """
+    if isinstance(extractor, FeatureUnion):
+        return list(OrderedDict((id(part), part)
+                                for part, _ in extractor._extractors).values())
+    return [extractor]
+
+
+def _count_tokens(extractor: FeatureExtractor, nr_tokens: List[int]
+                  ) -> Callable:
+    """
+    Makes extractor add the tokens of the data it extracts to nr_tokens, as
+    it reads them, and returns its original data extractor.
+    """
+    data_extractor = extractor._data_extractor
+
+    def counting(point):
+        data = data_extractor(point)
+        nr_tokens[0] += extractor._nr_tokens(data)
+        return data
+
+    extractor._data_extractor = counting
+    return data_extractor
+
+
+def _instrument(f: Callable, is_batch: bool) -> Callable:
+    @functools.wraps(f)
+    def instrumented(self, points):
+        if id(self) in _active:
+            return f(self, points)
+        _active.add(id(self))
+        nr_tokens = [0]
+        readers = _token_readers(self)
+        data_extractors = [_count_tokens(reader, nr_tokens)
+                           for reader in readers]
+        start = time.perf_counter()
+        try:
+            features = f(self, points)
+        finally:
+            seconds = time.perf_counter() - start
+            for reader, data_extractor in zip(readers, data_extractors):
+                reader._data_extractor = data_extractor
+            _active.discard(id(self))
+        _record(self, points if is_batch else [points], seconds,
+                nr_tokens[0], features)
+        return features
+
+    return instrumented
+
+
+def _extractor_classes():
+    classes = [FeatureExtractor]
+    for cls in classes:
+        classes.extend(sub for sub in cls.__subclasses__()
+                       if sub not in classes)
+    return classes
+
+
+def enable(log_every: Optional[float] = None):
+    """
+    Starts recording the calls of all extractor classes defined so far,
+    logging a snapshot every log_every seconds if given.
+    """
+    global _log_every, _last_log
+    _log_every = log_every
+    _last_log = time.time()
+    if is_enabled():
+        return
+    for cls in _extractor_classes():
+        for name in _instrumented_methods:
+            if name in vars(cls):
+                _originals[cls, name] = vars(cls)[name]
+                setattr(cls, name, _instrument(vars(cls)[name],
+                                               name == 'extract_batch'))
+    logger.info('[enable] Instrumenting {} extractor methods'
+                .format(len(_originals)))
+
+
+def disable():
+    global _log_every
+    for (cls, name), f in _originals.items():
+        setattr(cls, name, f)
+    _originals.clear()
+    _log_every = None
+
+
+def is_enabled() -> bool:
+    return len(_originals) > 0
+
+
+def reset():
+    _stats.clear()
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """
+    Stats recorded so far for each extractor class, slowest first.
+    """
+    return OrderedDict(
+        (name, stats.as_dict())
+        for name, stats in sorted(_stats.items(),
+                                  key=lambda item: -item[1].seconds))
+
+
+def log_snapshot():
+    global _last_log
+    _last_log = time.time()
+    logger.info('[log_snapshot] ' + '; '.join(
+        '{}: {:.2f}s, {} calls, {} points ({:.1f}us/point), {} tokens, '
+        '{} features, {:.1f} MiB out'.format(
+            name, stats['seconds'], stats['nr_calls'], stats['nr_points'],
+            1e6 * stats['seconds'] / max(stats['nr_points'], 1),
+            stats['nr_tokens'], stats['nr_features'],
+            stats['output_bytes'] / 2**20)
+        for name, stats in snapshot().items()))
@@ -0,0 +1,108 @@
+import logging
+import multiprocessing
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse
+
+from ml.feature_extractors.feature_extractor import FeatureExtractor
+
+logger = logging.getLogger('ml.feature_extractors.parallel')
+
+FEATURE_DTYPE = np.float32
+
+# Extractor, blocks and row ranges of the running extract_parallel call.
+# Forked workers inherit them instead of receiving them pickled, which data
+# extractors, often lambdas, would not survive.
+_job = None
+# The dense output matrix, as mapped by the current worker, if any
+_out = None
+
+
+def block_rows(blocks: Sequence[Sequence]) -> List[slice]:
+    """
+    Rows of each block in the matrix of the features of all blocks, stacked.
+    """
+    rows = []
+    start = 0
+    for block in blocks:
+        rows.append(slice(start, start + len(block)))
+        start += len(block)
+    return rows
+
+
+def _open_output(path: Optional[str]):
+    global _out
+    _out = np.load(path, mmap_mode='r+') if path is not None else None
+
+
+def _extract_block(idx: int) -> Tuple[int, Optional[scipy.sparse.spmatrix]]:
+    fe, blocks, rows = _job
+    features = fe.extract_batch(blocks[idx])
+    if _out is None or scipy.sparse.issparse(features):
+        return idx, scipy.sparse.csr_matrix(features, dtype=FEATURE_DTYPE)
+    _out[rows[idx]] = features
+    _out.flush()
+    return idx, None
+
+
+def _sparse_output(fe: FeatureExtractor, blocks: Sequence[Sequence]) -> bool:
+    """
+    Whether fe extracts sparse features, judging by those of a single point.
+    """
+    for block in blocks:
+        if len(block) > 0:
+            return scipy.sparse.issparse(fe.extract_batch(block[:1]))
+    return False
+
+
+def extract_parallel(fe: FeatureExtractor, blocks: Sequence[Sequence],
+                     path: str, workers: int = None) -> List:
+    """
+    Features of the points of all blocks, eg. of the tweets of each user,
+    extracted block by block with fe.extract_batch on a pool of workers
+    processes (by default, one per core). If fe has a fixed dim and extracts
+    dense features, each worker writes the rows of its blocks straight into
+    a float32 .npy matrix at path, memory-mapped by all of them, and sends
+    back only the index of the block. Otherwise, workers send back the
+    features of each block as a float32 csr_matrix, and no matrix is written.
+    Workers are forked, so this needs a platform that supports it.
+
+    :return: the features of each block, dense ones as rows of the matrix,
+        memory-mapped read-only
+    """
+    global _job
+    dim = fe.dim()
+    rows = block_rows(blocks)
+    if dim is None or _sparse_output(fe, blocks):
+        path = None
+    else:
+        nr_rows = rows[-1].stop if len(rows) > 0 else 0
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=FEATURE_DTYPE,
+                                        shape=(nr_rows, dim))
+        del out
+
+    # Largest blocks first, so that no worker is left with a big one at
+    # the end while the others idle
+    order = sorted(range(len(blocks)), key=lambda idx: -len(blocks[idx]))
+    features = [None] * len(blocks)
+    _job = fe, blocks, rows
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, _open_output, (path,)) as pool:
+            for nr_done, (idx, block_features) in enumerate(
+                    pool.imap_unordered(_extract_block, order), 1):
+                features[idx] = block_features
+                logger.debug('[extract_parallel] Block {} done, rows {}-{}'
+                             .format(idx, rows[idx].start, rows[idx].stop))
+                if nr_done % 1000 == 0:
+                    logger.info('[extract_parallel] {}/{} blocks done'
+                                .format(nr_done, len(blocks)))
+    finally:
+        _job = None
+    if path is not None:
+        out = np.load(path, mmap_mode='r')
+        features = [out[block_rows] if block_features is None
+                    else block_features
+                    for block_features, block_rows in zip(features, rows)]
+    return features
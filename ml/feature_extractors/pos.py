@@ -1,19 +1,23 @@
-from itertools import count
 from typing import Callable, TypeVar, Sequence
 
 import numpy as np
 
-from ml.feature_extractors.feature_extractor import FeatureExtractor
+from ml.feature_extractors.feature_extractor import (
+    FeatureExtractor, TokenBatch, ragged_rows, token_type_codes)
 from tokenization import tokens
 
 TweetT = TypeVar('TweetT')
 
+dense_token_types = (tokens.NounToken, tokens.VerbToken,
+                     tokens.AdjectiveToken, tokens.AdverbToken)
+
+# Whether each token type code stands for a dense token type
+dense_type_code_mask = np.array([issubclass(token_type, dense_token_types)
+                                 for token_type in tokens.all_token_types])
+
 
 def token_is_dense(token):
-    return (isinstance(token, tokens.NounToken)
-            or isinstance(token, tokens.VerbToken)
-            or isinstance(token, tokens.AdjectiveToken)
-            or isinstance(token, tokens.AdverbToken))
+    return isinstance(token, dense_token_types)
 
 
 class PosFeatureExtractor(
@@ -23,20 +27,41 @@ class PosFeatureExtractor(
     2. Ratio -"-
     3. Lexical density of the tweet
        That is, the ratio of nouns, verbs, adjectives and adverbs, to all words
+    Ratios and lexical density are 0 for tweets without tokens.
     """
     def __init__(self,
                  data_extractor: Callable[[TweetT], Sequence[tokens.Token]]):
-        self._token_type_to_index = dict(zip(tokens.all_token_types, count()))
+        self._nr_types = len(tokens.all_token_types)
         super().__init__(data_extractor)
 
-    def _extract(self, tokens: Sequence[tokens.Token]):
-        pos_count = np.zeros(len(self._token_type_to_index))
-        nr_dense_words = 0
-        for token in tokens:
-            type_index = self._token_type_to_index[type(token)]
-            pos_count[type_index] += 1
-            if token_is_dense(token):
-                nr_dense_words += 1
-        pos_ratio = pos_count / len(tokens)
-        lexical_density = nr_dense_words / len(tokens)
-        return np.concatenate((pos_count, pos_ratio, [lexical_density]))
+    def dim(self) -> int:
+        return 2 * self._nr_types + 1
+
+    def _extract_into(self, tokens: Sequence[tokens.Token], out: np.ndarray):
+        self.extract_codes(np.array([len(tokens)]), token_type_codes(tokens),
+                           out[np.newaxis])
+
+    def _extract_token_batch(self, batch: TokenBatch, out: np.ndarray):
+        self.extract_codes(batch.lengths, batch.type_codes, out)
+
+    def extract_codes(self, lengths: np.ndarray, codes: np.ndarray,
+                      out: np.ndarray = None) -> np.ndarray:
+        """
+        Features of a ragged batch of tweets: the number of tokens of each,
+        and the token type codes of all of them, concatenated tweet by tweet.
+        """
+        nr_tweets = len(lengths)
+        nr_types = self._nr_types
+        if out is None:
+            out = np.zeros((nr_tweets, self.dim()))
+        rows = ragged_rows(lengths)
+        pos_count = np.bincount(rows * nr_types + codes,
+                                minlength=nr_tweets * nr_types)
+        pos_count = pos_count.reshape(nr_tweets, nr_types)
+        nonzero_lengths = np.maximum(lengths, 1)
+        out[:, :nr_types] = pos_count
+        np.divide(pos_count, nonzero_lengths[:, np.newaxis],
+                  out=out[:, nr_types:2 * nr_types])
+        out[:, -1] = (pos_count[:, dense_type_code_mask].sum(axis=1) /
+                      nonzero_lengths)
+        return out
@@ -1,27 +1,100 @@
 import numpy as np
-from typing import Callable, TypeVar, Sequence
+from typing import Callable, Dict, TypeVar, Sequence, Tuple
 
-from basic.ditertools import icount
-from ml.feature_extractors.feature_extractor import FeatureExtractor
+from ml.feature_extractors.feature_extractor import (
+    FeatureExtractor, TokenBatch, ragged_rows, token_lower_ids, token_texts)
 from tokenization import tokenizers, tokens
 
 TweetT = TypeVar('TweetT')
 
+lc_vowels = frozenset('aeiouy')
+
+
+def word_profile(word: str) -> Tuple[bool, int]:
+    """
+    Whether word has no vowels, and its number of syllables.
+    """
+    return (lc_vowels.isdisjoint(str.lower(word)),
+            tokenizers.nltk_count_syllables(str.__str__(word)))
+
+
+class PronunciationProfiles:
+    """
+    Cache of the word_profile of words, keyed by the stable id of their
+    lowercase text (see compact.lower_stable_id), which is all the profile
+    depends on. Cleared once it holds max_size words.
+    """
+
+    def __init__(self, max_size: int = 1000000):
+        self._max_size = max_size
+        self._profiles = {}  # type: Dict[int, Tuple[bool, int]]
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def lookup(self, word_ids: np.ndarray, texts: Sequence[str]
+               ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        No-vowels mask and syllable counts of the words with the given ids
+        and texts, looking up each distinct word once.
+        """
+        distinct_ids, first_idxs, inverse = np.unique(
+            word_ids, return_index=True, return_inverse=True)
+        no_vowels = np.empty(len(distinct_ids), dtype=bool)
+        nr_syllables = np.empty(len(distinct_ids), dtype=np.int64)
+        if len(self._profiles) + len(distinct_ids) > self._max_size:
+            self._profiles.clear()
+        profiles = self._profiles
+        for idx, (word_id, first_idx) in enumerate(
+                zip(distinct_ids.tolist(), first_idxs.tolist())):
+            profile = profiles.get(word_id)
+            if profile is None:
+                profile = profiles[word_id] = word_profile(texts[first_idx])
+            no_vowels[idx], nr_syllables[idx] = profile
+        return no_vowels[inverse], nr_syllables[inverse]
+
+
+# Shared by all extractors, and by the workers forked from this process
+profiles = PronunciationProfiles()
+
 
 class PronunciationFeatureExtractor(
         FeatureExtractor[TweetT, Sequence[tokens.Token], np.ndarray]):
+    """
+    1. Number of words without vowels
+    2. Number of words with more than 3 syllables
+    """
+
     def __init__(self,
                  data_extractor: Callable[[TweetT], Sequence[tokens.Token]]):
-        self._lc_vowels = {'a', 'e', 'i', 'o', 'y', 'u'}
         super().__init__(data_extractor)
 
-    def _count_vowels(self, w):
-        nr_vowels = len(list(filter(lambda c: c in self._lc_vowels, w.lower())))
-        return nr_vowels
+    def dim(self) -> int:
+        return 2
+
+    def _extract_into(self, tokens: Sequence[tokens.Token], out: np.ndarray):
+        self.extract_profiles(np.array([len(tokens)]),
+                              *profiles.lookup(token_lower_ids(tokens),
+                                               token_texts(tokens)),
+                              out=out[np.newaxis])
+
+    def _extract_token_batch(self, batch: TokenBatch, out: np.ndarray):
+        self.extract_profiles(
+            batch.lengths, *profiles.lookup(batch.lower_ids, batch.texts),
+            out=out)
 
-    def _extract(self, tokens: Sequence[tokens.Token]):
-        nr_tokens_without_vowels = icount(
-            lambda token: self._count_vowels(token) == 0, tokens)
-        nr_polysyllables = icount(
-            lambda token: tokenizers.nltk_count_syllables(str(token)) > 3, tokens)
-        return np.array([nr_tokens_without_vowels, nr_polysyllables])
+    def extract_profiles(self, lengths: np.ndarray, no_vowels: np.ndarray,
+                         nr_syllables: np.ndarray,
+                         out: np.ndarray = None) -> np.ndarray:
+        """
+        Features of a ragged batch of tweets: the number of tokens of each,
+        and the profiles of all of them (see PronunciationProfiles.lookup),
+        concatenated tweet by tweet.
+        """
+        nr_tweets = len(lengths)
+        if out is None:
+            out = np.zeros((nr_tweets, self.dim()))
+        rows = ragged_rows(lengths)
+        out[:, 0] += np.bincount(rows[no_vowels], minlength=nr_tweets)
+        out[:, 1] += np.bincount(rows[nr_syllables > 3], minlength=nr_tweets)
+        return out
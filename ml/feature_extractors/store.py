@@ -0,0 +1,175 @@
+import glob
+import logging
+import os
+from typing import Callable, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse
+
+from basic import filesystem
+from ml.feature_extractors.feature_extractor import (
+    FeatureExtractor, config_digest)
+from ml.feature_extractors.parallel import FEATURE_DTYPE, extract_parallel
+
+logger = logging.getLogger('ml.feature_extractors.store')
+
+BlockKey = Tuple[Hashable, Hashable]
+Block = Tuple[BlockKey, Sequence]
+
+
+def _write_atomically(path: str, save, features):
+    """
+    Saves features to path through a temporary file, so that readers, eg.
+    other processes sharing the store, never see a partial file.
+    """
+    filesystem.ensure_writable_file_loc(path)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        save(f, features)
+    os.replace(tmp_path, path)
+
+
+class FeatureStore:
+    """
+    On-disk features of blocks of examples, eg. of the examples of one class
+    of one user, keyed by (uid, label). Blocks live under
+    root_dir/<digest of fe.config()>, so that changing the extractor, its
+    parameters or the stats it was built from reads and writes other files,
+    while the blocks of the old config stay untouched. The file of a block
+    is also named after a digest of the point_id of its points, so that a
+    block is extracted again whenever its points change.
+    Dense blocks are float32 .npy files, read memory-mapped; sparse ones are
+    scipy.sparse .npz files.
+    """
+
+    def __init__(self, root_dir: str, fe: FeatureExtractor,
+                 point_id: Callable[[object], Hashable] = str):
+        self._fe = fe
+        self._point_id = point_id
+        self._config = fe.config()
+        self._dir = os.path.join(root_dir, config_digest([self._config]))
+        config_file = os.path.join(self._dir, 'config.txt')
+        filesystem.ensure_writable_file_loc(config_file)
+        if not filesystem.readable_file(config_file):
+            with open(config_file, 'w', encoding='utf-8') as f:
+                f.write(self._config + '\n')
+
+    @property
+    def dir(self) -> str:
+        return self._dir
+
+    def _points_digest(self, points: Sequence) -> str:
+        return config_digest(map(self._point_id, points))
+
+    def _path(self, key: BlockKey, points_digest: str, extension: str) -> str:
+        uid, label = key
+        return os.path.join(self._dir, str(uid), '{}.{}.{}'.format(
+            label, points_digest, extension))
+
+    def _existing_path(self, key: BlockKey, points: Sequence) -> Optional[str]:
+        points_digest = self._points_digest(points)
+        for extension in ['npz', 'npy']:
+            path = self._path(key, points_digest, extension)
+            if filesystem.readable_file(path):
+                return path
+        return None
+
+    def get(self, key: BlockKey, points: Sequence):
+        """
+        Features of the block key, or None if there are none for these
+        points.
+        """
+        path = self._existing_path(key, points)
+        if path is None:
+            return None
+        if path.endswith('.npz'):
+            return scipy.sparse.load_npz(path)
+        return np.load(path, mmap_mode='r')
+
+    def put(self, key: BlockKey, points: Sequence, features):
+        """
+        Saves the features of points as the block key, replacing those of
+        any other points.
+        """
+        uid, label = key
+        stale_paths = glob.glob(os.path.join(
+            self._dir, str(uid), glob.escape(str(label)) + '.*.np[yz]'))
+        points_digest = self._points_digest(points)
+        if scipy.sparse.issparse(features):
+            path = self._path(key, points_digest, 'npz')
+            _write_atomically(path, scipy.sparse.save_npz,
+                              scipy.sparse.csr_matrix(
+                                  features, dtype=FEATURE_DTYPE))
+        else:
+            path = self._path(key, points_digest, 'npy')
+            _write_atomically(path, np.save,
+                              np.asarray(features, dtype=FEATURE_DTYPE))
+        for stale_path in stale_paths:
+            if stale_path != path:
+                os.remove(stale_path)
+
+    def get_or_extract(self, key: BlockKey, points: Sequence):
+        """
+        Features of the block key, extracted from points with the extractor
+        of the store and saved if they are missing or stale.
+        """
+        features = self.get(key, points)
+        if features is None:
+            logger.info('[FeatureStore] Generating features for user {} '
+                        'class {}'.format(*key))
+            self.put(key, points, self._fe.extract_batch(points))
+            features = self.get(key, points)
+        return features
+
+    def extract_all(self, blocks: Sequence[Block], workers: int = 1):
+        """
+        Extracts and saves the features of the blocks, given as keys and
+        points, that are missing or stale. With several workers, they are
+        extracted in parallel (see parallel.extract_parallel).
+        """
+        if workers == 1:
+            for key, points in blocks:
+                self.get_or_extract(key, points)
+            return
+
+        missing = [(key, points) for key, points in blocks
+                   if self._existing_path(key, points) is None]
+        if len(missing) == 0:
+            return
+        logger.info('[FeatureStore] Generating features for {} blocks on {} '
+                    'workers'.format(len(missing), workers))
+        path = os.path.join(self._dir, 'extracting.{}.npy'.format(os.getpid()))
+        features = extract_parallel(
+            self._fe, [points for _, points in missing], path, workers)
+        for (key, points), block_features in zip(missing, features):
+            self.put(key, points, block_features)
+        del features
+        if filesystem.readable_file(path):
+            os.remove(path)
+
+    def load_blocks(self, blocks: Sequence[Block]) -> List:
+        """
+        Features of the blocks, given as keys and points, which must all be
+        in the store, in order: dense blocks memory-mapped, without reading
+        or copying them, sparse ones as CSR matrices.
+        """
+        features = []
+        for key, points in blocks:
+            block_features = self.get(key, points)
+            if block_features is None:
+                raise KeyError('no features for {}'.format(key))
+            features.append(block_features)
+        return features
+
+    def load_stacked(self, blocks: Sequence[Block]):
+        """
+        Features of the blocks (see load_blocks) stacked in order into a
+        single matrix in memory, a CSR matrix if any block is sparse.
+        """
+        features = self.load_blocks(blocks)
+        if len(features) == 0:
+            return np.zeros((0, self._fe.dim() or 0), dtype=FEATURE_DTYPE)
+        if any(map(scipy.sparse.issparse, features)):
+            return scipy.sparse.vstack(features, format='csr',
+                                       dtype=FEATURE_DTYPE)
+        return np.concatenate(features)
@@ -0,0 +1,76 @@
+import unittest
+
+import numpy as np
+
+from dataio import iotypes
+from ml.feature_extractors.capitalization import \
+    CapitalizationFeatureExtractor
+from ml.feature_extractors.feature_extractor import FeatureExtractor
+from ml.feature_extractors.pos import PosFeatureExtractor
+from ml.feature_extractors.pronunciation import PronunciationFeatureExtractor
+from tokenization.compact import TokenTable
+
+texts = ['Oh GREAT, another Monday :) #blessed',
+         'I just LOVE waiting in line for hours...',
+         'beautiful university',
+         '@someone Thanks a lot, really http://t.co/x',
+         'HELLO hello Hello hELLO',
+         'sarcasm is the lowest form of wit D:']
+
+
+def points() -> list:
+    """
+    NGrams of texts, every other one backed by a compact TokenTable.
+    """
+    ngrams = list(map(iotypes.SvNgrams, texts))
+    return [iotypes.NGrams(TokenTable.from_tokens(ngrams_))
+            if idx % 2 == 0 else ngrams_
+            for idx, ngrams_ in enumerate(ngrams)]
+
+
+class _NoFeatures(FeatureExtractor):
+    def dim(self) -> int:
+        return 3
+
+
+class _Lengths(FeatureExtractor):
+    def dim(self) -> int:
+        return 1
+
+    def _extract_into(self, data, out: np.ndarray):
+        out[0] = len(data)
+
+
+class _UnknownDim(_Lengths):
+    def dim(self):
+        return None
+
+
+class FeatureExtractorTest(unittest.TestCase):
+    def test_missing_extract_raises_not_implemented(self):
+        for extractor in [FeatureExtractor(str), _NoFeatures(str),
+                          _UnknownDim(str)]:
+            with self.assertRaises(NotImplementedError):
+                extractor.extract('point')
+
+    def test_token_batches_match_points(self):
+        points_ = points()
+        for fe in [PosFeatureExtractor(lambda point: point),
+                   CapitalizationFeatureExtractor(lambda point: point),
+                   PronunciationFeatureExtractor(lambda point: point)]:
+            np.testing.assert_allclose(
+                fe.extract_batch(points_),
+                np.vstack([fe.extract(point) for point in points_]))
+            np.testing.assert_allclose(
+                fe.extract_batch(points_[1:2]), [fe.extract(points_[1])])
+            self.assertEqual(fe.extract_batch([]).shape, (0, fe.dim()))
+
+    def test_extract_into(self):
+        extractor = _Lengths(str)
+        np.testing.assert_array_equal(extractor.extract('point'), [5])
+        np.testing.assert_array_equal(
+            extractor.extract_batch(['a', 'bb']), [[1], [2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+import numpy as np
+
+from dataio import iotypes
+from ml.feature_extractors.historical_salient_terms import (
+    HSTFrequencyFeatureExtractor, HSTGlobalFrequencyFeatureExtractor,
+    HSTGlobalIndicatorFeatureExtractor, HstIndex)
+
+hst = {1: ['great', 'Monday', 'love'],
+       2: ['love', 'day', 'GREAT', 'wit'],
+       3: []}
+global_terms = ['great', 'monday', 'love', 'day', 'wit']
+points = [(1, iotypes.SvNgrams('Oh GREAT another Monday great')),
+          (2, iotypes.SvNgrams('I love a great day, I LOVE it')),
+          (3, iotypes.SvNgrams('the lowest form of wit')),
+          (1, iotypes.SvNgrams('nothing to see here'))]
+
+
+def term_counts(terms: list, point) -> list:
+    words = [str.lower(token) for token in point[1]]
+    return [words.count(term) for term in terms]
+
+
+class HstFeatureExtractorTest(unittest.TestCase):
+    def test_global_columns_are_distinct_terms(self):
+        index = HstIndex(hst)
+        self.assertEqual(index.nr_global_terms, len(global_terms))
+        fe = HSTGlobalFrequencyFeatureExtractor(lambda point: point, index)
+        self.assertEqual(fe.dim(), len(global_terms))
+        np.testing.assert_array_equal(
+            fe.extract_batch(points),
+            [term_counts(global_terms, point) for point in points])
+
+    def test_user_columns(self):
+        fe = HSTFrequencyFeatureExtractor(lambda point: point, hst,
+                                          nr_terms=3)
+        expected = np.zeros((len(points), 3))
+        for row, point in zip(expected, points):
+            terms = [term.lower() for term in hst[point[0]][:3]]
+            row[:len(terms)] = term_counts(terms, point)
+        np.testing.assert_array_equal(fe.extract_batch(points), expected)
+
+    def test_batch_matches_points(self):
+        for fe in [HSTFrequencyFeatureExtractor(lambda point: point, hst,
+                                                should_normalize=True),
+                   HSTGlobalFrequencyFeatureExtractor(lambda point: point,
+                                                      hst)]:
+            np.testing.assert_allclose(
+                fe.extract_batch(points),
+                np.vstack([fe.extract(point) for point in points]))
+
+    def test_sparse_matches_dense(self):
+        dense = HSTGlobalIndicatorFeatureExtractor(lambda point: point, hst)
+        sparse = HSTGlobalIndicatorFeatureExtractor(lambda point: point, hst,
+                                                    sparse=True)
+        np.testing.assert_array_equal(
+            sparse.extract_batch(points).toarray(),
+            dense.extract_batch(points))
+        np.testing.assert_array_equal(
+            dense.extract_batch(points),
+            np.minimum(1, [term_counts(global_terms, point)
+                           for point in points]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.sparse
+
+from dataio import iotypes
+from ml.feature_extractors.parallel import block_rows, extract_parallel
+from ml.feature_extractors.pos import PosFeatureExtractor
+from ml.feature_extractors.vocabulary_based import (
+    HashedNGramFeatureExtractor, NGramFrequencyFeatureExtractor)
+
+texts = ['Oh GREAT, another Monday :) #blessed',
+         'I just LOVE waiting in line for hours...',
+         'what a great day',
+         '@someone Thanks a lot, really http://t.co/x',
+         'Great great GREAT'] * 3
+
+
+def ngrams_of(point):
+    return point
+
+
+def blocks() -> list:
+    points = list(map(iotypes.SvNgrams, texts))
+    return [points[:4], points[4:5], [], points[5:]]
+
+
+class ExtractParallelTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.root_dir, 'features.npy')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def assertMatchesSerial(self, fe, features: list, blocks_: list):
+        self.assertEqual(len(features), len(blocks_))
+        for block_features, block in zip(features, blocks_):
+            expected = fe.extract_batch(block)
+            if scipy.sparse.issparse(expected):
+                self.assertTrue(scipy.sparse.isspmatrix_csr(block_features))
+                expected = expected.toarray()
+                block_features = block_features.toarray()
+            self.assertEqual(block_features.dtype, np.float32)
+            self.assertEqual(block_features.shape, (len(block), fe.dim()))
+            np.testing.assert_allclose(block_features, expected, rtol=1e-6)
+
+    def test_dense_into_memmap(self):
+        fe = PosFeatureExtractor(ngrams_of)
+        blocks_ = blocks()
+        features = extract_parallel(fe, blocks_, self.path, workers=2)
+        self.assertMatchesSerial(fe, features, blocks_)
+        self.assertTrue(all(isinstance(block_features, np.memmap)
+                            for block_features, block in zip(features, blocks_)
+                            if len(block) > 0))
+        self.assertEqual(np.load(self.path).shape,
+                         (len(texts), fe.dim()))
+
+    def test_sparse_stays_sparse(self):
+        blocks_ = blocks()
+        for fe in [NGramFrequencyFeatureExtractor(
+                       ngrams_of, ['great', 'a', 'love'], sparse=True),
+                   HashedNGramFeatureExtractor(ngrams_of, nr_buckets=32)]:
+            features = extract_parallel(fe, blocks_, self.path, workers=2)
+            self.assertMatchesSerial(fe, features, blocks_)
+            self.assertFalse(os.path.exists(self.path))
+
+    def test_block_rows(self):
+        self.assertEqual(block_rows(blocks()),
+                         [slice(0, 4), slice(4, 5), slice(5, 5),
+                          slice(5, 15)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import scipy.sparse
+
+from dataio import iotypes
+from ml.feature_extractors.pos import PosFeatureExtractor
+from ml.feature_extractors.store import FeatureStore
+from ml.feature_extractors.vocabulary_based import \
+    NGramFrequencyFeatureExtractor
+
+texts = ['Oh GREAT, another Monday :) #blessed',
+         'I just LOVE waiting in line for hours...',
+         'what a great day',
+         '@someone Thanks a lot, really http://t.co/x',
+         'Great great GREAT',
+         'sarcasm is the lowest form of wit D:'] * 4
+vocabulary = ['great', 'day', 'a', 'love', 'lot', 'monday']
+
+
+def points() -> list:
+    """
+    (id, NGrams) points.
+    """
+    return [(idx, iotypes.SvNgrams(text)) for idx, text in enumerate(texts)]
+
+
+def ngrams_of(point):
+    return point[1]
+
+
+def point_id(point):
+    return point[0]
+
+
+def blocks_of(points_: list) -> list:
+    """
+    Points split into blocks of 4, keyed by (user, class).
+    """
+    return [((start // 8, start // 4 % 2), points_[start:start + 4])
+            for start in range(0, len(points_), 4)]
+
+
+def files_under(path: str) -> list:
+    return sorted(os.path.relpath(os.path.join(dir_path, file_name), path)
+                  for dir_path, _, file_names in os.walk(path)
+                  for file_name in file_names)
+
+
+class FeatureStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_extracts_once(self):
+        fe = PosFeatureExtractor(ngrams_of)
+        store = FeatureStore(self.root_dir, fe, point_id)
+        points_ = points()[:4]
+        self.assertIsNone(store.get((0, 0), points_))
+        features = store.get_or_extract((0, 0), points_)
+        np.testing.assert_allclose(features, fe.extract_batch(points_),
+                                   rtol=1e-6)
+        self.assertEqual(features.dtype, np.float32)
+        self.assertIsInstance(store.get((0, 0), points_), np.memmap)
+
+    def test_points_of_same_count_are_not_stale(self):
+        fe = PosFeatureExtractor(ngrams_of)
+        store = FeatureStore(self.root_dir, fe, point_id)
+        points_ = points()
+        store.get_or_extract((0, 0), points_[:4])
+        features = store.get_or_extract((0, 0), points_[4:8])
+        np.testing.assert_allclose(features, fe.extract_batch(points_[4:8]),
+                                   rtol=1e-6)
+        self.assertIsNone(store.get((0, 0), points_[:4]))
+        # The features of the old points are replaced, not kept
+        self.assertEqual(len(os.listdir(os.path.join(store.dir, '0'))), 1)
+
+    def test_config_changes_directory(self):
+        store = FeatureStore(self.root_dir, NGramFrequencyFeatureExtractor(
+            ngrams_of, vocabulary), point_id)
+        other_store = FeatureStore(
+            self.root_dir,
+            NGramFrequencyFeatureExtractor(ngrams_of, vocabulary[:-1]),
+            point_id)
+        self.assertNotEqual(store.dir, other_store.dir)
+
+    def test_load_blocks_maps_without_copies(self):
+        fe = PosFeatureExtractor(ngrams_of)
+        store = FeatureStore(self.root_dir, fe, point_id)
+        blocks = blocks_of(points())
+        store.extract_all(blocks)
+        files = files_under(store.dir)
+        loaded = store.load_blocks(blocks[::-1])
+        self.assertTrue(all(isinstance(block_features, np.memmap)
+                            for block_features in loaded))
+        np.testing.assert_allclose(
+            store.load_stacked(blocks),
+            fe.extract_batch([point for _, block in blocks
+                              for point in block]), rtol=1e-6)
+        self.assertEqual(files_under(store.dir), files)
+
+    def test_sparse(self):
+        fe = NGramFrequencyFeatureExtractor(ngrams_of, vocabulary,
+                                            sparse=True)
+        store = FeatureStore(self.root_dir, fe, point_id)
+        blocks = blocks_of(points())
+        store.extract_all(blocks)
+        self.assertTrue(all(path.endswith('.npz')
+                            for path in files_under(store.dir)
+                            if path != 'config.txt'))
+        features = store.load_stacked(blocks)
+        self.assertTrue(scipy.sparse.isspmatrix_csr(features))
+        np.testing.assert_allclose(
+            features.toarray(),
+            fe.extract_batch([point for _, block in blocks
+                              for point in block]).toarray(), rtol=1e-6)
+
+    def test_parallel_matches_serial(self):
+        blocks = blocks_of(points())
+        for fe in [PosFeatureExtractor(ngrams_of),
+                   NGramFrequencyFeatureExtractor(ngrams_of, vocabulary,
+                                                  sparse=True)]:
+            serial = FeatureStore(os.path.join(self.root_dir, 'serial'), fe,
+                                  point_id)
+            serial.extract_all(blocks)
+            parallel = FeatureStore(os.path.join(self.root_dir, 'parallel'),
+                                    fe, point_id)
+            parallel.extract_all(blocks, workers=2)
+            for serial_block, parallel_block in zip(
+                    serial.load_blocks(blocks), parallel.load_blocks(blocks)):
+                self.assertEqual(scipy.sparse.issparse(parallel_block),
+                                 scipy.sparse.issparse(serial_block))
+                if scipy.sparse.issparse(serial_block):
+                    serial_block = serial_block.toarray()
+                    parallel_block = parallel_block.toarray()
+                np.testing.assert_array_equal(parallel_block, serial_block)
+            # Only the blocks are left, not the matrix workers wrote into
+            self.assertEqual(
+                [path for path in files_under(parallel.dir)
+                 if not path.startswith('extracting')],
+                files_under(parallel.dir))
+
+    def test_missing_block(self):
+        store = FeatureStore(self.root_dir, PosFeatureExtractor(ngrams_of),
+                             point_id)
+        with self.assertRaises(KeyError):
+            store.load_stacked(blocks_of(points()))
+        self.assertEqual(store.load_stacked([]).shape,
+                         (0, PosFeatureExtractor(ngrams_of).dim()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+
+import numpy as np
+import scipy.sparse
+
+from dataio import iotypes
+from ml.feature_extractors.capitalization import \
+    CapitalizationFeatureExtractor
+from ml.feature_extractors.historical_salient_terms import (
+    HSTFrequencyFeatureExtractor, HSTGlobalIndicatorFeatureExtractor)
+from ml.feature_extractors.pos import PosFeatureExtractor
+from ml.feature_extractors.pronunciation import PronunciationFeatureExtractor
+from ml.feature_extractors.union import FeatureUnion
+from ml.feature_extractors.vocabulary_based import (
+    HashedNGramFeatureExtractor, NGramFrequencyFeatureExtractor,
+    NGramIndicatorFeatureExtractor)
+
+texts = [
+    'Oh GREAT, another Monday :) #blessed',
+    'I just LOVE waiting in line for hours...',
+    'what a great day',
+    '@someone Thanks a lot, really http://t.co/x',
+    'Great great GREAT',
+    'sarcasm is the lowest form of wit D:'
+]
+vocabulary = ['great', 'day', 'a', 'love', 'lot', 'great day', 'a lot']
+hst = {0: ['great', 'monday'], 1: ['love', 'day', 'wit']}
+
+
+def points() -> list:
+    """
+    (uid, NGrams) points, whose NGrams are shared by all extractors.
+    """
+    return [(idx % 2, iotypes.SvNgrams(text))
+            for idx, text in enumerate(texts)]
+
+
+def ngrams_of(point):
+    return point[1]
+
+
+def dense_parts() -> list:
+    return [
+        ('pos', PosFeatureExtractor(ngrams_of)),
+        ('caps', CapitalizationFeatureExtractor(ngrams_of)),
+        ('frequency', NGramFrequencyFeatureExtractor(
+            ngrams_of, vocabulary, should_normalise=True)),
+        ('pronunciation', PronunciationFeatureExtractor(ngrams_of)),
+        ('bigrams', NGramIndicatorFeatureExtractor(
+            ngrams_of, vocabulary, n=2)),
+        ('hst', HSTFrequencyFeatureExtractor(lambda point: point, hst))
+    ]
+
+
+def sparse_parts() -> list:
+    return [
+        ('hashed', HashedNGramFeatureExtractor(ngrams_of, nr_buckets=64)),
+        ('global_hst', HSTGlobalIndicatorFeatureExtractor(
+            lambda point: point, hst, sparse=True))
+    ]
+
+
+def stacked(parts: list, points_: list):
+    features = [extractor.extract_batch(points_) for _, extractor in parts]
+    if any(map(scipy.sparse.issparse, features)):
+        return scipy.sparse.hstack(features, format='csr')
+    return np.hstack(features)
+
+
+class FeatureUnionTest(unittest.TestCase):
+    def test_dense_equals_stacked_parts(self):
+        parts = dense_parts()
+        union = FeatureUnion(parts)
+        points_ = points()
+        features = union.extract_batch(points_)
+        np.testing.assert_allclose(features, stacked(parts, points_))
+        self.assertEqual(features.shape, (len(points_), union.dim()))
+        for point, row in zip(points_, features):
+            np.testing.assert_allclose(union.extract(point), row)
+
+    def test_layout(self):
+        parts = dense_parts()
+        union = FeatureUnion(parts)
+        points_ = points()
+        features = union.extract_batch(points_)
+        for name, extractor in parts:
+            np.testing.assert_allclose(features[:, union.layout[name]],
+                                       extractor.extract_batch(points_))
+
+    def test_sparse_parts(self):
+        parts = dense_parts()[:2] + sparse_parts() + dense_parts()[2:3]
+        union = FeatureUnion(parts)
+        points_ = points()
+        features = union.extract_batch(points_)
+        self.assertTrue(scipy.sparse.isspmatrix_csr(features))
+        np.testing.assert_allclose(features.toarray(),
+                                   stacked(parts, points_).toarray())
+        np.testing.assert_allclose(union.extract(points_[0]).toarray(),
+                                   features[0].toarray())
+
+    def test_empty_batch(self):
+        union = FeatureUnion(dense_parts())
+        self.assertEqual(union.extract_batch([]).shape, (0, union.dim()))
+
+
+if __name__ == '__main__':
+    unittest.main()
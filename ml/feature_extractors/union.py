@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from typing import Dict, Sequence, Tuple, TypeVar
+
+import numpy as np
+import scipy.sparse
+
+from basic import functions
+from ml.feature_extractors.feature_extractor import (
+    FeatureExtractor, TokenBatch, reads_token_batches)
+
+TweetT = TypeVar('TweetT')
+
+
+class FeatureUnion(FeatureExtractor[TweetT, TweetT, np.ndarray]):
+    """
+    Concatenation of the features of several named extractors, each written
+    into its own slice of a single feature vector (see layout); a CSR matrix
+    if any of them gives sparse features.
+    Extractors that read the same sequence of tokens, that is, whose data
+    extractors give them the same object, read it once: in a batch, those
+    that read token batches share a single TokenBatch of the tokens of all
+    points; point by point, those that walk tokens share a single walk over
+    them, each token being passed to all of their accumulators in turn.
+    """
+
+    def __init__(self, extractors: Sequence[Tuple[str, FeatureExtractor]]):
+        super().__init__(functions.id)
+        self._extractors = []
+        self._layout = OrderedDict()
+        start = 0
+        for name, extractor in extractors:
+            assert name not in self._layout, 'duplicate extractor ' + name
+            dim = extractor.dim()
+            assert dim is not None, name + ' has no fixed dim'
+            self._layout[name] = slice(start, start + dim)
+            self._extractors.append((extractor, self._layout[name]))
+            start += dim
+        self._dim = start
+
+    @property
+    def layout(self) -> Dict[str, slice]:
+        """
+        Slice of the feature vector holding the features of each extractor.
+        """
+        return self._layout
+
+    def dim(self) -> int:
+        return self._dim
+
+    def config(self) -> str:
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={}'.format(name, extractor.config())
+            for name, (extractor, _) in zip(self._layout, self._extractors)))
+
+    def _nr_tokens(self, point: TweetT) -> int:
+        # Instrumentation counts the tokens of the data of its extractors
+        return 0
+
+    def _extract(self, point: TweetT):
+        features = self.extract_batch([point])
+        if scipy.sparse.issparse(features):
+            return features
+        return features[0]
+
+    def _extract_into(self, point: TweetT, out: np.ndarray):
+        self._walk(point, out, self._extractors)
+
+    def extract_batch(self, points: Sequence[TweetT]):
+        """
+        Extractors that read token batches fill their slice of the whole
+        batch from the batch of their tokens, shared with the others reading
+        the same tokens; those that walk tokens walk the tokens of each point
+        together; the others give their own, possibly vectorized or sparse,
+        extract_batch.
+        """
+        features = np.zeros((len(points), self._dim))
+        sparse_features = {}
+        token_batches = OrderedDict()
+        walking = []
+        for idx, (extractor, out_slice) in enumerate(self._extractors):
+            if reads_token_batches(extractor):
+                tokens_per_row = [extractor._data_extractor(point)
+                                  for point in points]
+                tokens_ids = tuple(map(id, tokens_per_row))
+                batch = token_batches.get(tokens_ids)
+                if batch is None:
+                    batch = token_batches[tokens_ids] = \
+                        TokenBatch(tokens_per_row)
+                extractor._extract_token_batch(batch, features[:, out_slice])
+            elif _walks_tokens(extractor):
+                walking.append((extractor, out_slice))
+            else:
+                extractor_features = extractor.extract_batch(points)
+                if scipy.sparse.issparse(extractor_features):
+                    sparse_features[idx] = extractor_features
+                else:
+                    features[:, out_slice] = extractor_features
+        if len(walking) > 0:
+            for point, row in zip(points, features):
+                self._walk(point, row, walking)
+        if len(sparse_features) == 0:
+            return features
+        return scipy.sparse.hstack([
+            sparse_features.get(idx, features[:, out_slice])
+            for idx, (_, out_slice) in enumerate(self._extractors)],
+            format='csr')
+
+    @staticmethod
+    def _walk(point: TweetT, out: np.ndarray,
+              extractors: Sequence[Tuple[FeatureExtractor, slice]]):
+        walks = OrderedDict()
+        finishes = []
+        for extractor, out_slice in extractors:
+            data = extractor._data_extractor(point)
+            extractor_out = out[out_slice]
+            token_pass = extractor._token_pass(data, extractor_out)
+            if token_pass is None:
+                extractor._extract_into(data, extractor_out)
+                continue
+            tokens, accumulate, finish = token_pass
+            walk = walks.get(id(tokens))
+            if walk is None:
+                walk = walks[id(tokens)] = (tokens, [])
+            walk[1].append(accumulate)
+            finishes.append(finish)
+
+        for tokens, accumulates in walks.values():
+            if len(accumulates) == 1:
+                accumulate, = accumulates
+                for token in tokens:
+                    accumulate(token)
+            else:
+                for token in tokens:
+                    for accumulate in accumulates:
+                        accumulate(token)
+        for finish in finishes:
+            finish()
+
+
+def _walks_tokens(extractor: FeatureExtractor) -> bool:
+    return type(extractor)._token_pass is not FeatureExtractor._token_pass
@@ -1,59 +1,217 @@
 import logging
 import numpy as np
+import scipy.sparse
 from itertools import count
-from typing import Callable, Sequence, TypeVar
-from nltk.util import ngrams as nltk_util_ngrams
+from typing import Callable, Dict, Iterable, List, Sequence, TypeVar
 
+from basic import functions
 from dataio import iotypes
-from ml.feature_extractors.feature_extractor import FeatureExtractor
+from ml.feature_extractors.feature_extractor import (
+    FeatureExtractor, TokenPass, config_digest, sparse_row, sparse_rows)
+from tokenization import tokens
 
 logger = logging.getLogger('ml.feature_extractors.vocabulary_based')
 TweetT = TypeVar('TweetT')
 
 
+def _of_order(vocabulary: Iterable[str], n: int) -> List[str]:
+    """
+    The n-grams of a vocabulary of n-grams of any order, eg. an
+    NGramVocabularyStat, n-grams being their words joined by spaces.
+    """
+    return [ngram for ngram in vocabulary if ngram.count(' ') == n - 1]
+
+
+def _ngrams_of(ngrams_obj: iotypes.NGrams, n: int) -> Sequence:
+    # The unigrams are the NGrams itself, which lets FeatureUnion walk them
+    # together with extractors that get the same NGrams as their tokens.
+    # Longer n-grams are looked up like vocabulary entries, by their words
+    # joined by spaces
+    if n == 1:
+        return ngrams_obj
+    return list(map(tokens.Token, map(' '.join, ngrams_obj.ngrams(n))))
+
+
+def _vocab_idxs(ngrams_obj: iotypes.NGrams, n: int,
+                word_to_vocab_idx: Dict[str, int]) -> List[int]:
+    idxs = []
+    for ngram in _ngrams_of(ngrams_obj, n):
+        idx_in_vocab = word_to_vocab_idx.get(ngram.extract().lower())
+        if idx_in_vocab is not None:
+            idxs.append(idx_in_vocab)
+    return idxs
+
+
 class NGramFrequencyFeatureExtractor(
         FeatureExtractor[TweetT, iotypes.NGrams, np.ndarray]):
+    """
+    Histogram of the n-grams over vocabulary; a 1 x len(vocabulary) sparse
+    row instead of a dense array if sparse.
+    """
+
     def __init__(self, data_extractor: Callable[[TweetT], iotypes.NGrams],
                  vocabulary: Sequence[str], n: int = 1,
-                 should_normalise: bool = False):
+                 should_normalise: bool = False, sparse: bool = False):
         super().__init__(data_extractor)
-        if n > 1:
-            vocabulary = nltk_util_ngrams(vocabulary, n)
+        vocabulary = _of_order(vocabulary, n)
         self._n = n
         self._should_normalise = should_normalise
+        self._sparse = sparse
         self._word_to_vocab_idx = dict(zip(vocabulary, count()))
+        self._vocabulary_digest = config_digest(self._word_to_vocab_idx)
+
+    def dim(self) -> int:
+        return len(self._word_to_vocab_idx)
+
+    def config(self) -> str:
+        return '{}(n={}, normalise={}, sparse={}, vocabulary={})'.format(
+            self.__class__.__name__, self._n, self._should_normalise,
+            self._sparse, self._vocabulary_digest)
 
     def _extract(self, ngrams_obj: iotypes.NGrams) -> np.ndarray:
-        ngrams = ngrams_obj.ngrams(self._n)
-        histogram = np.zeros(len(self._word_to_vocab_idx))
-        for ngram in ngrams:
-            idx_in_vocab = self._word_to_vocab_idx.get(ngram.extract().lower())
+        if self._sparse:
+            idxs = _vocab_idxs(ngrams_obj, self._n, self._word_to_vocab_idx)
+            return sparse_row(idxs, self.dim(),
+                              normalise=self._should_normalise)
+        return super()._extract(ngrams_obj)
+
+    def _token_pass(self, ngrams_obj: iotypes.NGrams,
+                    out: np.ndarray) -> TokenPass:
+        word_to_vocab_idx = self._word_to_vocab_idx
+
+        def accumulate(ngram):
+            idx_in_vocab = word_to_vocab_idx.get(ngram.extract().lower())
             if idx_in_vocab is not None:
-                histogram[idx_in_vocab] += 1
-        if self._should_normalise:
-            histogram_sum = sum(histogram)
-            if histogram_sum > 0:
-                histogram = histogram / sum(histogram)
-        return histogram
+                out[idx_in_vocab] += 1
+
+        def finish():
+            if self._should_normalise:
+                histogram_sum = out.sum()
+                if histogram_sum > 0:
+                    out[:] /= histogram_sum
+
+        return _ngrams_of(ngrams_obj, self._n), accumulate, finish
+
+    def extract_batch(self, points: Sequence[TweetT]):
+        if self._sparse:
+            return sparse_rows(
+                (_vocab_idxs(self._data_extractor(point), self._n,
+                             self._word_to_vocab_idx)
+                 for point in points),
+                self.dim(), normalise=self._should_normalise)
+        return super().extract_batch(points)
 
 
 class NGramIndicatorFeatureExtractor(
         FeatureExtractor[TweetT, iotypes.NGrams, np.ndarray]):
+    """
+    Indicator of the n-grams in vocabulary; a 1 x len(vocabulary) sparse
+    row instead of a dense array if sparse.
+    """
+
     def __init__(self, data_extractor: Callable[[TweetT], iotypes.NGrams],
                  vocabulary: Sequence[str], n: int = 1,
-                 should_normalise: bool = False):
+                 should_normalise: bool = False, sparse: bool = False):
         super().__init__(data_extractor)
-        if n > 1:
-            vocabulary = nltk_util_ngrams(vocabulary, n)
+        vocabulary = _of_order(vocabulary, n)
         self._n = n
         self._should_normalise = should_normalise
+        self._sparse = sparse
         self._word_to_vocab_idx = dict(zip(vocabulary, count()))
+        self._vocabulary_digest = config_digest(self._word_to_vocab_idx)
+
+    def dim(self) -> int:
+        return len(self._word_to_vocab_idx)
+
+    def config(self) -> str:
+        return '{}(n={}, normalise={}, sparse={}, vocabulary={})'.format(
+            self.__class__.__name__, self._n, self._should_normalise,
+            self._sparse, self._vocabulary_digest)
 
     def _extract(self, ngrams_obj: iotypes.NGrams) -> np.ndarray:
-        ngrams = ngrams_obj.ngrams(self._n)
-        indicator = np.zeros(len(self._word_to_vocab_idx))
-        for ngram in ngrams:
-            idx_in_vocab = self._word_to_vocab_idx.get(ngram.extract().lower())
+        if self._sparse:
+            idxs = _vocab_idxs(ngrams_obj, self._n, self._word_to_vocab_idx)
+            return sparse_row(idxs, self.dim(), binary=True)
+        return super()._extract(ngrams_obj)
+
+    def _token_pass(self, ngrams_obj: iotypes.NGrams,
+                    out: np.ndarray) -> TokenPass:
+        word_to_vocab_idx = self._word_to_vocab_idx
+
+        def accumulate(ngram):
+            idx_in_vocab = word_to_vocab_idx.get(ngram.extract().lower())
             if idx_in_vocab is not None:
-                indicator[idx_in_vocab] = 1
-        return indicator
+                out[idx_in_vocab] = 1
+
+        return _ngrams_of(ngrams_obj, self._n), accumulate, functions.noop
+
+    def extract_batch(self, points: Sequence[TweetT]):
+        if self._sparse:
+            return sparse_rows(
+                (_vocab_idxs(self._data_extractor(point), self._n,
+                             self._word_to_vocab_idx)
+                 for point in points),
+                self.dim(), binary=True)
+        return super().extract_batch(points)
+
+
+class HashedNGramFeatureExtractor(
+        FeatureExtractor[TweetT, iotypes.NGrams, scipy.sparse.csr_matrix]):
+    """
+    Maps the lowercased n-grams into nr_buckets features by their ids (see
+    NGrams.ngram_ids), without a vocabulary: the low bits of an id pick the
+    bucket and its top bit the sign, +1 or -1, so that colliding n-grams
+    tend to cancel out instead of adding up. Returns a 1 x nr_buckets sparse
+    row holding the signed n-gram counts or, if indicator, the signed count
+    of distinct n-grams per bucket.
+    """
+
+    def __init__(self, data_extractor: Callable[[TweetT], iotypes.NGrams],
+                 nr_buckets: int = 2 ** 18, n: int = 1,
+                 indicator: bool = False, should_normalise: bool = False):
+        super().__init__(data_extractor)
+        self._nr_buckets = nr_buckets
+        self._n = n
+        self._indicator = indicator
+        self._should_normalise = should_normalise
+
+    def dim(self) -> int:
+        return self._nr_buckets
+
+    def config(self) -> str:
+        return '{}(nr_buckets={}, n={}, indicator={}, normalise={})'.format(
+            self.__class__.__name__, self._nr_buckets, self._n,
+            self._indicator, self._should_normalise)
+
+    def _buckets_and_signs(self, ngrams_obj: iotypes.NGrams):
+        ids = ngrams_obj.ngram_ids(self._n, case_sensitive=False)
+        if self._indicator:
+            ids = np.unique(ids)
+        buckets = (ids % np.uint64(self._nr_buckets)).astype(np.int64)
+        signs = 1.0 - 2.0 * (ids >> np.uint64(63)).astype(np.float64)
+        if self._should_normalise and len(ids) > 0:
+            signs /= len(ids)
+        return buckets, signs
+
+    def _rows(self, ngrams_objs: Iterable[iotypes.NGrams]
+              ) -> scipy.sparse.csr_matrix:
+        all_buckets = []
+        all_signs = []
+        rows = []
+        for row, ngrams_obj in enumerate(ngrams_objs):
+            buckets, signs = self._buckets_and_signs(ngrams_obj)
+            all_buckets.append(buckets)
+            all_signs.append(signs)
+            rows.append(np.full(len(buckets), row, dtype=np.int64))
+        if len(rows) == 0:
+            return scipy.sparse.csr_matrix((0, self._nr_buckets))
+        return scipy.sparse.csr_matrix(
+            (np.concatenate(all_signs),
+             (np.concatenate(rows), np.concatenate(all_buckets))),
+            shape=(len(rows), self._nr_buckets))
+
+    def _extract(self, ngrams_obj: iotypes.NGrams) -> scipy.sparse.csr_matrix:
+        return self._rows([ngrams_obj])
+
+    def extract_batch(self, points: Sequence[TweetT]) -> scipy.sparse.csr_matrix:
+        return self._rows(map(self._data_extractor, points))
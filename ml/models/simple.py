@@ -10,13 +10,15 @@ class BinaryLogisticRegression(Model):
                  optimizer='adam',
                  l2_param=0.01,
                  nickname=None,
-                 metrics=None):
+                 metrics=None,
+                 sparse=False):
         if metrics is None:
             metrics = ['binary_accuracy']
         if nickname is None:
             nickname = ('{}({})'.format(self.__class__.__name__, l2_param))
 
         self._input_size = input_size
+        self._sparse = sparse
         self._loss = loss
         self._activation = activation
         self._optimizer = optimizer
@@ -25,7 +27,7 @@ class BinaryLogisticRegression(Model):
         super().__init__(nickname)
 
     def _create_model(self):
-        x = K.layers.Input(shape=(self._input_size,))
+        x = K.layers.Input(shape=(self._input_size,), sparse=self._sparse)
         y = K.layers.Dense(1, activation='sigmoid', kernel_regularizer=self._kernel_regularizer)(x)
         model = K.Model(inputs=x, outputs=y)
         model.compile(optimizer=self._optimizer, loss=self._loss, metrics=self._metrics)
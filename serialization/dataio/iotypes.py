@@ -1,11 +1,17 @@
 from dataio import iotypes
 from serialization import JsonSerializer, JsonDeserializer
+from serialization.tokenization.compact import (
+    TokenTableSerializer, TokenTableDeserializer)
 from serialization.tokenization.tokens import TokenSerializer, TokenDeserializer
 
 
 class NGramsSerializer(JsonSerializer[iotypes.NGrams]):
     @staticmethod
     def to_json(t: iotypes.NGrams) -> dict:
+        if t.is_compact():
+            return {
+                'unigrams': TokenTableSerializer.to_json(t.table())
+            }
         return {
             'unigrams': [TokenSerializer.to_json(u) for u in t]
         }
@@ -17,3 +23,10 @@ class NGramsDeserializer(JsonDeserializer[iotypes.NGrams]):
         assert isinstance(j['unigrams'], list)
         unigrams = [TokenDeserializer.from_json(ij) for ij in j['unigrams']]
         return iotypes.NGrams(unigrams)
+
+
+class CompactNGramsDeserializer(JsonDeserializer[iotypes.NGrams]):
+    @staticmethod
+    def from_json(j: dict) -> iotypes.NGrams:
+        assert isinstance(j['unigrams'], list)
+        return iotypes.NGrams(TokenTableDeserializer.from_json(j['unigrams']))
@@ -1,6 +1,33 @@
+from typing import Tuple, Union
+
 from basic.dcollections import setlist
-from serialization import JsonSerializer, JsonDeserializer
-from staging.pipeline.stats import HstStat, TopicsStat
+from serialization import Deserializer, JsonSerializer, JsonDeserializer
+from serialization.serializers import SvSerializer
+from serialization.tokenization.tokens import TokenSerializer, TokenDeserializer
+from staging.pipeline.stats import (
+    HstStat, HstState, NGramVocabularyState, TopicsStat)
+from tokenization import tokens
+
+NGramCount = Tuple[str, int]
+
+
+class NGramCountSerializer(SvSerializer[NGramCount]):
+    """
+    An n-gram of an NGramVocabularyStat and its count, tab separated; the
+    line number of an n-gram in the vocabulary file is its id.
+    """
+    sep = '\t'
+
+    @staticmethod
+    def to_sv(t: NGramCount) -> list:
+        return [t[0], str(t[1])]
+
+
+class NGramCountDeserializer(Deserializer[NGramCount]):
+    @staticmethod
+    def deserialize(s: str) -> NGramCount:
+        ngram, count = s.strip().rsplit('\t', 1)
+        return ngram, int(count)
 
 
 class HstStatSerializer(JsonSerializer[HstStat]):
@@ -36,3 +63,77 @@ class TopicsStatDeserializer(JsonDeserializer[TopicsStat]):
         assert isinstance(j['uid'], int)
         assert isinstance(j['topics'], list)
         return TopicsStat(j['uid'], j['topics'])
+
+
+# Terms of the partial states of stat builders are tokens, whose types
+# matter when comparing them, or strings, eg. read from a previous vocabulary
+def _term_to_json(term: Union[str, tokens.Token]):
+    if isinstance(term, tokens.Token):
+        return TokenSerializer.to_json(term)
+    return term
+
+
+def _term_from_json(j) -> Union[str, tokens.Token]:
+    if isinstance(j, str):
+        return j
+    return TokenDeserializer.from_json(j)
+
+
+class VocabularyStateSerializer(JsonSerializer[list]):
+    @staticmethod
+    def to_json(t: list) -> dict:
+        return {
+            'vocab': [_term_to_json(term) for term in t]
+        }
+
+
+class VocabularyStateDeserializer(JsonDeserializer[list]):
+    @staticmethod
+    def from_json(j: dict) -> list:
+        assert isinstance(j['vocab'], list)
+        return [_term_from_json(tj) for tj in j['vocab']]
+
+
+class NGramVocabularyStateSerializer(JsonSerializer[NGramVocabularyState]):
+    @staticmethod
+    def to_json(t: NGramVocabularyState) -> dict:
+        return {
+            'n': t.n,
+            'min_count': t.min_count,
+            'max_size': t.max_size,
+            'capacity': t.capacity,
+            'floor': t.floor,
+            'counts': t.counts
+        }
+
+
+class NGramVocabularyStateDeserializer(
+        JsonDeserializer[NGramVocabularyState]):
+    @staticmethod
+    def from_json(j: dict) -> NGramVocabularyState:
+        assert isinstance(j['counts'], list)
+        return NGramVocabularyState(
+            j['n'], j['min_count'], j['max_size'], j['capacity'], j['floor'],
+            [(ngram, count) for ngram, count in j['counts']])
+
+
+class HstStateSerializer(JsonSerializer[HstState]):
+    @staticmethod
+    def to_json(t: HstState) -> dict:
+        return {
+            'uid': t.uid,
+            'nr_terms': t.nr_terms,
+            'nr_docs': t.nr_docs,
+            'terms': [[_term_to_json(term), max_tf, df]
+                      for term, max_tf, df in t.term_max_tf_df]
+        }
+
+
+class HstStateDeserializer(JsonDeserializer[HstState]):
+    @staticmethod
+    def from_json(j: dict) -> HstState:
+        assert isinstance(j['uid'], int)
+        assert isinstance(j['terms'], list)
+        return HstState(j['uid'], j['nr_terms'], j['nr_docs'], [
+            (_term_from_json(tj), max_tf, df)
+            for tj, max_tf, df in j['terms']])
@@ -1,6 +1,7 @@
 from dataio import iotypes
 from serialization import JsonSerializer, JsonDeserializer
-from serialization.dataio.iotypes import NGramsSerializer, NGramsDeserializer
+from serialization.dataio.iotypes import (
+    CompactNGramsDeserializer, NGramsSerializer)
 from staging.pipeline.types import User_Tweet, Example, Tweet
 
 
@@ -63,14 +64,31 @@ class TweetDeserializer(JsonDeserializer[Tweet]):
             assert isinstance(j['in_reply_to_user_id'], int)
         if 'retweeted' in j:
             assert isinstance(j['retweeted'], bool)
-        return Tweet(j['id'], j['uid'], NGramsDeserializer.from_json(j['text']),
+        return Tweet(j['id'], j['uid'],
+                     CompactNGramsDeserializer.from_json(j['text']),
                      j['lang'], j['truncated'], j.get('in_reply_to_status_id'),
                      j.get('in_reply_to_user_id'), j.get('retweeted'))
 
 
 class RawTweetDeserializer(JsonDeserializer[Tweet]):
+    """
+    Tweets of the raw Twitter JSON, whose text is turned into NGrams by
+    ngrams_builder the first time it is needed.
+    """
+
+    ngrams_builder = staticmethod(iotypes.SvNgrams)
+
     @staticmethod
-    def from_json(j: dict) -> Tweet:
+    def build(ngrams_builder):
+        """
+        A RawTweetDeserializer whose texts are built by ngrams_builder, eg.
+        one of NGrams.get_builder over a CachingStringTokenizer.
+        """
+        return type('RawTweetDeserializer', (RawTweetDeserializer,),
+                    {'ngrams_builder': staticmethod(ngrams_builder)})
+
+    @classmethod
+    def from_json(cls, j: dict) -> Tweet:
         assert isinstance(j['id'], int)
         assert isinstance(j['user'], dict)
         assert isinstance(j['user']['id'], int)
@@ -87,7 +105,8 @@ class RawTweetDeserializer(JsonDeserializer[Tweet]):
         if 'retweeted_status' in j:
             assert isinstance(j['retweeted_status'], dict)
             retweeted = True
-        tweet = Tweet(j['id'], j['user']['id'], iotypes.SvNgrams(j['text']),
+        text = iotypes.LazyNGrams(j['text'], cls.ngrams_builder)
+        tweet = Tweet(j['id'], j['user']['id'], text,
                       j['lang'], j['truncated'], j.get('in_reply_to_status_id'),
                       j.get('in_reply_to_user_id'), retweeted)
         return tweet
@@ -0,0 +1,35 @@
+import numpy as np
+
+from serialization import JsonSerializer, JsonDeserializer
+from tokenization import tokens
+from tokenization.compact import (
+    StringTable, TokenTable, STRING_ID_DTYPE, TYPE_CODE_DTYPE,
+    default_string_table)
+
+type_names = [token_type.__name__ for token_type in tokens.all_token_types]
+type_name_to_code = {name: code for code, name in enumerate(type_names)}
+
+
+# A TokenTable is written in the same format as a list of TokenSerializer
+# objects, so that compact and regular unigrams can read each other's output.
+class TokenTableSerializer(JsonSerializer[TokenTable]):
+    @staticmethod
+    def to_json(t: TokenTable) -> list:
+        return [{'type': type_names[code], 'string': text}
+                for code, text in zip(t.type_codes.tolist(), t.texts())]
+
+
+class TokenTableDeserializer(JsonDeserializer[TokenTable]):
+    @staticmethod
+    def from_json(j: list, strings: StringTable = None) -> TokenTable:
+        assert isinstance(j, list)
+        if strings is None:
+            strings = default_string_table
+        string_ids = np.empty(len(j), dtype=STRING_ID_DTYPE)
+        type_codes = np.empty(len(j), dtype=TYPE_CODE_DTYPE)
+        for idx, tj in enumerate(j):
+            assert isinstance(tj['type'], str)
+            assert isinstance(tj['string'], str)
+            string_ids[idx] = strings.intern(tj['string'])
+            type_codes[idx] = type_name_to_code[tj['type']]
+        return TokenTable(string_ids, type_codes, strings)
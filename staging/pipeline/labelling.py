@@ -10,12 +10,15 @@ from dataio import fileio, iotypes, iopipes
 from ml.feature_extractors.feature_extractor import FeatureExtractor
 from serialization.staging.pipeline.stats import (
     HstStatSerializer, TopicsStatSerializer, HstStatDeserializer,
-    TopicsStatDeserializer)
+    TopicsStatDeserializer, NGramCountSerializer, NGramCountDeserializer,
+    NGramVocabularyStateSerializer, NGramVocabularyStateDeserializer)
 from serialization.staging.pipeline.types import RawTweetDeserializer, ExampleSerializer, ExampleDeserializer
 from staging.pipeline.stats import (
-    VocabularyStatBuilder, HstStatBuilder, TopicsStatBuilder, AllStats)
+    VocabularyStatBuilder, NGramVocabularyStatBuilder, HstStatBuilder,
+    TopicsStatBuilder, AllStats)
 from staging.pipeline.types import Tweet, Example
-from tokenization import tokens
+from tokenization import tokenizers, tokens
+from tokenization.cache import CachingStringTokenizer
 
 logger = logging.getLogger('labelling')
 label_space = [0, 1]
@@ -40,11 +43,24 @@ def add_label(tweet: Tweet) -> Example:
 
 
 def valid_tweet(tweet: Tweet):
-    return tweet.lang == 'en' and len(tweet.text) > 3
+    if tweet.lang != 'en':
+        return False
+    try:
+        return len(tweet.text) > 3
+    except iotypes.TokenizerError:
+        return False
 
 
 def gen_examples_and_vocab(user_raw_dir_in: str, user_labelled_dir_out: str,
-                           stats_dir_out: str,  min_ex_per_user: int):
+                           stats_dir_out: str,  min_ex_per_user: int,
+                           ngram_n: int = 2, ngram_min_count: int = 2,
+                           ngram_max_size: int = 100000,
+                           tokenization_cache_file: str = None):
+    """
+    :param tokenization_cache_file: TokenizationStore of the tokenized tweet
+           texts, which later runs reuse instead of tokenizing them again, by
+           default tokenization_cache.sqlite in stats_dir_out
+    """
 
     vocab_file = os.path.join(stats_dir_out, 'vocabulary.txt')
     prev_vocab = []
@@ -52,35 +68,67 @@ def gen_examples_and_vocab(user_raw_dir_in: str, user_labelled_dir_out: str,
         prev_vocab = iopipes.Pipe.from_path(vocab_file)
     vocab = VocabularyStatBuilder(prev_vocab)
 
-    for path, u_tweet_it in iopipes.Pipe.named_from_path(
-            user_raw_dir_in, RawTweetDeserializer, min_ex_per_user):
-        uid = int(filesystem.name(path))
-        u_ex_it = map(add_label, filter(valid_tweet, u_tweet_it))
-
-        path_root = os.path.join(user_labelled_dir_out, str(uid))
-        ex_files_out = list(map(
-            lambda label: os.path.join(path_root, str(label) + '.json'),
-            label_space))
-        if not filesystem.readable_files(*ex_files_out):
-            logger.info('[generate_examples_and_vocab] '
-                        'Generating examples for user {}'.format(uid))
-            with fileio.FileDumpers(zip(label_space, ex_files_out),
-                                    ExampleSerializer,
-                                    mode=fileio.WriteModes.WRITE) as dumpers:
-                hst, topics = HstStatBuilder(uid), TopicsStatBuilder(uid)
-                labels_hist = defaultdict(int)
-                for ex in u_ex_it:
-                    hst.add(ex)
-                    topics.add(ex)
-                    vocab.add(ex)
-                    dumpers[ex.label].dump(ex)
-                    labels_hist[ex.label] += 1
-                logger.info('[generate_examples_and_stats] Done generating '
-                            'examples for user {}. Label class balance: {}'
-                            .format(uid, labels_hist))
+    # The vocabulary file only has the n-grams that survived pruning, so the
+    # counts carried over to later runs are those of the full builder state
+    ngram_vocab_file = os.path.join(stats_dir_out, 'ngram_vocabulary.tsv')
+    ngram_state_file = os.path.join(stats_dir_out,
+                                    'ngram_vocabulary_state.json')
+    ngram_vocab = NGramVocabularyStatBuilder(
+        ngram_n, ngram_min_count, ngram_max_size)
+    if filesystem.readable_file(ngram_state_file):
+        prev_ngram_vocab = NGramVocabularyStatBuilder.from_state(
+            fileio.file_to_type(ngram_state_file,
+                                NGramVocabularyStateDeserializer))
+        if prev_ngram_vocab.state().n == ngram_n:
+            ngram_vocab.merge(prev_ngram_vocab)
+        else:
+            logger.info('[generate_examples_and_vocab] Not reusing the '
+                        'counts of other n-grams in ' + ngram_state_file)
+
+    if tokenization_cache_file is None:
+        tokenization_cache_file = os.path.join(
+            stats_dir_out, 'tokenization_cache.sqlite')
+    with CachingStringTokenizer(tokenizers.CasualStringTokenizer(),
+                                tokenization_cache_file) as tokenizer:
+        tweet_deserializer = RawTweetDeserializer.build(
+            iotypes.NGrams.get_builder(tokenizer))
+        for path, u_tweet_it in iopipes.Pipe.named_from_path(
+                user_raw_dir_in, tweet_deserializer, min_ex_per_user):
+            uid = int(filesystem.name(path))
+            u_ex_it = map(add_label, filter(valid_tweet, u_tweet_it))
+
+            path_root = os.path.join(user_labelled_dir_out, str(uid))
+            ex_files_out = list(map(
+                lambda label: os.path.join(path_root, str(label) + '.json'),
+                label_space))
+            if not filesystem.readable_files(*ex_files_out):
+                logger.info('[generate_examples_and_vocab] '
+                            'Generating examples for user {}'.format(uid))
+                with fileio.FileDumpers(zip(label_space, ex_files_out),
+                                        ExampleSerializer,
+                                        mode=fileio.WriteModes.WRITE) as dumpers:
+                    hst, topics = HstStatBuilder(uid), TopicsStatBuilder(uid)
+                    labels_hist = defaultdict(int)
+                    for ex in u_ex_it:
+                        hst.add(ex)
+                        topics.add(ex)
+                        vocab.add(ex)
+                        ngram_vocab.add(ex)
+                        dumpers[ex.label].dump(ex)
+                        labels_hist[ex.label] += 1
+                    logger.info('[generate_examples_and_stats] Done generating '
+                                'examples for user {}. Label class balance: {}'
+                                .format(uid, labels_hist))
 
     logger.info('[generate_examples_and_stats] Done')
     fileio.it_to_file(vocab.get(), vocab_file, mode=fileio.WriteModes.WRITE)
+    fileio.it_to_file([ngram_vocab.state()], ngram_state_file,
+                      NGramVocabularyStateSerializer,
+                      mode=fileio.WriteModes.WRITE)
+    ngram_vocab_stat = ngram_vocab.get()
+    fileio.it_to_file(zip(ngram_vocab_stat.ngrams, ngram_vocab_stat.counts),
+                      ngram_vocab_file, NGramCountSerializer,
+                      mode=fileio.WriteModes.WRITE)
 
 
 def get_examples(users_labelled_dir_in: str, main_class: int, class_ratio: float):
@@ -113,6 +161,17 @@ def get_vocab(stats_dir_in: str):
     return list(iopipes.Pipe.from_path(vocab_file_in))
 
 
+def get_ngram_vocab(stats_dir_in: str):
+    """
+    The n-grams of the vocabulary written by gen_examples_and_vocab, by id,
+    ready for the n-gram extractors.
+    """
+    vocab_file_in = os.path.join(stats_dir_in, 'ngram_vocabulary.tsv')
+    logger.info('[get_ngram_vocab] Reading vocab from ' + vocab_file_in)
+    return [ngram for ngram, _ in
+            iopipes.Pipe.from_path(vocab_file_in, NGramCountDeserializer)]
+
+
 def get_stats(stats_dir_in: str):
     """
     :param stats_dir_in: path to a directory with structure
@@ -8,6 +8,7 @@ from basic.ditertools import filter_not, split, idiff, take
 from basic.stattools import histogram
 from dataio import fileio, iotypes, iopipes
 from ml.feature_extractors.feature_extractor import FeatureExtractor
+from ml.feature_extractors.store import FeatureStore
 from serialization.staging.pipeline.stats import (
     HstStatSerializer, TopicsStatSerializer, HstStatDeserializer,
     TopicsStatDeserializer)
@@ -15,7 +16,8 @@ from serialization.staging.pipeline.types import RawTweetDeserializer, ExampleSe
 from staging.pipeline.stats import (
     VocabularyStatBuilder, HstStatBuilder, TopicsStatBuilder, AllStats)
 from staging.pipeline.types import Tweet, Example
-from tokenization import tokens
+from tokenization import tokenizers, tokens
+from tokenization.cache import CachingStringTokenizer
 
 logger = logging.getLogger('labelling')
 label_space = [0, 1]
@@ -40,11 +42,22 @@ def add_label(tweet: Tweet) -> Example:
 
 
 def valid_tweet(tweet: Tweet):
-    return tweet.lang == 'en' and len(tweet.text) > 3
+    if tweet.lang != 'en':
+        return False
+    try:
+        return len(tweet.text) > 3
+    except iotypes.TokenizerError:
+        return False
 
 
 def gen_examples_and_stats(user_raw_dir_in: str, user_labelled_dir_out: str,
-                           stats_dir_out: str,  min_ex_per_user: int):
+                           stats_dir_out: str,  min_ex_per_user: int,
+                           tokenization_cache_file: str = None):
+    """
+    :param tokenization_cache_file: TokenizationStore of the tokenized tweet
+           texts, which later runs reuse instead of tokenizing them again, by
+           default tokenization_cache.sqlite in stats_dir_out
+    """
 
     vocab_file = os.path.join(stats_dir_out, 'vocabulary.txt')
     prev_vocab = []
@@ -52,92 +65,92 @@ def gen_examples_and_stats(user_raw_dir_in: str, user_labelled_dir_out: str,
         prev_vocab = iopipes.Pipe.from_path(vocab_file)
     vocab = VocabularyStatBuilder(prev_vocab)
 
+    if tokenization_cache_file is None:
+        tokenization_cache_file = os.path.join(
+            stats_dir_out, 'tokenization_cache.sqlite')
     hst_file_out = os.path.join(stats_dir_out, 'hst.json')
     topics_file_out = os.path.join(stats_dir_out, 'topics.json')
     with fileio.FileDumper(hst_file_out, HstStatSerializer) as hst_dumper, \
          fileio.FileDumper(topics_file_out, TopicsStatSerializer) as topics_dumper:
-        for path, u_tweet_it in iopipes.Pipe.named_from_path(
-                user_raw_dir_in, RawTweetDeserializer, min_ex_per_user):
-            uid = int(filesystem.name(path))
-            u_ex_it = map(add_label, filter(valid_tweet, u_tweet_it))
-
-            path_root = os.path.join(user_labelled_dir_out, str(uid))
-            ex_files_out = list(map(
-                lambda label: os.path.join(path_root, str(label) + '.json'),
-                label_space))
-            if not filesystem.readable_files(*ex_files_out):
-                logger.info('[generate_examples_and_stats]'
-                            'Generating examples for user {}'.format(uid))
-                with fileio.FileDumpers(zip(label_space, ex_files_out),
-                                        ExampleSerializer,
-                                        mode=fileio.WriteModes.WRITE) as dumpers:
-                    hst, topics = HstStatBuilder(uid), TopicsStatBuilder(uid)
-                    labels_hist = defaultdict(int)
-                    for ex in u_ex_it:
-                        hst.add(ex)
-                        topics.add(ex)
-                        vocab.add(ex)
-                        dumpers[ex.label].dump(ex)
-                        labels_hist[ex.label] += 1
-                    logger.info('[generate_examples_and_stats] Done generating '
-                                'examples for user {}. Label class balance: {}'
-                                .format(uid, labels_hist))
-                    hst_dumper.dump(hst.get())
-                    topics_dumper.dump(topics.get())
+        with CachingStringTokenizer(tokenizers.CasualStringTokenizer(),
+                                    tokenization_cache_file) as tokenizer:
+            tweet_deserializer = RawTweetDeserializer.build(
+                iotypes.NGrams.get_builder(tokenizer))
+            for path, u_tweet_it in iopipes.Pipe.named_from_path(
+                    user_raw_dir_in, tweet_deserializer, min_ex_per_user):
+                uid = int(filesystem.name(path))
+                u_ex_it = map(add_label, filter(valid_tweet, u_tweet_it))
+
+                path_root = os.path.join(user_labelled_dir_out, str(uid))
+                ex_files_out = list(map(
+                    lambda label: os.path.join(path_root, str(label) + '.json'),
+                    label_space))
+                if not filesystem.readable_files(*ex_files_out):
+                    logger.info('[generate_examples_and_stats]'
+                                'Generating examples for user {}'.format(uid))
+                    with fileio.FileDumpers(zip(label_space, ex_files_out),
+                                            ExampleSerializer,
+                                            mode=fileio.WriteModes.WRITE) as dumpers:
+                        hst, topics = HstStatBuilder(uid), TopicsStatBuilder(uid)
+                        labels_hist = defaultdict(int)
+                        for ex in u_ex_it:
+                            hst.add(ex)
+                            topics.add(ex)
+                            vocab.add(ex)
+                            dumpers[ex.label].dump(ex)
+                            labels_hist[ex.label] += 1
+                        logger.info('[generate_examples_and_stats] Done generating '
+                                    'examples for user {}. Label class balance: {}'
+                                    .format(uid, labels_hist))
+                        hst_dumper.dump(hst.get())
+                        topics_dumper.dump(topics.get())
 
     logger.info('[generate_examples_and_stats] Done')
     fileio.it_to_file(vocab.get(), vocab_file, mode=fileio.WriteModes.WRITE)
 
 
 def get_examples_and_features(users_labelled_dir_in: str, fe: FeatureExtractor,
-                              main_class: int, class_ratio: float):
+                              main_class: int, class_ratio: float,
+                              features_dir: str = None, workers: int = 1):
+    """
+    :param features_dir: root of the FeatureStore caching the features of
+           each user and class, by default users_labelled_dir_in + '_features'
+    :param workers: number of processes extracting missing features
+    """
     assert 0 <= class_ratio <= 1, 'pos_neg_ratio should be between 0 and 1'
     logger.info('[get_examples] Reading examples from ' + users_labelled_dir_in)
 
     users_labelled_dir_obj = iopipes.Pipe \
         .recursive_from_path(users_labelled_dir_in, ExampleDeserializer)
+    if features_dir is None:
+        features_dir = os.path.normpath(users_labelled_dir_in) + '_features'
+    store = FeatureStore(features_dir, fe, point_id=lambda tweet: tweet.id)
 
     all_ex = []
-    all_feat = []
+    feat_blocks = []
     for uid, dir_obj in users_labelled_dir_obj.items():
-        main_class_file_in = str(main_class)
-        main_class_feat_file = os.path.join(
-            users_labelled_dir_in, uid, main_class_file_in + '_features.json')
-
-        main_ex = list(dir_obj.file(main_class_file_in))
+        main_ex = list(dir_obj.file(str(main_class)))
         all_ex.extend(main_ex)
-        if not filesystem.readable_file(main_class_feat_file):
-            logger.info('[get_examples] Generating features for user {} class {}'
-                        .format(uid, main_class))
-            main_feat = [fe.extract(ex.point) for ex in main_ex]
-            all_feat.extend(main_feat)
-            np.savetxt(main_class_feat_file, main_feat, fmt='%.5e')
-        else:
-            all_feat.extend(np.loadtxt(main_class_feat_file))
+        if len(main_ex) > 0:
+            feat_blocks.append(((uid, main_class),
+                                [ex.point for ex in main_ex]))
 
         nr_other_ex = int((1/class_ratio) * len(main_ex))
         for other_class in idiff(pos=label_space, neg=[main_class]):
-            other_class_file_in = str(other_class)
-            other_class_feat_file = os.path.join(
-                users_labelled_dir_in, uid, other_class_file_in + '_features.json')
-
-            other_ex = list(take(nr_other_ex, dir_obj.file(other_class_file_in)))
+            other_ex = list(take(nr_other_ex, dir_obj.file(str(other_class))))
             all_ex.extend(other_ex)
-            if not filesystem.readable_file(other_class_feat_file):
-                logger.info('[get_examples] Generating features for user {} class {}'
-                            .format(uid, other_class))
-                other_feat = [fe.extract(ex.point) for ex in other_ex]
-                all_feat.extend(other_feat)
-                np.savetxt(other_class_feat_file, other_feat, fmt='%.5e')
-            else:
-                all_feat.extend(np.loadtxt(other_class_feat_file))
+            if len(other_ex) > 0:
+                feat_blocks.append(((uid, other_class),
+                                    [ex.point for ex in other_ex]))
 
+    store.extract_all(feat_blocks, workers)
     points, labels = split(functions.id, all_ex)
 
     logger.info('[gen_examples] Done reading examples and generating features. '
                 'Class distribution: {}'
                 .format(histogram(labels)))
-    return points, np.array(all_feat), np.array(labels)
+    return points, store.load_stacked(feat_blocks), \
+        np.array(labels)
 
 
 def get_stats(stats_dir_in: str):
@@ -3,6 +3,7 @@ import os
 from typing import List, Sequence
 
 import numpy as np
+import scipy.sparse
 
 from basic import filesystem
 from dataio.fileio import writers as fwrite_utils
@@ -36,9 +37,10 @@ def gen_kfold(k, points, labels, split_spec, kfold_dir):
 
 
 def train_model(features, labels, kfolds, epochs=1, batch_size=32, verbose=1):
-    input_size = len(features[0])
-    models = [BinaryLogisticRegression(input_size, l2_param=0.1),
-              BinaryLogisticRegression(input_size, l2_param=0.01)]
+    input_size = features.shape[1]
+    sparse = scipy.sparse.issparse(features)
+    models = [BinaryLogisticRegression(input_size, l2_param=0.1, sparse=sparse),
+              BinaryLogisticRegression(input_size, l2_param=0.01, sparse=sparse)]
     run_cv(models, kfolds, features, labels, epochs, batch_size, verbose)
 
 
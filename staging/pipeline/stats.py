@@ -1,13 +1,12 @@
 import heapq
 import logging
 import typing as t
-from collections import namedtuple, defaultdict
+from collections import Counter, namedtuple, defaultdict
 
 import math
 from operator import itemgetter
 
 from basic.dcollections import orderedset
-from basic.dicttools import map_values
 from basic.stattools import histogram
 from staging.pipeline.types import Example
 
@@ -15,9 +14,31 @@ logger = logging.getLogger('stats')
 
 
 class StatBuilder:
+    """
+    Builders can be fed shards of the examples separately, eg. by several
+    processes, and merged: a builder fed some examples, merged with one fed
+    the examples that follow, gets what a single builder fed all of them
+    would. The partial state of a builder is what state() returns, from
+    which from_state makes it again, eg. after serializing it.
+    """
+
     def add(self, ex: Example):
         raise NotImplementedError
 
+    def merge(self, other: 'StatBuilder'):
+        """
+        Adds what other was fed, as if it had been fed to this builder
+        after its own examples.
+        """
+        raise NotImplementedError
+
+    def state(self):
+        raise NotImplementedError
+
+    @classmethod
+    def from_state(cls, state) -> 'StatBuilder':
+        raise NotImplementedError
+
 
 class VocabularyStatBuilder(StatBuilder):
     def __init__(self, initial: t.Iterator[str] = None):
@@ -30,35 +51,176 @@ class VocabularyStatBuilder(StatBuilder):
     def add(self, ex: Example):
         self.set.update(map(lambda word: word.lower(), ex.point.text))
 
+    def merge(self, other: 'VocabularyStatBuilder'):
+        self.set.update(other.set)
+
+    def state(self) -> list:
+        return list(self.set)
+
+    @classmethod
+    def from_state(cls, state: list) -> 'VocabularyStatBuilder':
+        return cls(state)
+
     def get(self) -> list:
         return list(self.set)
 
 
+NGramVocabularyStat = namedtuple(
+    'NGramVocabularyStat', ['ngrams', 'counts'], verbose=False)
+NGramVocabularyState = namedtuple(
+    'NGramVocabularyState',
+    ['n', 'min_count', 'max_size', 'capacity', 'floor', 'counts'],
+    verbose=False)
+class NGramVocabularyStatBuilder(StatBuilder):
+    """
+    Counts of the lowercase 1..n-grams of the examples, n-grams being their
+    words joined by spaces, in at most capacity entries (by default ten
+    times max_size). Once full, the least counted entries are evicted and
+    new ones start from the highest count evicted so far, as in
+    space-saving, so a count overestimates by at most that much.
+    get() keeps the max_size most counted n-grams seen at least min_count
+    times, most counted first: the id of an n-gram is its position.
+    """
+
+    def __init__(self, n: int = 1, min_count: int = 2,
+                 max_size: int = 100000, capacity: int = None,
+                 initial: t.Iterable[t.Tuple[str, int]] = ()):
+        self._n = n
+        self._min_count = min_count
+        self._max_size = max_size
+        self._capacity = 10 * max_size if capacity is None else capacity
+        self._counts = Counter()
+        self._floor = 0
+        for ngram, count in initial:
+            self._counts[ngram] += count
+
+    def add(self, ex: Example):
+        words = list(map(str.lower, ex.point.text))
+        ngrams = list(words)
+        for n in range(2, self._n + 1):
+            ngrams.extend(map(' '.join, zip(*(words[i:] for i in range(n)))))
+        counts = self._counts
+        if self._floor > 0:
+            for ngram in ngrams:
+                if ngram not in counts:
+                    counts[ngram] = self._floor
+        counts.update(ngrams)
+        if len(counts) > self._capacity:
+            self._evict()
+
+    def merge(self, other: 'NGramVocabularyStatBuilder'):
+        """
+        Counts are added up. An n-gram missing from one of the builders may
+        have been evicted from it, so it gets that builder's floor, as in
+        merging space-saving summaries; without evictions, the counts stay
+        exact.
+        """
+        assert self._n == other._n, 'merging vocabularies of other n-grams'
+        counts = self._counts
+        if other._floor > 0:
+            for ngram in counts:
+                if ngram not in other._counts:
+                    counts[ngram] += other._floor
+        for ngram, count in other._counts.items():
+            counts[ngram] = counts.get(ngram, self._floor) + count
+        self._floor += other._floor
+        if len(counts) > self._capacity:
+            self._evict()
+
+    def state(self) -> NGramVocabularyState:
+        return NGramVocabularyState(
+            self._n, self._min_count, self._max_size, self._capacity,
+            self._floor, list(self._counts.items()))
+
+    @classmethod
+    def from_state(cls, state: NGramVocabularyState
+                   ) -> 'NGramVocabularyStatBuilder':
+        builder = cls(state.n, state.min_count, state.max_size,
+                      state.capacity, initial=state.counts)
+        builder._floor = state.floor
+        return builder
+
+    def _evict(self):
+        # Down to 3/4 of capacity at once, so that evicting, which looks at
+        # all entries, happens once every many adds
+        nr_evicted = len(self._counts) - self._capacity * 3 // 4
+        evicted = heapq.nsmallest(
+            nr_evicted, self._counts.items(), key=itemgetter(1))
+        for ngram, _ in evicted:
+            del self._counts[ngram]
+        self._floor = max(self._floor, evicted[-1][1])
+
+    def get(self) -> NGramVocabularyStat:
+        frequent = ((ngram, count) for ngram, count in self._counts.items()
+                    if count >= self._min_count)
+        kept = heapq.nlargest(self._max_size, frequent, key=itemgetter(1))
+        return NGramVocabularyStat([ngram for ngram, _ in kept],
+                                   [count for _, count in kept])
+
+
 HstStat = namedtuple('HstStat', ['uid', 'hst'], verbose=False)
+HstState = namedtuple(
+    'HstState', ['uid', 'nr_terms', 'nr_docs', 'term_max_tf_df'],
+    verbose=False)
 class HstStatBuilder(StatBuilder):
+    """
+    The nr_terms terms of the examples of a user with the highest tf-idf in
+    any example. Since idf is the same for every example and never
+    negative, that is the highest tf of a term times its idf, so only the
+    highest tf and the df of each term are kept, not the terms of every
+    example.
+    """
+
     def __init__(self, uid: int, nr_terms: int = 100):
         self._uid = uid
         self._nr_terms = nr_terms
-        self._term_hists = []
+        self._term_to_max_tf = {}
         self._term_to_idf = defaultdict(int)
         self._nr_docs = 0
 
     def add(self, ex: Example):
         terms = list(map(lambda w: w.lower(), ex.point.text))
-        term_hist = map_values(lambda tf: tf / len(terms), histogram(terms))
-        for term in term_hist.keys():
+        term_to_max_tf = self._term_to_max_tf
+        for term, term_count in histogram(terms).items():
+            tf = term_count / len(terms)
+            if tf > term_to_max_tf.get(term, 0):
+                term_to_max_tf[term] = tf
             self._term_to_idf[term] += 1
-        self._term_hists.append(term_hist)
         self._nr_docs += 1
 
+    def merge(self, other: 'HstStatBuilder'):
+        assert self._uid == other._uid, 'merging HSTs of other users'
+        term_to_max_tf = self._term_to_max_tf
+        for term, tf in other._term_to_max_tf.items():
+            if tf > term_to_max_tf.get(term, 0):
+                term_to_max_tf[term] = tf
+            self._term_to_idf[term] += other._term_to_idf[term]
+        self._nr_docs += other._nr_docs
+
+    def state(self) -> HstState:
+        """
+        The counts of the builder, with a (term, max tf, df) triple per term
+        in the order they were first seen, which breaks ties in get().
+        """
+        return HstState(self._uid, self._nr_terms, self._nr_docs, [
+            (term, max_tf, self._term_to_idf[term])
+            for term, max_tf in self._term_to_max_tf.items()])
+
+    @classmethod
+    def from_state(cls, state: HstState) -> 'HstStatBuilder':
+        builder = cls(state.uid, state.nr_terms)
+        for term, max_tf, df in state.term_max_tf_df:
+            builder._term_to_max_tf[term] = max_tf
+            builder._term_to_idf[term] = df
+        builder._nr_docs = state.nr_docs
+        return builder
+
     def get(self) -> HstStat:
-        heap = defaultdict(int)
-        for term_hist in self._term_hists:
-            for term, tf in term_hist.items():
-                raw_idf = max(1, self._term_to_idf[term])
-                idf = math.log(self._nr_docs / raw_idf)
-                tfidf = tf * idf
-                heap[term] = max(tfidf, heap[term])
+        heap = {}
+        for term, max_tf in self._term_to_max_tf.items():
+            raw_idf = max(1, self._term_to_idf[term])
+            idf = math.log(self._nr_docs / raw_idf)
+            heap[term] = max_tf * idf
         term_with_tfidf = heapq.nlargest(
             self._nr_terms, heap.items(), key=itemgetter(1))
         hst = list(map(itemgetter(0), term_with_tfidf))
@@ -74,6 +236,18 @@ class TopicsStatBuilder(StatBuilder):
     def add(self, ex: Example):
         pass
 
+    def merge(self, other: 'TopicsStatBuilder'):
+        assert self.uid == other.uid, 'merging topics of other users'
+
+    def state(self) -> TopicsStat:
+        return self.get()
+
+    @classmethod
+    def from_state(cls, state: TopicsStat) -> 'TopicsStatBuilder':
+        builder = cls(state.uid)
+        builder.topics = list(state.topics)
+        return builder
+
     def get(self) -> TopicsStat:
         return TopicsStat(self.uid, self.topics)
 
@@ -0,0 +1,64 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from dataio import iopipes
+from serialization.staging.pipeline.stats import NGramCountDeserializer
+from staging.pipeline import labelling
+
+user_texts = {
+    1: ['what a great day for a walk',
+        'another great monday at work',
+        'i love waiting in line'],
+    2: ['such a great day to stay in',
+        'i love mondays at work so much',
+        'waiting in line again today']
+}
+
+
+def write_raw_tweets(raw_dir: str, uid: int):
+    with open(os.path.join(raw_dir, '{}.json'.format(uid)), 'w') as f:
+        for idx, text in enumerate(user_texts[uid]):
+            f.write(json.dumps({'id': uid * 100 + idx, 'user': {'id': uid},
+                                'text': text, 'lang': 'en',
+                                'truncated': False}) + '\n')
+
+
+class GenExamplesAndVocabTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def run_labelling(self, name: str, uids: list) -> set:
+        """
+        Runs gen_examples_and_vocab on the raw tweets of uids, in the
+        directories of name, and returns the n-gram counts it wrote.
+        """
+        raw_dir, labelled_dir, stats_dir = (
+            os.path.join(self.root_dir, name, dir_name)
+            for dir_name in ['raw', 'labelled', 'stats'])
+        for dir_path in [raw_dir, labelled_dir, stats_dir]:
+            os.makedirs(dir_path, exist_ok=True)
+        for uid in uids:
+            write_raw_tweets(raw_dir, uid)
+        labelling.gen_examples_and_vocab(raw_dir, labelled_dir, stats_dir,
+                                         min_ex_per_user=1)
+        return set(iopipes.Pipe.from_path(
+            os.path.join(stats_dir, 'ngram_vocabulary.tsv'),
+            NGramCountDeserializer))
+
+    def test_incremental_run_keeps_pruned_counts(self):
+        first = self.run_labelling('incremental', [1])
+        incremental = self.run_labelling('incremental', [1, 2])
+        at_once = self.run_labelling('at_once', [1, 2])
+        self.assertNotIn(('great day', 2), first)
+        self.assertIn(('great day', 2), incremental)
+        self.assertEqual(incremental, at_once)
+
+
+if __name__ == '__main__':
+    unittest.main()
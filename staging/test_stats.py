@@ -0,0 +1,215 @@
+import heapq
+import math
+import random
+import unittest
+from collections import defaultdict
+from operator import itemgetter
+
+from basic.stattools import histogram
+from serialization.staging.pipeline.stats import (
+    HstStateDeserializer, HstStateSerializer,
+    NGramVocabularyStateDeserializer, NGramVocabularyStateSerializer,
+    TopicsStatDeserializer, TopicsStatSerializer,
+    VocabularyStateDeserializer, VocabularyStateSerializer)
+from staging.pipeline.stats import (
+    HstStatBuilder, NGramVocabularyStatBuilder, StatBuilder,
+    TopicsStatBuilder, VocabularyStatBuilder)
+from staging.pipeline.types import Example, Tweet
+from tokenization import tokens
+
+
+def example(text: list, uid: int = 1, label: float = 0) -> Example:
+    return Example(Tweet(0, uid, text, 'en', False, None, None, False), label)
+
+
+def examples(nr_examples: int, seed: int = 0) -> list:
+    """
+    Examples of words from a small vocabulary, so that terms repeat within
+    and across them, with empty ones and exact duplicates, whose terms tie.
+    """
+    rnd = random.Random(seed)
+    vocabulary = (['the', 'The', 'a', 'sarcasm', 'Great', 'great', 'day'] +
+                  ['w{}'.format(i) for i in range(40)])
+    exs = []
+    for _ in range(nr_examples):
+        if rnd.random() < 0.1:
+            exs.append(example([]))
+        elif rnd.random() < 0.1 and len(exs) > 0:
+            exs.append(exs[rnd.randrange(len(exs))])
+        else:
+            words = rnd.choices(vocabulary, k=rnd.randint(1, 12))
+            exs.append(example([
+                tokens.WordToken(word) if rnd.random() < 0.5 else word
+                for word in words]))
+    return exs
+
+
+def baseline_hst(uid: int, nr_terms: int, exs: list) -> list:
+    """
+    The HST as HstStatBuilder computed it when it kept the tf of every
+    term of every example.
+    """
+    term_hists = []
+    term_to_idf = defaultdict(int)
+    for ex in exs:
+        terms = list(map(lambda w: w.lower(), ex.point.text))
+        term_hist = {term: count / len(terms)
+                     for term, count in histogram(terms).items()}
+        term_hists.append(term_hist)
+        for term in term_hist:
+            term_to_idf[term] += 1
+
+    nr_docs = len(term_hists)
+    heap = defaultdict(float)
+    for term_hist in term_hists:
+        for term, tf in term_hist.items():
+            idf = math.log(nr_docs / max(1, term_to_idf[term]))
+            heap[term] = max(tf * idf, heap[term])
+    term_with_tfidf = heapq.nlargest(nr_terms, heap.items(),
+                                     key=itemgetter(1))
+    return list(map(itemgetter(0), term_with_tfidf))
+
+
+class HstStatBuilderTest(unittest.TestCase):
+    def hst(self, nr_terms: int, exs: list) -> list:
+        builder = HstStatBuilder(1, nr_terms)
+        for ex in exs:
+            builder.add(ex)
+        stat = builder.get()
+        self.assertEqual(stat.uid, 1)
+        return stat.hst
+
+    def assertHstEqual(self, hst: list, expected: list):
+        # Tokens of other types are other terms, so compare types too
+        self.assertEqual([(type(term), term) for term in hst],
+                         [(type(term), term) for term in expected])
+
+    def test_matches_baseline(self):
+        for seed in range(5):
+            exs = examples(300, seed)
+            for nr_terms in [1, 5, 20, 1000]:
+                self.assertHstEqual(self.hst(nr_terms, exs),
+                                    baseline_hst(1, nr_terms, exs))
+
+    def test_ties_keep_first_seen_terms(self):
+        exs = [example(['b', 'a']), example(['c', 'd']), example(['b', 'a']),
+               example(['e'])]
+        self.assertHstEqual(self.hst(3, exs), baseline_hst(1, 3, exs))
+        self.assertEqual(self.hst(3, exs), ['e', 'c', 'd'])
+
+    def test_terms_in_every_example_score_zero(self):
+        exs = [example(['x', 'a']), example(['x', 'b']), example(['x'])]
+        self.assertHstEqual(self.hst(10, exs), baseline_hst(1, 10, exs))
+        self.assertEqual(self.hst(10, exs)[-1], 'x')
+
+    def test_empty_examples(self):
+        self.assertEqual(self.hst(10, []), [])
+        exs = [example([]), example(['a']), example([]), example(['a', 'b'])]
+        self.assertHstEqual(self.hst(10, exs), baseline_hst(1, 10, exs))
+
+
+class StatBuilderMergeTest(unittest.TestCase):
+    shard_bounds = [0, 40, 41, 41, 170, 300]
+
+    def serial(self, make, exs: list) -> StatBuilder:
+        builder = make()
+        for ex in exs:
+            builder.add(ex)
+        return builder
+
+    def shards(self, make, serializer, deserializer, exs: list,
+               bounds: list = None) -> list:
+        """
+        A builder per shard of exs, between bounds (by default shard_bounds,
+        with some empty shards), made again from its state after serializing
+        and deserializing it.
+        """
+        bounds = self.shard_bounds if bounds is None else bounds
+        builders = []
+        for start, stop in zip(bounds, bounds[1:]):
+            state = self.serial(make, exs[start:stop]).state()
+            state = deserializer.deserialize(serializer.serialize(state))
+            builders.append(type(make()).from_state(state))
+        return builders
+
+    def merged(self, make, serializer, deserializer, exs: list
+               ) -> StatBuilder:
+        builders = self.shards(make, serializer, deserializer, exs)
+        for builder in builders[1:]:
+            builders[0].merge(builder)
+        return builders[0]
+
+    def assertTermsEqual(self, terms: list, expected: list):
+        self.assertEqual([(type(term), term) for term in terms],
+                         [(type(term), term) for term in expected])
+
+    def test_hst(self):
+        for nr_terms in [5, 1000]:
+            make = lambda: HstStatBuilder(1, nr_terms)
+            exs = examples(300)
+            merged = self.merged(make, HstStateSerializer,
+                                 HstStateDeserializer, exs).get()
+            serial = self.serial(make, exs).get()
+            self.assertEqual(merged.uid, serial.uid)
+            self.assertTermsEqual(merged.hst, serial.hst)
+
+    def test_vocabulary(self):
+        make = lambda: VocabularyStatBuilder(['initial'])
+        exs = examples(300)
+        merged = self.merged(make, VocabularyStateSerializer,
+                             VocabularyStateDeserializer, exs).get()
+        serial = self.serial(make, exs).get()
+        # Terms are sorted by text, so that a string and a token of the same
+        # text, which are different terms, come in no particular order
+        self.assertEqual(set(merged), set(serial))
+        self.assertEqual(len(merged), len(serial))
+        self.assertEqual(list(map(str.__str__, merged)),
+                         list(map(str.__str__, serial)))
+
+    def test_ngram_vocabulary(self):
+        make = lambda: NGramVocabularyStatBuilder(
+            3, min_count=2, max_size=50, capacity=100000)
+        exs = examples(300)
+        merged = self.merged(make, NGramVocabularyStateSerializer,
+                             NGramVocabularyStateDeserializer, exs)
+        serial = self.serial(make, exs)
+        self.assertEqual(merged.state().floor, 0)
+        self.assertEqual(merged.get(), serial.get())
+
+    def test_ngram_vocabulary_with_evictions(self):
+        """
+        After each merge, counts are never underestimated, and are
+        overestimated by at most the floor of the merged builder.
+        """
+        exs = examples(300)
+        bounds = [0, 60, 120, 180, 240, 300]
+        make = lambda: NGramVocabularyStatBuilder(
+            2, min_count=1, max_size=20, capacity=100)
+        builders = self.shards(make, NGramVocabularyStateSerializer,
+                               NGramVocabularyStateDeserializer, exs, bounds)
+        merged = builders[0]
+        for builder, stop in zip(builders[1:], bounds[2:]):
+            merged.merge(builder)
+            true_counts = dict(self.serial(
+                lambda: NGramVocabularyStatBuilder(2, min_count=1),
+                exs[:stop]).state().counts)
+            state = merged.state()
+            for ngram, count in state.counts:
+                self.assertGreaterEqual(count, true_counts[ngram])
+                self.assertLessEqual(count, true_counts[ngram] + state.floor)
+        self.assertGreater(merged.state().floor, 0)
+        stat = merged.get()
+        self.assertEqual(len(stat.ngrams), 20)
+        self.assertEqual(stat.counts, sorted(stat.counts, reverse=True))
+
+    def test_topics(self):
+        make = lambda: TopicsStatBuilder(1)
+        exs = examples(300)
+        self.assertEqual(
+            self.merged(make, TopicsStatSerializer, TopicsStatDeserializer,
+                        exs).get(),
+            self.serial(make, exs).get())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import ExitStack
+from typing import Callable, Dict, List, Sequence
+
+from basic import filesystem, log
+from dataio import iotypes
+from tokenization import compact, tokenizers
+from tokenization.test_tokenizers import StubCmuGateway
+
+logger = logging.getLogger('tokenization.benchmark')
+
+# Version of what measure reports; runs in the history file are only
+# compared with runs of the same version, number of tweets and seed
+measure_version = 3
+
+_letters = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def synthetic_corpus(nr_tweets: int, seed: int = 0,
+                     vocabulary_size: int = 20000) -> List[str]:
+    """
+    Reproducible tweets: words drawn from a Zipf-like distribution over a
+    random vocabulary, mixed with hashtags, mentions, URLs, emoticons and
+    punctuation in roughly timeline proportions.
+    """
+    rnd = random.Random(seed)
+    vocabulary = [''.join(rnd.choice(_letters)
+                          for _ in range(rnd.randint(1, 10)))
+                  for _ in range(vocabulary_size)]
+    emojis = tokenizers.positive_emojis + tokenizers.negative_emojis
+
+    def word():
+        rank = min(int(rnd.paretovariate(1.1)), vocabulary_size)
+        w = vocabulary[rank - 1]
+        return w.capitalize() if rnd.random() < 0.1 else w
+
+    extras = [
+        lambda: '#' + word(),
+        lambda: '@' + word(),
+        lambda: 'https://t.co/' + ''.join(rnd.choice(_letters + '0123456789')
+                                          for _ in range(10)),
+        lambda: rnd.choice(emojis),
+        lambda: word() + rnd.choice([',', '.', '!', '?', '...', '!!'])
+    ]
+
+    tweets = []
+    for _ in range(nr_tweets):
+        chunks = [rnd.choice(extras)() if rnd.random() < 0.2 else word()
+                  for _ in range(rnd.randint(3, 30))]
+        tweets.append(' '.join(chunks))
+    return tweets
+
+
+def clear_caches():
+    """
+    Empties the memo caches of tokenization, eg. of the chunks the casual
+    tokenizer matched, so that a run does not profit from the previous one
+    over the same tweets.
+    """
+    casual = tokenizers.CasualStringTokenizer.instance
+    if casual is not None:
+        type(casual)._chunk_to_token.cache_clear()
+    compact.stable_id.cache_clear()
+    compact.lower_stable_id.cache_clear()
+
+
+def measure(f: Callable[[Sequence[str]], List], tweets: Sequence[str],
+            repeat: int = 3) -> Dict[str, float]:
+    """
+    Best of repeat runs of f over all tweets, each with cold caches (see
+    clear_caches), the rate of one more run with the caches it left warm,
+    and the allocations per tweet of a traced run, with its peak memory.
+    tracemalloc only sees the blocks that are still allocated when the run
+    ends, so allocations are those of the results and of anything else the
+    run keeps, eg. caches: blocks allocated and freed within the run are
+    not counted.
+    """
+    best_time = float('inf')
+    nr_tokens = 0
+    for _ in range(repeat):
+        clear_caches()
+        start = time.perf_counter()
+        results = f(tweets)
+        best_time = min(best_time, time.perf_counter() - start)
+        nr_tokens = sum(map(len, results))
+        del results
+
+    start = time.perf_counter()
+    f(tweets)
+    warm_time = time.perf_counter() - start
+
+    clear_caches()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    results = f(tweets)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    nr_allocations = sum(max(0, stat.count_diff)
+                         for stat in after.compare_to(before, 'lineno'))
+    del results
+
+    return OrderedDict([
+        ('tweets_per_s', len(tweets) / best_time),
+        ('tokens_per_s', nr_tokens / best_time),
+        ('warm_tweets_per_s', len(tweets) / warm_time),
+        ('allocations_per_tweet', nr_allocations / len(tweets)),
+        ('peak_kib', peak / 1024)
+    ])
+
+
+def benchmarks(resources: ExitStack
+               ) -> Dict[str, Callable[[Sequence[str]], List]]:
+    """
+    :param resources: closes what the benchmarks hold, eg. tagger pools
+    """
+    casual = tokenizers.CasualStringTokenizer()
+    casual_sequential = tokenizers.CasualStringTokenizer(single_pass=False)
+    space = tokenizers.SpaceStringTokenizer()
+    ngrams = iotypes.NGrams.get_builder(tokenizer=casual)
+    cmu_pool = resources.enter_context(
+        tokenizers.CmuTaggerPool([0], connect=StubCmuGateway))
+
+    def ngrams_or_empty(tweet):
+        try:
+            return ngrams(tweet)
+        except iotypes.TokenizerError:
+            return []
+
+    return OrderedDict([
+        ('casual', lambda tweets: [casual.tokenize(t) for t in tweets]),
+        ('casual_sequential',
+         lambda tweets: [casual_sequential.tokenize(t) for t in tweets]),
+        ('space', lambda tweets: [space.tokenize(t) for t in tweets]),
+        ('ngrams_from_string',
+         lambda tweets: [ngrams_or_empty(t) for t in tweets]),
+        ('cmu_stub_batched', lambda tweets: list(cmu_pool.tokenize_many(tweets)))
+    ])
+
+
+def regressions(previous: Dict, current: Dict, tolerance: float) -> List[str]:
+    found = []
+    for name, metrics in current.items():
+        if name not in previous:
+            continue
+        prev_rate = previous[name]['tweets_per_s']
+        rate = metrics['tweets_per_s']
+        if rate < (1 - tolerance) * prev_rate:
+            found.append('{}: {:.0f} tweets/s, was {:.0f}'
+                         .format(name, rate, prev_rate))
+    return found
+
+
+def main(nr_tweets, seed, repeat, history_file, tolerance):
+    tweets = synthetic_corpus(nr_tweets, seed)
+    results = OrderedDict()
+    with ExitStack() as resources:
+        for name, f in benchmarks(resources).items():
+            results[name] = measure(f, tweets, repeat)
+            logger.info('[main] {:<20} {:>10.0f} tweets/s {:>11.0f} tokens/s '
+                        '{:>10.0f} warm tweets/s {:>7.1f} allocations/'
+                        'tweet {:>9.0f} KiB peak'
+                        .format(name, *results[name].values()))
+
+    if history_file is None:
+        return []
+    history = []
+    if filesystem.readable_file(history_file):
+        with open(history_file, encoding='utf-8') as f:
+            history = json.load(f)
+    found = []
+    comparable = [run for run in history
+                  if run.get('measure_version') == measure_version and
+                  run['nr_tweets'] == nr_tweets and run['seed'] == seed]
+    if len(comparable) > 0:
+        found = regressions(comparable[-1]['results'], results, tolerance)
+        for regression in found:
+            logger.warning('[main] Regression in ' + regression)
+    else:
+        logger.info('[main] No previous run with {} tweets and seed {} to '
+                    'compare with'.format(nr_tweets, seed))
+    history.append({
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'measure_version': measure_version,
+        'nr_tweets': nr_tweets,
+        'seed': seed,
+        'results': results
+    })
+    filesystem.ensure_writable_file_loc(history_file)
+    with open(history_file, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=2)
+    return found
+
+
+if __name__ == '__main__':
+    log.create_logger('tokenization.benchmark')
+    parser = argparse.ArgumentParser(description='Tokenizer throughput')
+    parser.add_argument('-n', '--nr_tweets',
+                        help='number of synthetic tweets',
+                        type=int,
+                        default=20000)
+    parser.add_argument('-s', '--seed',
+                        help='seed of the synthetic corpus',
+                        type=int,
+                        default=0)
+    parser.add_argument('-r', '--repeat',
+                        help='timed runs per benchmark; the best one counts',
+                        type=int,
+                        default=3)
+    parser.add_argument('-hf', '--history_file',
+                        help='JSON file with the results of previous runs',
+                        default=None)
+    parser.add_argument('-t', '--tolerance',
+                        help='relative slowdown reported as a regression',
+                        type=float,
+                        default=0.1)
+
+    args = parser.parse_args()
+    found = main(args.nr_tweets, args.seed, args.repeat,
+                 args.history_file, args.tolerance)
+    sys.exit(1 if len(found) > 0 else 0)
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import sqlite3
+from collections import OrderedDict
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from basic import filesystem
+from basic.ditertools import ichunks
+from tokenization import tokens
+from tokenization.tokenizers import StringTokenizer
+
+logger = logging.getLogger('tokenization.cache')
+
+# Type code of the plain strings some tokenizers, eg. SpaceStringTokenizer,
+# produce instead of tokens
+str_type_code = 255
+
+
+def cache_key(config: str, s: str) -> bytes:
+    return hashlib.blake2b((config + '\0' + s).encode('utf-8'),
+                           digest_size=16).digest()
+
+
+class TokenizationStore:
+    """
+    On-disk map from cache keys to tokenized strings, in an SQLite file that
+    several processes can share. Token types are stored as their codes in
+    tokens.token_type_codes, plain strings as str_type_code.
+    The database is in WAL mode, so that readers do not block the writer.
+    Puts are buffered and written in a single short transaction every
+    commit_every puts, so that no transaction stays open in between and
+    other processes wait for the write lock, up to timeout seconds, only
+    while a batch is written.
+    """
+
+    def __init__(self, path: str, commit_every: int = 100,
+                 timeout: float = 30.0):
+        filesystem.ensure_writable_file_loc(path)
+        self._db = sqlite3.connect(path, timeout=timeout)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tokenizations ('
+                         'key BLOB PRIMARY KEY, types BLOB, texts TEXT)')
+        self._db.commit()
+        self._commit_every = commit_every
+        self._pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, key: bytes) -> Optional[Tuple[str, ...]]:
+        row = self._pending.get(key)
+        if row is None:
+            row = self._db.execute(
+                'SELECT types, texts FROM tokenizations WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        types, texts = row
+        all_token_types = tokens.all_token_types
+        return tuple(text if code == str_type_code
+                     else all_token_types[code](text)
+                     for code, text in zip(types, json.loads(texts)))
+
+    def put(self, key: bytes, tokens_: Sequence[str]):
+        types = bytes(str_type_code if type(token) is str
+                      else tokens.token_type_code(token) for token in tokens_)
+        texts = json.dumps(list(map(str.__str__, tokens_)))
+        self._pending[key] = (types, texts)
+        if len(self._pending) >= self._commit_every:
+            self.flush()
+
+    def flush(self):
+        if len(self._pending) == 0:
+            return
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO tokenizations VALUES (?, ?, ?)',
+                [(key, types, texts)
+                 for key, (types, texts) in self._pending.items()])
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+
+class CachingStringTokenizer(StringTokenizer):
+    """
+    Wraps any StringTokenizer with a cache of its output, keyed by a hash of
+    the tokenizer config and the string: an in-memory LRU of lru_size
+    entries, in front of an optional TokenizationStore at store_path.
+    """
+
+    def __init__(self, tokenizer: StringTokenizer, store_path: str = None,
+                 lru_size: int = 100000):
+        self._tokenizer = tokenizer
+        self._config = tokenizer.config()
+        self._lru = OrderedDict()
+        self._lru_size = lru_size
+        self._store = None
+        if store_path is not None:
+            self._store = TokenizationStore(store_path)
+        self.nr_hits = 0
+        self.nr_misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+        logger.info('[CachingStringTokenizer] {} hits, {} misses'
+                    .format(self.nr_hits, self.nr_misses))
+
+    def config(self):
+        return self._config
+
+    def _remember(self, key: bytes, tokens_: Tuple[tokens.Token, ...]):
+        self._lru[key] = tokens_
+        if len(self._lru) > self._lru_size:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, key: bytes) -> Optional[Tuple[tokens.Token, ...]]:
+        cached = self._lru.get(key)
+        if cached is not None:
+            self._lru.move_to_end(key)
+        elif self._store is not None:
+            cached = self._store.get(key)
+            if cached is not None:
+                self._remember(key, cached)
+        return cached
+
+    def _store_result(self, key: bytes, tokens_: List[tokens.Token]):
+        self._remember(key, tuple(tokens_))
+        if self._store is not None:
+            self._store.put(key, tokens_)
+
+    def tokenize(self, s: str) -> list:
+        key = cache_key(self._config, s)
+        cached = self._lookup(key)
+        if cached is not None:
+            self.nr_hits += 1
+            return list(cached)
+        self.nr_misses += 1
+        result = self._tokenizer.tokenize(s)
+        self._store_result(key, result)
+        return result
+
+    def tokenize_many(self, strings: Iterable[str], workers: int = 1,
+                      chunksize: int = 256) -> Iterator[list]:
+        """
+        Like the wrapped tokenizer's tokenize_many, but only strings missing
+        from the cache are passed on to it, chunksize strings at a time.
+        """
+        for chunk in ichunks(chunksize, strings):
+            keys = [cache_key(self._config, s) for s in chunk]
+            results = [self._lookup(key) for key in keys]
+            miss_idxs = [idx for idx, result in enumerate(results)
+                         if result is None]
+            self.nr_hits += len(chunk) - len(miss_idxs)
+            self.nr_misses += len(miss_idxs)
+            if len(miss_idxs) > 0:
+                missed = self._tokenizer.tokenize_many(
+                    [chunk[idx] for idx in miss_idxs], workers, chunksize)
+                for idx, result in zip(miss_idxs, missed):
+                    self._store_result(keys[idx], result)
+                    results[idx] = result
+            for result in results:
+                yield list(result)
@@ -0,0 +1,186 @@
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Sequence
+
+from tokenization import tokens
+
+STRING_ID_DTYPE = np.uint32
+TYPE_CODE_DTYPE = np.uint8
+STABLE_ID_DTYPE = np.uint64
+
+
+@lru_cache(maxsize=262144)
+def stable_id(string: str) -> int:
+    """
+    64-bit id of string that, unlike hash() and StringTable ids, is the same
+    in every process and run, so it can be stored and shared.
+    """
+    return int.from_bytes(
+        hashlib.blake2b(string.encode('utf-8'), digest_size=8).digest(),
+        'little')
+
+
+@lru_cache(maxsize=262144)
+def lower_stable_id(string: str) -> int:
+    """
+    stable_id of string.lower(), lowercasing each distinct string only once.
+    """
+    return stable_id(str.lower(string))
+
+
+def lower_stable_ids(strings: Sequence[str]) -> np.ndarray:
+    return np.fromiter(map(lower_stable_id, map(str.__str__, strings)),
+                       dtype=STABLE_ID_DTYPE, count=len(strings))
+
+
+class StringTable:
+    """
+    Interns strings to dense integer ids, so that a token can be stored as
+    a (string id, token type code) pair instead of a Token object.
+    Ids are only meaningful within the table that produced them.
+    """
+
+    def __init__(self, strings: Iterable[str] = ()):
+        self._string_to_id = {}  # type: Dict[str, int]
+        self._strings = []  # type: List[str]
+        self._id_to_lower_id = {}  # type: Dict[int, int]
+        for string in strings:
+            self.intern(string)
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __getitem__(self, string_id: int) -> str:
+        return self._strings[string_id]
+
+    def __contains__(self, string: str) -> bool:
+        return string in self._string_to_id
+
+    def get(self, string: str, default: int = None) -> int:
+        return self._string_to_id.get(string, default)
+
+    def intern(self, string: str) -> int:
+        string_id = self._string_to_id.get(string)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._string_to_id[string] = string_id
+            self._strings.append(string)
+        return string_id
+
+    def intern_all(self, strings: Iterable[str]) -> np.ndarray:
+        return np.fromiter(map(self.intern, strings), dtype=STRING_ID_DTYPE)
+
+    def lower_id(self, string_id: int) -> int:
+        lower_id = self._id_to_lower_id.get(string_id)
+        if lower_id is None:
+            lower_id = self.intern(self._strings[string_id].lower())
+            self._id_to_lower_id[string_id] = lower_id
+        return lower_id
+
+    def lower_ids(self, string_ids: np.ndarray) -> np.ndarray:
+        unique_ids, inverse = np.unique(string_ids, return_inverse=True)
+        unique_lower_ids = np.fromiter(
+            map(self.lower_id, unique_ids.tolist()), dtype=STRING_ID_DTYPE,
+            count=len(unique_ids))
+        return unique_lower_ids[inverse]
+
+
+# Process-wide table, shared by every TokenTable built without an explicit one.
+# Strings are never removed from it, so it grows with every distinct string
+# seen for the lifetime of the process: to bound it, eg. to a single run,
+# build the TokenTables with a StringTable of their own and drop it after.
+default_string_table = StringTable()
+
+
+class TokenTable(Sequence[tokens.Token]):
+    """
+    Compact representation of a tokenized string: an array of interned
+    string ids and an array of token type codes (see tokens.token_type_codes).
+    Tokens are only materialized when indexed or iterated over; slicing or
+    indexing with an array of indices gives another TokenTable, over the same
+    StringTable.
+    """
+
+    def __init__(self, string_ids: np.ndarray, type_codes: np.ndarray,
+                 strings: StringTable = None):
+        assert len(string_ids) == len(type_codes)
+        if strings is None:
+            strings = default_string_table
+        self._string_ids = np.asarray(string_ids, dtype=STRING_ID_DTYPE)
+        self._type_codes = np.asarray(type_codes, dtype=TYPE_CODE_DTYPE)
+        self._strings = strings
+
+    @staticmethod
+    def from_tokens(tokens_: Iterable[tokens.Token],
+                    strings: StringTable = None) -> 'TokenTable':
+        if strings is None:
+            strings = default_string_table
+        tokens_ = list(tokens_)
+        string_ids = strings.intern_all(token.extract() for token in tokens_)
+        type_codes = np.fromiter(map(tokens.token_type_code, tokens_),
+                                 dtype=TYPE_CODE_DTYPE, count=len(tokens_))
+        return TokenTable(string_ids, type_codes, strings)
+
+    @property
+    def string_ids(self) -> np.ndarray:
+        return self._string_ids
+
+    @property
+    def type_codes(self) -> np.ndarray:
+        return self._type_codes
+
+    @property
+    def strings(self) -> StringTable:
+        return self._strings
+
+    def __len__(self) -> int:
+        return len(self._string_ids)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            token_type = tokens.all_token_types[self._type_codes[idx]]
+            return token_type(self._strings[self._string_ids[idx]])
+        return TokenTable(self._string_ids[idx], self._type_codes[idx],
+                          self._strings)
+
+    def __iter__(self) -> Iterator[tokens.Token]:
+        return iter(self.to_tokens())
+
+    def texts(self) -> List[str]:
+        strings = self._strings
+        return [strings[string_id] for string_id in self._string_ids.tolist()]
+
+    def lower_ids(self) -> np.ndarray:
+        return self._strings.lower_ids(self._string_ids)
+
+    def to_tokens(self) -> List[tokens.Token]:
+        all_token_types = tokens.all_token_types
+        return [all_token_types[code](text) for code, text
+                in zip(self._type_codes.tolist(), self.texts())]
+
+    def __str__(self):
+        return str(self.to_tokens())
+
+    def __repr__(self):
+        return 'TokenTable({})'.format(self.to_tokens())
+
+
+def type_codes(tokens_: Sequence[tokens.Token]) -> np.ndarray:
+    """
+    Token type codes of a TokenTable or of any sequence of tokens.
+    """
+    if isinstance(tokens_, TokenTable):
+        return tokens_.type_codes
+    return np.fromiter(map(tokens.token_type_code, tokens_),
+                       dtype=TYPE_CODE_DTYPE, count=len(tokens_))
+
+
+def texts(tokens_: Sequence[tokens.Token]) -> List[str]:
+    """
+    Texts of a TokenTable or of any sequence of tokens, as plain strings.
+    """
+    if isinstance(tokens_, TokenTable):
+        return tokens_.texts()
+    return [str.__str__(token) for token in tokens_]
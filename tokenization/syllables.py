@@ -0,0 +1,104 @@
+import logging
+import mmap
+import os
+import struct
+from functools import lru_cache
+
+from basic import filesystem
+
+logger = logging.getLogger('tokenization.syllables')
+
+# Precomputed word -> max syllable count table, built once from the CMU
+# pronouncing dictionary and memory-mapped on first use, so that every process
+# shares the same pages instead of loading cmudict into Python objects.
+# Layout (little-endian):
+#   magic b'SYL1', uint32 n
+#   uint32 offsets[n + 1]  byte offsets of the words in the words blob
+#   uint8 counts[n]        max syllable count of each word
+#   words blob             utf-8 lowercase words, sorted bytewise
+table_path = os.path.join(
+    os.path.expanduser('~'), '.cache', 'sarcasm', 'cmudict_syllables.bin')
+
+_magic = b'SYL1'
+_header = struct.Struct('<4sI')
+_offset = struct.Struct('<I')
+
+
+def build_syllable_table(path: str):
+    from nltk.corpus import cmudict
+
+    logger.info('[build_syllable_table] Building syllable table in ' + path)
+    word_to_count = {}
+    for word, pronunciation in cmudict.entries():
+        count = sum(1 for phone in pronunciation if phone[-1].isdigit())
+        word = word.lower().encode('utf-8')
+        word_to_count[word] = max(count, word_to_count.get(word, 0))
+    words = sorted(word_to_count)
+
+    offsets = [0]
+    for word in words:
+        offsets.append(offsets[-1] + len(word))
+
+    filesystem.ensure_writable_file_loc(path)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(_header.pack(_magic, len(words)))
+        f.write(struct.pack('<{}I'.format(len(offsets)), *offsets))
+        f.write(bytes(min(word_to_count[word], 255) for word in words))
+        f.write(b''.join(words))
+    os.replace(tmp_path, path)
+
+
+class SyllableTable:
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._n = _header.unpack_from(self._mm, 0)
+        assert magic == _magic, path + ' is not a syllable table'
+        self._offsets_start = _header.size
+        self._counts_start = self._offsets_start + _offset.size * (self._n + 1)
+        self._words_start = self._counts_start + self._n
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _word(self, idx: int) -> bytes:
+        start, = _offset.unpack_from(
+            self._mm, self._offsets_start + _offset.size * idx)
+        end, = _offset.unpack_from(
+            self._mm, self._offsets_start + _offset.size * (idx + 1))
+        return self._mm[self._words_start + start: self._words_start + end]
+
+    def get(self, word: str, default: int = 0) -> int:
+        key = word.encode('utf-8')
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n and self._word(lo) == key:
+            return self._mm[self._counts_start + lo]
+        return default
+
+
+_table = None
+
+
+def get_syllable_table() -> SyllableTable:
+    global _table
+    if _table is None:
+        if not filesystem.readable_file(table_path):
+            build_syllable_table(table_path)
+        _table = SyllableTable(table_path)
+    return _table
+
+
+@lru_cache(maxsize=65536)
+def count_syllables(word: str) -> int:
+    """
+    Maximum number of syllables over the CMU pronunciations of word,
+    or 0 if the word is not in the dictionary.
+    """
+    return get_syllable_table().get(word.lower())
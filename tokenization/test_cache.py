@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from dataio import iotypes
+from serialization.staging.pipeline.types import RawTweetDeserializer
+from tokenization import tokenizers
+from tokenization.cache import CachingStringTokenizer
+
+tweets = ['Oh GREAT, another Monday :) #blessed',
+          '@someone just LOVE it... http://t.co/x',
+          'what a day D:',
+          'Oh GREAT, another Monday :) #blessed']
+
+
+def typed(tokens_: list) -> list:
+    return [(type(token), str.__str__(token)) for token in tokens_]
+
+
+def raw_tweet(idx: int, text: str) -> str:
+    return json.dumps({'id': idx, 'user': {'id': 1}, 'text': text,
+                       'lang': 'en', 'truncated': False})
+
+
+class CachingStringTokenizerTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.root_dir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_second_run_hits_store(self):
+        for tokenizer in [tokenizers.CasualStringTokenizer(),
+                          tokenizers.SpaceStringTokenizer()]:
+            expected = list(map(typed, map(tokenizer.tokenize, tweets)))
+            with CachingStringTokenizer(tokenizer, self.store_path) as cached:
+                self.assertEqual([typed(cached.tokenize(tweet))
+                                  for tweet in tweets], expected)
+                self.assertEqual((cached.nr_hits, cached.nr_misses), (1, 3))
+            with CachingStringTokenizer(tokenizer, self.store_path) as cached:
+                self.assertEqual(
+                    list(map(typed, cached.tokenize_many(tweets))), expected)
+                self.assertEqual((cached.nr_hits, cached.nr_misses), (4, 0))
+
+    def test_raw_tweets_reuse_store(self):
+        lines = [raw_tweet(idx, text) for idx, text in enumerate(tweets)]
+        expected = [typed(iotypes.SvNgrams(text)) for text in tweets]
+        for nr_misses in [3, 0]:
+            with CachingStringTokenizer(tokenizers.CasualStringTokenizer(),
+                                        self.store_path) as tokenizer:
+                deserializer = RawTweetDeserializer.build(
+                    iotypes.NGrams.get_builder(tokenizer))
+                texts = [deserializer.deserialize(line).text
+                         for line in lines]
+                self.assertEqual([typed(text) for text in texts], expected)
+                self.assertEqual(tokenizer.nr_misses, nr_misses)
+        # The default deserializer is unchanged
+        self.assertEqual(
+            typed(RawTweetDeserializer.deserialize(lines[0]).text),
+            expected[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import json
+import unittest
+
+import numpy as np
+
+from dataio import iotypes
+from serialization.staging.pipeline.types import (
+    ExampleDeserializer, ExampleSerializer)
+from staging.pipeline.types import Example, Tweet
+from tokenization import tokens
+from tokenization.compact import StringTable, TokenTable
+
+
+def typed(tokens_) -> list:
+    return [(type(token), str.__str__(token)) for token in tokens_]
+
+
+class TokenTableTest(unittest.TestCase):
+    def setUp(self):
+        self.tokens = iotypes.SvNgrams(
+            '@someone Oh GREAT, another Monday :) #blessed http://t.co/x')
+        self.strings = StringTable()
+        self.table = TokenTable.from_tokens(self.tokens, self.strings)
+
+    def test_int_index(self):
+        for idx in range(-len(self.tokens), len(self.tokens)):
+            self.assertEqual(typed([self.table[idx]]),
+                             typed([self.tokens[idx]]))
+        self.assertEqual(typed([self.table[np.int64(1)]]),
+                         typed([self.tokens[1]]))
+
+    def test_slice(self):
+        for idx in [slice(1, 3), slice(None, -2), slice(None, None, -2),
+                    slice(5, 1)]:
+            view = self.table[idx]
+            self.assertIsInstance(view, TokenTable)
+            self.assertIs(view.strings, self.strings)
+            self.assertEqual(typed(view), typed(list(self.tokens)[idx]))
+
+    def test_array_index(self):
+        idxs = [4, 0, 4]
+        for index in [idxs, np.array(idxs),
+                      np.arange(len(self.tokens)) % 2 == 0]:
+            selected = self.table[index]
+            self.assertIsInstance(selected, TokenTable)
+            expected = (np.array(self.table.to_tokens(), dtype=object)[index]
+                        .tolist())
+            self.assertEqual(typed(selected), typed(expected))
+
+    def test_compact_ngrams_slice(self):
+        ngrams = iotypes.NGrams(self.table)
+        self.assertEqual(typed(ngrams[1:3]), typed(list(self.tokens)[1:3]))
+        self.assertTrue(ngrams.has_valid_tail(
+            [tokens.HashtagToken('#Blessed')], case_sensitive=False))
+
+
+class CompactExamplesTest(unittest.TestCase):
+    def test_examples_read_compact(self):
+        text = iotypes.SvNgrams('what a GREAT day :) #sarcasm')
+        example = Example(Tweet(1, 2, text, 'en', False, None, None, False), 1)
+        line = json.dumps(ExampleSerializer.to_json(example))
+        read = ExampleDeserializer.deserialize(line)
+        self.assertTrue(read.point.text.is_compact())
+        self.assertEqual(typed(read.point.text), typed(text))
+        self.assertEqual(json.dumps(ExampleSerializer.to_json(read)), line)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,301 @@
+import random
+import threading
+import unittest
+
+from py4j.protocol import Py4JError, Py4JNetworkError
+
+from tokenization import tokenizers, tokens
+from tokenization.tokenizers import (
+    CasualStringTokenizer, CmuTaggerPool, EmojiMatcher, emoji_matcher,
+    negative_emojis, positive_emojis)
+
+
+def typed(tokens_: list) -> list:
+    return [(type(token), str.__str__(token)) for token in tokens_]
+
+
+class _StubCmuToken:
+    def __init__(self, tag, token):
+        self._tag = tag
+        self._token = token
+
+    def tag(self):
+        return self._tag
+
+    def token(self):
+        return self._token
+
+
+class StubCmuGateway:
+    """
+    Local stand-in for a tagger JVM gateway, implementing the batched
+    tagging wire format, and tokenizeAndTag, with tags derived from the
+    casual tokenizer. Without batched, it behaves like a tagger predating
+    tokenizeAndTagBatch. Its next nr_failures calls fail with a network
+    error, like a lost JVM.
+    """
+
+    def __init__(self, port=None, batched=True, nr_failures=0):
+        self.entry_point = self
+        self.port = port
+        self.closed = False
+        self.nr_calls = 0
+        self.nr_failures = nr_failures
+        self._batched = batched
+        self._tokenizer = tokenizers.CasualStringTokenizer()
+        self._type_to_tag = {
+            tokens.UrlToken: 'U',
+            tokens.AtToken: '@',
+            tokens.HashtagToken: '#',
+            tokens.PunctuationToken: ',',
+            tokens.PositiveEmojiToken: 'E',
+            tokens.NegativeEmojiToken: 'E',
+            tokens.WordToken: 'N'
+        }
+
+    def _call(self):
+        self.nr_calls += 1
+        if self.nr_failures > 0:
+            self.nr_failures -= 1
+            raise Py4JNetworkError('stub tagger on port {} is down'
+                                   .format(self.port))
+
+    def tag(self, tweet):
+        return [(self._type_to_tag[type(token)], str.__str__(token))
+                for token in self._tokenizer.tokenize(tweet)]
+
+    def expected_tokens(self, tweet):
+        return [tokenizers.cmu_tagset[tag](text)
+                for tag, text in self.tag(tweet)]
+
+    def tokenizeAndTag(self, tweet):
+        self._call()
+        return [_StubCmuToken(tag, text) for tag, text in self.tag(tweet)]
+
+    def tokenizeAndTagBatch(self, request):
+        self._call()
+        if not self._batched:
+            raise Py4JError('Method tokenizeAndTagBatch([class '
+                            'java.lang.String]) does not exist')
+        lines = []
+        for tweet in request.split(tokenizers.cmu_batch_tweet_sep):
+            tags, texts = zip(*self.tag(tweet)) if tweet else ((), ())
+            lines.append(''.join(tags) + tokenizers.cmu_batch_field_sep +
+                         tokenizers.cmu_batch_token_sep.join(texts))
+        return tokenizers.cmu_batch_tweet_sep.join(lines)
+
+    def close(self):
+        self.closed = True
+
+
+class StubConnector:
+    """
+    connect function for CmuTaggerPool, making StubCmuGateways and
+    remembering all of them. The first gateway of a port is made with the
+    arguments given for it in first_gateway_args, if any; all gateways of
+    down_ports fail every call.
+    """
+
+    def __init__(self, first_gateway_args: dict = None, down_ports=()):
+        self.gateways = []
+        self._first_gateway_args = dict(first_gateway_args or {})
+        self._down_ports = frozenset(down_ports)
+
+    def __call__(self, port):
+        gateway_args = self._first_gateway_args.pop(port, {})
+        if port in self._down_ports:
+            gateway_args = dict(gateway_args, nr_failures=float('inf'))
+        gateway = StubCmuGateway(port, **gateway_args)
+        self.gateways.append(gateway)
+        return gateway
+
+    def of_port(self, port):
+        return [gateway for gateway in self.gateways if gateway.port == port]
+
+
+def reference_search(s: str):
+    """
+    Leftmost-longest emoji of s, found by trying every emoji at every
+    position, negative ones first.
+    """
+    emojis = (
+        [(emoji, tokens.NegativeEmojiToken) for emoji in negative_emojis] +
+        [(emoji, tokens.PositiveEmojiToken) for emoji in positive_emojis])
+    for start in range(len(s)):
+        match = None
+        for emoji, token_type in emojis:
+            end = start + len(emoji)
+            if (end <= len(s) and
+                    all(c.lower() == e.lower()
+                        for c, e in zip(s[start:end], emoji)) and
+                    (match is None or end > match[1])):
+                match = (start, end, token_type)
+        if match is not None:
+            return match
+    return None
+
+
+class EmojiMatcherTest(unittest.TestCase):
+    def test_leftmost_longest(self):
+        self.assertEqual(emoji_matcher.search('a:-))))b'),
+                         (1, 7, tokens.PositiveEmojiToken))
+        self.assertEqual(emoji_matcher.search('x>:(y'),
+                         (1, 4, tokens.NegativeEmojiToken))
+        self.assertIsNone(emoji_matcher.search('plain'))
+
+    def test_case_insensitive(self):
+        self.assertEqual(emoji_matcher.search(':s'),
+                         (0, 2, tokens.NegativeEmojiToken))
+        self.assertEqual(emoji_matcher.search('dx'),
+                         (0, 2, tokens.NegativeEmojiToken))
+
+    def test_negative_first(self):
+        matcher = EmojiMatcher(positive=[':|'], negative=[':|'])
+        self.assertEqual(matcher.search(':|'),
+                         (0, 2, tokens.NegativeEmojiToken))
+        self.assertIs(matcher.polarity(':|'), tokens.NegativeEmojiToken)
+
+    def test_lowercase_changing_length(self):
+        # 'İ'.lower() is two characters long
+        self.assertEqual(emoji_matcher.search('İ:S'),
+                         (1, 3, tokens.NegativeEmojiToken))
+        self.assertEqual(emoji_matcher.search('İİDX'),
+                         (2, 4, tokens.NegativeEmojiToken))
+        for single_pass in [True, False]:
+            self.assertEqual(
+                typed(CasualStringTokenizer(single_pass)
+                      .tokenize('İ:S D=İ')),
+                [(tokens.NegativeEmojiToken, ':S'),
+                 (tokens.NegativeEmojiToken, 'D=')])
+
+    def test_matches_reference(self):
+        rnd = random.Random(0)
+        pieces = positive_emojis + negative_emojis + list('aDxSİ:-= ')
+        for _ in range(1000):
+            s = ''.join(piece.upper() if rnd.random() < 0.3 else piece
+                        for piece in rnd.choices(pieces, k=rnd.randint(1, 6)))
+            self.assertEqual(emoji_matcher.search(s), reference_search(s), s)
+
+    def test_every_emoji(self):
+        for emoji in positive_emojis + negative_emojis:
+            start, end, _ = emoji_matcher.search(emoji)
+            self.assertEqual((start, end), (0, len(emoji)), emoji)
+
+
+tweets = ['Oh GREAT, another Monday :) #blessed',
+          '@someone just LOVE it... http://t.co/x',
+          '',
+          'what a day D:'] * 5
+
+
+def random_tweets(nr_tweets: int, seed: int = 0) -> list:
+    """
+    Tweets of pieces that the casual tokenizer has to tell apart, glued
+    together or separated by spaces, in random cases.
+    """
+    rnd = random.Random(seed)
+    pieces = (positive_emojis + negative_emojis +
+              ['great', 'Monday', "don't", 'x2', '3.14', '...', '!!', ',',
+               '#blessed', '#', '@someone', '@', 'http://t.co/x',
+               'https://example.com/a?b=1', 'www.example.com', 'İ', 'é',
+               '’',
+               '-', '(', ')', ':', 'D', 'xx', '\n'])
+    strings = []
+    for _ in range(nr_tweets):
+        parts = []
+        for piece in rnd.choices(pieces, k=rnd.randint(0, 12)):
+            if rnd.random() < 0.3:
+                piece = piece.upper() if rnd.random() < 0.5 else piece.lower()
+            parts.append(piece)
+            parts.append(rnd.choice(['', ' ', ' ', '  ', '\t']))
+        strings.append(''.join(parts))
+    return strings
+
+
+class CasualStringTokenizerTest(unittest.TestCase):
+    def test_single_pass_matches_sequential(self):
+        single_pass = CasualStringTokenizer(single_pass=True)
+        sequential = CasualStringTokenizer(single_pass=False)
+        for tweet in tweets + random_tweets(3000):
+            self.assertEqual(typed(single_pass.tokenize(tweet)),
+                             typed(sequential.tokenize(tweet)), tweet)
+
+    def test_tokenize_many_on_workers(self):
+        tokenizer = CasualStringTokenizer()
+        strings = random_tweets(200, seed=1)
+        self.assertEqual(
+            list(map(typed, tokenizer.tokenize_many(strings, workers=2,
+                                                    chunksize=16))),
+            list(map(typed, map(tokenizer.tokenize, strings))))
+
+
+class CmuTaggerPoolTest(unittest.TestCase):
+    def expected(self, strings):
+        return [typed(StubCmuGateway().expected_tokens(s)) for s in strings]
+
+    def test_tokenize_many_preserves_order(self):
+        connect = StubConnector()
+        with CmuTaggerPool([1, 2, 3], batch_size=3, connect=connect) as pool:
+            self.assertEqual(list(map(typed, pool.tokenize_many(tweets))),
+                             self.expected(tweets))
+            self.assertEqual(typed(pool.tokenize(tweets[0])),
+                             self.expected(tweets[:1])[0])
+        self.assertTrue(all(gateway.closed for gateway in connect.gateways))
+
+    def test_reconnects_on_network_error(self):
+        connect = StubConnector({1: {'nr_failures': 1}})
+        with CmuTaggerPool([1], connect=connect) as pool:
+            self.assertEqual(list(map(typed, pool.tokenize_batch(tweets))),
+                             self.expected(tweets))
+        lost, reconnected = connect.of_port(1)
+        self.assertTrue(lost.closed)
+        self.assertEqual(lost.nr_calls, 1)
+        self.assertEqual(reconnected.nr_calls, 1)
+
+    def test_gives_up_after_one_retry(self):
+        connect = StubConnector(down_ports=[1])
+        with CmuTaggerPool([1], connect=connect) as pool:
+            with self.assertRaises(Py4JNetworkError):
+                pool.tokenize_batch(tweets)
+            self.assertEqual(len(connect.of_port(1)), 2)
+            # The connection is idle again, for later batches
+            self.assertEqual(pool._idle_connections.qsize(), 1)
+
+    def test_falls_back_to_per_tweet_tagging(self):
+        connect = StubConnector({1: {'batched': False}})
+        with CmuTaggerPool([1], batch_size=4, connect=connect) as pool:
+            self.assertEqual(list(map(typed, pool.tokenize_many(tweets))),
+                             self.expected(tweets))
+        gateway, = connect.of_port(1)
+        # One failed batch call, then one call per tweet
+        self.assertEqual(gateway.nr_calls, 1 + len(tweets))
+
+    def test_check_health_reconnects(self):
+        connect = StubConnector({1: {'nr_failures': 1}}, down_ports=[2])
+        with CmuTaggerPool([1, 2, 3], connect=connect) as pool:
+            self.assertEqual(pool.check_health(), [2])
+            self.assertEqual(len(connect.of_port(1)), 2)
+            self.assertEqual(len(connect.of_port(2)), 2)
+            self.assertEqual(len(connect.of_port(3)), 1)
+            self.assertEqual(pool.check_health(), [2])
+            self.assertEqual(len(connect.of_port(1)), 2)
+            self.assertEqual(len(connect.of_port(2)), 3)
+
+    def test_check_health_skips_busy_connections(self):
+        connect = StubConnector()
+        with CmuTaggerPool([1, 2, 3], connect=connect) as pool:
+            busy = pool._idle_connections.get()
+            checker = threading.Thread(target=pool.check_health)
+            checker.start()
+            checker.join(timeout=5)
+            self.assertFalse(checker.is_alive())
+            for port, (gateway,) in ((port, connect.of_port(port))
+                                     for port in [1, 2, 3]):
+                self.assertEqual(gateway.nr_calls,
+                                 0 if port == busy.port else 1)
+            pool._idle_connections.put(busy)
+            self.assertEqual(pool._idle_connections.qsize(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,20 @@
+import logging
+import multiprocessing
+import queue
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Iterable, Iterator
+
 from py4j.java_gateway import JavaGateway, GatewayParameters
-from nltk.corpus import cmudict
+from py4j.protocol import Py4JError, Py4JNetworkError
 
+from basic.ditertools import ichunks
+from tokenization import syllables
 from tokenization.tokens import *
 
-
-en_dict = cmudict.dict()
+logger = logging.getLogger('tokenization.tokenizers')
 
 positive_emojis = [
     ':-]', ':]', ':-3', ':3', ':->', ':>',  # smileys
@@ -63,6 +72,98 @@ regex_string = '{}|{}|{}|{}|{}|{}|{}'.format(
     word_regex, hashtag_regex,
     positive_emojis_regex, negative_emojis_regex)
 
+
+def _lower_char(c: str) -> str:
+    lowered = c.lower()
+    return lowered if len(lowered) == 1 else c
+
+
+class EmojiMatcher:
+    """
+    Trie over emoji and emoticon strings, built once, with leftmost-longest,
+    case-insensitive matching (like the emoji regexes) and hashed polarity
+    lookup, so that matching does not get slower as the lists grow.
+    """
+    _end = ''
+
+    def __init__(self, positive: Iterable[str], negative: Iterable[str]):
+        self._root = {}
+        self._polarity = {}
+        for emojis, token_type in ((negative, NegativeEmojiToken),
+                                   (positive, PositiveEmojiToken)):
+            for emoji in emojis:
+                self._polarity.setdefault(emoji, token_type)
+                node = self._root
+                for c in emoji.lower():
+                    node = node.setdefault(c, {})
+                node.setdefault(EmojiMatcher._end, token_type)
+        self._first_chars = frozenset(self._root)
+
+    def polarity(self, s: str):
+        """Token type of an exact emoji string, or None if it is unknown."""
+        return self._polarity.get(s)
+
+    def search(self, s: str):
+        """
+        (start, end, token type) of the leftmost-longest emoji in s,
+        or None if there is none.
+        """
+        lowered = s.lower()
+        if len(lowered) != len(s):
+            # Some characters, eg. 'İ', lowercase to several, which would
+            # shift the offsets of the emojis after them
+            lowered = ''.join(_lower_char(c) for c in s)
+        if self._first_chars.isdisjoint(lowered):
+            return None
+        end_key = EmojiMatcher._end
+        nr_chars = len(lowered)
+        for start in range(nr_chars):
+            node = self._root.get(lowered[start])
+            match = None
+            end = start + 1
+            while node is not None:
+                token_type = node.get(end_key)
+                if token_type is not None:
+                    match = (start, end, token_type)
+                if end == nr_chars:
+                    break
+                node = node.get(lowered[end])
+                end += 1
+            if match is not None:
+                return match
+        return None
+
+
+emoji_matcher = EmojiMatcher(positive_emojis, negative_emojis)
+
+# Single-pass variant of the per-chunk searches done by
+# CasualStringTokenizer._str_to_token. Every alternative starts at a chunk
+# boundary, skips lazily to its leftmost match within the chunk and the
+# trailing \S* swallows the rest of the chunk, so alternatives are tried in
+# the same precedence order as the sequential searches. Chunks that match
+# none of them are left to emoji_matcher and then to word_regex. The URL
+# alternative is bounded by any whitespace so that the pattern can also run
+# over a whole tweet.
+casual_token_regexes = [
+    ('url', 'http[s]?:\\S+'),
+    ('at', at_regex),
+    ('hashtag', hashtag_regex),
+    ('punctuation', punctuation_regex)
+]
+# Fast path for the common case: a chunk that is one whole word cannot match
+# any of the alternatives above, unless it contains a word-like emoji (eg. DX).
+word_char_regex = "[a-zA-Z0-9_'-]"
+word_like_emojis_regex = '|'.join(
+    re.escape(e) for e in positive_emojis + negative_emojis
+    if re.fullmatch(word_char_regex + '+', e))
+plain_word_regex = '(?!{}*?(?:{})){}(?!\\S)'.format(
+    word_char_regex, word_like_emojis_regex, word_regex)
+single_pass_regex_string = \
+    '(?<!\\S)(?:(?P<plain_word>{})|{}|(?P<other>\\S+))\\S*'.format(
+        plain_word_regex,
+        '|'.join('\\S*?(?P<{}>{})'.format(name, regex)
+                 for name, regex in casual_token_regexes))
+
 generic_stopwords = ['', 'null']
 regex_stopwords = ['https?://t.co', '…', '^https?:/?/?(.*\.|)$']
 regex_stopwords = [re.compile(r, re.IGNORECASE) for r in regex_stopwords]
@@ -85,10 +186,42 @@ def split(string,
     return r
 
 
+def _pool_imap(f, strings, workers, chunksize):
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap(f, strings, chunksize)
+
+
 class StringTokenizer:
     def tokenize(self, s: str) -> list:
         raise NotImplementedError
 
+    def config(self) -> str:
+        """
+        Identifies the tokenizer and the version of its output, eg. as part
+        of cache keys. Tokenizers that produce the same tokens for the same
+        string share a config; change it whenever the output changes.
+        """
+        return self.__class__.__name__
+
+    def _pool_tokenizer(self):
+        """
+        Picklable callable that tokenizes one string inside a worker process,
+        or None if this tokenizer can only run in the current process.
+        """
+        return None
+
+    def tokenize_many(self, strings: Iterable[str], workers: int = 1,
+                      chunksize: int = 256) -> Iterator[list]:
+        """
+        Tokenize every string, preserving order. With workers > 1 (or None,
+        for one worker per core) strings are sent to a process pool in chunks
+        of chunksize; tokenizers without a pool implementation run serially.
+        """
+        pool_tokenizer = self._pool_tokenizer()
+        if pool_tokenizer is None or (workers is not None and workers <= 1):
+            return map(self.tokenize, strings)
+        return _pool_imap(pool_tokenizer, strings, workers, chunksize)
+
 
 class CasualStringTokenizer(StringTokenizer):
     class __CasualStringTokenizer(StringTokenizer):
@@ -98,8 +231,31 @@ class CasualStringTokenizer(StringTokenizer):
             self._hashtag_regex = re.compile(hashtag_regex, re.IGNORECASE)
             self._punctuation_regex = re.compile(punctuation_regex, re.IGNORECASE)
             self._word_regex = re.compile(word_regex, re.IGNORECASE)
-            self._positive_emojis_regex = re.compile(positive_emojis_regex, re.IGNORECASE)
-            self._negative_emojis_regex = re.compile(negative_emojis_regex, re.IGNORECASE)
+            self._single_pass_regex = re.compile(
+                single_pass_regex_string, re.IGNORECASE)
+            group_to_token_type = {
+                'url': UrlToken,
+                'at': AtToken,
+                'hashtag': HashtagToken,
+                'punctuation': PunctuationToken,
+                'plain_word': WordToken,
+                'other': None
+            }
+            self._group_index_to_token_type = {
+                idx: group_to_token_type[name] for name, idx
+                in self._single_pass_regex.groupindex.items()}
+
+        def _emoji_or_word_token(self, s):
+            emoji_match = emoji_matcher.search(s)
+            if emoji_match is not None:
+                start, end, token_type = emoji_match
+                return token_type(s[start:end])
+
+            word_match = self._word_regex.search(s)
+            if word_match is not None:
+                return WordToken(word_match.group())
+
+            return None
 
         def _str_to_token(self, s):
             url_match = self._url_regex.search(s)
@@ -118,19 +274,7 @@ class CasualStringTokenizer(StringTokenizer):
             if punctuation_match is not None:
                 return PunctuationToken(punctuation_match.group())
 
-            positive_emojis_match = self._positive_emojis_regex.search(s)
-            if positive_emojis_match is not None:
-                return PositiveEmojiToken(positive_emojis_match.group())
-
-            negative_emojis_match = self._negative_emojis_regex.search(s)
-            if negative_emojis_match is not None:
-                return NegativeEmojiToken(negative_emojis_match.group())
-
-            word_match = self._word_regex.search(s)
-            if word_match is not None:
-                return WordToken(word_match.group())
-
-            return None
+            return self._emoji_or_word_token(s)
 
         def tokenize(self, s):
             str_tokens = split(s)
@@ -138,19 +282,42 @@ class CasualStringTokenizer(StringTokenizer):
             valid_tokens = [s for s in tokens if s is not None]
             return valid_tokens
 
+        # Chunks follow a heavy-tailed distribution across tweets, so each
+        # distinct chunk is matched once and its (immutable) token reused.
+        @lru_cache(maxsize=262144)
+        def _chunk_to_token(self, chunk):
+            m = self._single_pass_regex.match(chunk)
+            token_type = self._group_index_to_token_type[m.lastindex]
+            if token_type is None:
+                return self._emoji_or_word_token(chunk)
+            return token_type(m.group(m.lastindex))
+
+        def tokenize_single_pass(self, s):
+            return [token for token in map(self._chunk_to_token, s.split())
+                    if token is not None]
+
     instance = None
 
-    def __init__(self):
+    def __init__(self, single_pass=True):
         if not CasualStringTokenizer.instance:
                 CasualStringTokenizer.instance =\
                     CasualStringTokenizer.__CasualStringTokenizer()
+        self._single_pass = single_pass
 
     def __getattr__(self, name):
         return getattr(self.instance, name)
 
     def tokenize(self, s):
+        if self._single_pass:
+            return CasualStringTokenizer.instance.tokenize_single_pass(s)
         return CasualStringTokenizer.instance.tokenize(s)
 
+    def _pool_tokenizer(self):
+        return partial(_casual_tokenize, self._single_pass)
+
+    def config(self):
+        return 'casual/2'
+
 
 class SpaceStringTokenizer(StringTokenizer):
     instance = None
@@ -166,6 +333,12 @@ class SpaceStringTokenizer(StringTokenizer):
     def tokenize(self, s):
         return self.instance.tokenize(s)
 
+    def _pool_tokenizer(self):
+        return _space_tokenize
+
+    def config(self):
+        return 'space/1'
+
     class __SpaceStringTokenizer(StringTokenizer):
         def __init__(self):
             pass
@@ -174,16 +347,151 @@ class SpaceStringTokenizer(StringTokenizer):
             return split(s, empty_entries_allowed=False)
 
 
+def _casual_tokenize(single_pass, s):
+    return CasualStringTokenizer(single_pass).tokenize(s)
+
+
+def _space_tokenize(s):
+    return SpaceStringTokenizer().tokenize(s)
+
+
+def _identify_emoji(s):
+    token_type = emoji_matcher.polarity(s)
+    if token_type is None:
+        token_type = EmojiToken
+    return token_type(s)
+
+
+cmu_tagset = {
+    'N': CommonNounToken,
+    'O': PersonalPronounToken,
+    '^': ProperNounToken,
+    'S': NominalAndPossessiveToken,
+    'Z': ProperNounAndPossessiveToken,
+    'V': VerbToken,
+    'L': NominalAndVerbalToken,
+    'M': ProperNounAndVerbalToken,
+    'A': AdjectiveToken,
+    'R': AdverbToken,
+    '!': InterjectionToken,
+    'D': DeterminerToken,
+    'P': PreOrPostPositionOrSubordinatingConjunctionToken,
+    '&': CoordinatingConjunctionToken,
+    'T': VerbParticleToken,
+    'X': ExistentialOrPredeterminersToken,
+    'Y': ExistentialOrPredeterminersAndVerbalToken,
+    '#': HashtagToken,
+    '@': AtToken,
+    '~': DiscourseMarkerToken,
+    'U': UrlOrEmailToken,
+    'E': _identify_emoji,
+    '$': NumeralToken,
+    ',': PunctuationToken,
+    'G': OtherToken
+}
+
+# Wire format of the batched tagging call, tokenizeAndTagBatch. The request
+# is a single string with one tweet per line. The response is a single string
+# with one line per tweet, holding the concatenated one-character CMU tags, a
+# tab, and then the tokens separated by single spaces (the CMU tokenizer
+# never produces tokens that contain whitespace). py4j passes strings by
+# value, so a whole batch costs one round trip, whereas every access to a
+# returned Java object or array is a round trip of its own.
+cmu_batch_tweet_sep = '\n'
+cmu_batch_field_sep = '\t'
+cmu_batch_token_sep = ' '
+cmu_batch_line_breaks = re.compile('[\r\n]')
+
+
+def cmu_batch_request(strings):
+    return cmu_batch_tweet_sep.join(
+        cmu_batch_line_breaks.sub(' ', s) for s in strings)
+
+
+def cmu_batch_response_to_tokens(response, nr_strings):
+    lines = response.split(cmu_batch_tweet_sep)
+    assert len(lines) == nr_strings, \
+        'tagger returned {} lines for {} tweets'.format(len(lines), nr_strings)
+    result = []
+    for line in lines:
+        tags, text = line.split(cmu_batch_field_sep, 1)
+        result.append([cmu_tagset[tag](s) for tag, s
+                       in zip(tags, text.split(cmu_batch_token_sep))])
+    return result
+
+
+def cmu_tag_batch(entry_point, strings):
+    """
+    Tokens of strings from a single tokenizeAndTagBatch call, or None if the
+    tagger has no such method, eg. a tagger server predating it.
+    """
+    try:
+        response = entry_point.tokenizeAndTagBatch(cmu_batch_request(strings))
+    except Py4JNetworkError:
+        raise
+    except Py4JError as e:
+        if 'does not exist' not in str(e):
+            raise
+        return None
+    except AttributeError:
+        return None
+    return cmu_batch_response_to_tokens(response, len(strings))
+
+
+def cmu_tag_each(entry_point, strings):
+    """
+    Tokens of strings from one tokenizeAndTag call per string, which every
+    tagger server has.
+    """
+    return [[cmu_tagset[cmu_token.tag()](cmu_token.token())
+             for cmu_token in entry_point.tokenizeAndTag(s)]
+            for s in strings]
+
+
+class CmuBatchTagger:
+    """
+    Tags batches with tokenizeAndTagBatch while the tagger has it, falling
+    back to tokenizeAndTag per string for good once it turns out not to.
+    """
+
+    def __init__(self):
+        self._batched = True
+
+    def tag_batch(self, entry_point, strings, port):
+        if len(strings) == 0:
+            return []
+        if self._batched:
+            result = cmu_tag_batch(entry_point, strings)
+            if result is not None:
+                return result
+            logger.warning('[CmuBatchTagger] Tagger on port {} has no '
+                           'tokenizeAndTagBatch, tagging one tweet at a time'
+                           .format(port))
+            self._batched = False
+        return cmu_tag_each(entry_point, strings)
+
+
+def connect_java_gateway(port):
+    gateway_param = GatewayParameters(port=port)
+    return JavaGateway(gateway_parameters=gateway_param)
+
+
 class CmuStringTokenizer(StringTokenizer):
     instance = None
 
-    def __init__(self, port):
+    def __init__(self, port, batch_size=512):
         if not CmuStringTokenizer.instance:
             CmuStringTokenizer.instance =\
                 CmuStringTokenizer.__CmuStringTokenizer(port)
-        else:
+        elif CmuStringTokenizer.instance.port != port:
+            logger.warning('[CmuStringTokenizer] Replacing the tagger on port '
+                           '{} with the one on port {}, for all instances. '
+                           'Use CmuTaggerPool to tag with several taggers.'
+                           .format(CmuStringTokenizer.instance.port, port))
             CmuStringTokenizer.instance._tagger =\
                 CmuStringTokenizer.instance.get_java_tagger(port)
+            CmuStringTokenizer.instance.port = port
+        self._batch_size = batch_size
 
     def __getattr__(self, name):
         return getattr(self.instance, name)
@@ -191,50 +499,31 @@ class CmuStringTokenizer(StringTokenizer):
     def tokenize(self, s):
         return CmuStringTokenizer.instance.tokenize(s)
 
+    def config(self):
+        return 'cmu/1'
+
+    def tokenize_many(self, strings, workers=1, chunksize=None):
+        """
+        Tag strings in batches of chunksize (by default, the batch_size this
+        tokenizer was created with), one tokenizeAndTagBatch call per batch
+        if the tagger has it (see CmuBatchTagger).
+        The gateway cannot be shared with worker processes, so workers is
+        ignored.
+        """
+        if chunksize is None:
+            chunksize = self._batch_size
+        for batch in ichunks(chunksize, strings):
+            yield from CmuStringTokenizer.instance.tokenize_batch(batch)
+
     class __CmuStringTokenizer(StringTokenizer):
         def __init__(self, port):
+            self.port = port
             self._tagger = self.get_java_tagger(port)
-            self._cmu_tagset = {
-                'N': CommonNounToken,
-                'O': PersonalPronounToken,
-                '^': ProperNounToken,
-                'S': NominalAndPossessiveToken,
-                'Z': ProperNounAndPossessiveToken,
-                'V': VerbToken,
-                'L': NominalAndVerbalToken,
-                'M': ProperNounAndVerbalToken,
-                'A': AdjectiveToken,
-                'R': AdverbToken,
-                '!': InterjectionToken,
-                'D': DeterminerToken,
-                'P': PreOrPostPositionOrSubordinatingConjunctionToken,
-                '&': CoordinatingConjunctionToken,
-                'T': VerbParticleToken,
-                'X': ExistentialOrPredeterminersToken,
-                'Y': ExistentialOrPredeterminersAndVerbalToken,
-                '#': HashtagToken,
-                '@': AtToken,
-                '~': DiscourseMarkerToken,
-                'U': UrlOrEmailToken,
-                'E': self._identify_emoji,
-                '$': NumeralToken,
-                ',': PunctuationToken,
-                'G': OtherToken
-            }
-
-        def _identify_emoji(self, s):
-            if s in negative_emojis:
-                return NegativeEmojiToken(s)
-            elif s in positive_emojis:
-                return PositiveEmojiToken(s)
-            else:
-                return EmojiToken(s)
+            self._cmu_tagset = cmu_tagset
+            self._batch_tagger = CmuBatchTagger()
 
         def get_java_tagger(self, port):
-            gateway_param = GatewayParameters(port=port)
-            gateway = JavaGateway(gateway_parameters=gateway_param)
-            tagger = gateway.entry_point
-            return tagger
+            return connect_java_gateway(port).entry_point
 
         def _cmu_token_to_token(self, cmu_token):
             tag = cmu_token.tag()
@@ -246,12 +535,137 @@ class CmuStringTokenizer(StringTokenizer):
             tokens = [self._cmu_token_to_token(ct) for ct in cmu_tokens]
             return tokens
 
+        def tokenize_batch(self, strings):
+            return self._batch_tagger.tag_batch(self._tagger, strings,
+                                                self.port)
+
+
+class CmuTaggerConnection:
+    """
+    A gateway to one tagger JVM. connect(port) must return an object with an
+    entry_point and a close() method, like JavaGateway does, so that a local
+    stand-in gateway can take the place of the JVM.
+    """
+
+    def __init__(self, port, connect=connect_java_gateway):
+        self.port = port
+        self._connect = connect
+        self._gateway = connect(port)
+        self._batch_tagger = CmuBatchTagger()
+
+    def reconnect(self):
+        self.close()
+        self._gateway = self._connect(self.port)
+
+    def close(self):
+        try:
+            self._gateway.close()
+        except Py4JError as e:
+            logger.info('[CmuTaggerConnection] Error closing gateway on port '
+                        '{}: {}'.format(self.port, e))
+
+    def is_healthy(self):
+        try:
+            self.tokenize_batch([''])
+            return True
+        except Py4JError:
+            return False
+
+    def tokenize_batch(self, strings):
+        return self._batch_tagger.tag_batch(self._gateway.entry_point,
+                                            strings, self.port)
+
+
+class CmuTaggerPool(StringTokenizer):
+    """
+    Spreads tagging over several tagger JVMs, one per port, from a thread
+    pool with one thread per connection. A connection that fails with a
+    network error is reconnected and the batch is retried once on it.
+    """
+
+    def __init__(self, ports, batch_size=512, connect=connect_java_gateway):
+        self._batch_size = batch_size
+        self._connections = [CmuTaggerConnection(port, connect)
+                             for port in ports]
+        self._idle_connections = queue.Queue()
+        for connection in self._connections:
+            self._idle_connections.put(connection)
+        self._executor = ThreadPoolExecutor(len(self._connections))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+        for connection in self._connections:
+            connection.close()
+
+    def check_health(self):
+        """
+        Ping every connection idle at the time of the call, reconnecting the
+        ones that do not answer, without waiting for the busy ones. Returns
+        the ports of the connections that are still unhealthy.
+        """
+        idle_connections = []
+        while True:
+            try:
+                idle_connections.append(self._idle_connections.get_nowait())
+            except queue.Empty:
+                break
+        unhealthy_ports = []
+        try:
+            for connection in idle_connections:
+                if not connection.is_healthy():
+                    logger.warning('[CmuTaggerPool] Tagger on port {} is not '
+                                   'responding, reconnecting'
+                                   .format(connection.port))
+                    connection.reconnect()
+                    if not connection.is_healthy():
+                        unhealthy_ports.append(connection.port)
+        finally:
+            for connection in idle_connections:
+                self._idle_connections.put(connection)
+        return unhealthy_ports
+
+    def tokenize_batch(self, strings):
+        connection = self._idle_connections.get()
+        try:
+            try:
+                return connection.tokenize_batch(strings)
+            except Py4JNetworkError as e:
+                logger.warning('[CmuTaggerPool] Lost tagger on port {} ({}), '
+                               'reconnecting'.format(connection.port, e))
+                connection.reconnect()
+                return connection.tokenize_batch(strings)
+        finally:
+            self._idle_connections.put(connection)
+
+    def tokenize(self, s):
+        return self.tokenize_batch([s])[0]
+
+    def config(self):
+        return 'cmu/1'
+
+    def tokenize_many(self, strings, workers=None, chunksize=None):
+        """
+        Tag strings in batches of chunksize (by default, the pool batch_size),
+        spread over all connections, preserving order. At most two batches
+        per connection are in flight at any time; workers is ignored.
+        """
+        if chunksize is None:
+            chunksize = self._batch_size
+        max_in_flight = 2 * len(self._connections)
+        in_flight = deque()
+        for batch in ichunks(chunksize, strings):
+            in_flight.append(self._executor.submit(self.tokenize_batch, batch))
+            if len(in_flight) >= max_in_flight:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
 
 def nltk_count_syllables(word):
-    try:
-        hyphenation = en_dict[word.lower()]
-        counts = [len(list(y for y in x if y[-1].isdigit()))
-                  for x in hyphenation]
-        return max(counts)
-    except KeyError:
-        return 0
+    return syllables.count_syllables(word)
@@ -1,3 +1,6 @@
+from itertools import count
+
+
 class Token(str):
     def __new__(cls, str_):
         return super(Token, cls).__new__(cls, str_)
@@ -6,7 +9,7 @@ class Token(str):
         return type(self) is type(other) and str.__eq__(self, other)
 
     def __hash__(self):
-        return hash(self.__class__.__name__ + str(self))
+        return hash((self.__class__, str.__hash__(self)))
 
     def eq(self, other, case_sensitive=True):
         if case_sensitive:
@@ -99,3 +102,10 @@ all_token_types = [
     OtherToken,
     WordToken
 ]
+
+# Compact, integer encoding of token types, eg. for tokenization.compact
+token_type_codes = dict(zip(all_token_types, count()))
+
+
+def token_type_code(token: Token) -> int:
+    return token_type_codes[type(token)]